@@ -6,6 +6,18 @@ from app.routes.loans import loans_bp
 from app.routes.users import users_bp
 from app.routes.auth import auth_bp
 from app.extension import db, cache
+from app.utils.search import init_search
+from app.utils.swr_cache import SWR_METRICS
+from app.utils.rollups import rebuild_rollups_command, fold_loan_stats_command
+from app.utils.archive import archive_loans_command
+from app.utils.refresh_tokens import purge_refresh_tokens_command
+from app.utils.principal_cache import init_principal_cache
+from app.utils.revocation import init_revocation
+from app.utils.token_cache import init_token_cache
+from app.utils.hashing import init_hashing
+from app.utils.rate_limit import init_rate_limit
+from app.utils.auth_middleware import init_auth
+from app.utils.schema import ensure_schema
 import os
 
 def create_app(config_name=None):
@@ -37,8 +49,15 @@ def create_app(config_name=None):
         
     @app.route("/cache")
     def debug_cache():
-        print("CACHE hiện tại:", cache.cache._cache)
-        return {"cache": list(cache.cache._cache.keys())}
+        # Chỉ SimpleCache liệt kê được key trong process
+        keys = list(getattr(cache.cache, "_cache", {}).keys())
+        print("CACHE hiện tại:", keys)
+        return {"cache": keys, "swr": SWR_METRICS,
+                "principal": app.extensions["principal_cache"].stats(),
+                "revocation": app.extensions["revocation"].report(),
+                "verified_tokens": app.extensions["token_cache"].stats(),
+                "hashing": app.extensions["hashing"].report(),
+                "rate_limit": app.extensions["rate_limiter"].report()}
 
     # CORS và Config
     CORS(app)
@@ -50,12 +69,21 @@ def create_app(config_name=None):
         # Default: load từ config.Config
         app.config.from_object('config.Config')
          
-    app.config['CACHE_TYPE'] = 'SimpleCache'
-    app.config['CACHE_DEFAULT_TIMEOUT'] = 300
+    # Cache lấy từ config (CACHE_TYPE, CACHE_REDIS_URL...), mặc định SimpleCache
+    app.config.setdefault('CACHE_TYPE', 'SimpleCache')
+    app.config.setdefault('CACHE_DEFAULT_TIMEOUT', 300)
     
     # Init extension
     db.init_app(app)
     cache.init_app(app)
+    init_search(app)
+    init_principal_cache(app)
+    init_revocation(app)
+    init_token_cache(app)
+    init_hashing(app)
+    # Rate limit chạy trước xác thực: request bị chặn không tốn DB/decode
+    init_rate_limit(app)
+    init_auth(app)
     
     # Register blueprints
     app.register_blueprint(auth_bp, url_prefix='/auth')
@@ -63,8 +91,16 @@ def create_app(config_name=None):
     app.register_blueprint(loans_bp, url_prefix='/loans')
     app.register_blueprint(users_bp, url_prefix='/users')
     
+    # CLI: flask rebuild-rollups, flask fold-loan-stats, flask archive-loans, flask purge-refresh-tokens
+    app.cli.add_command(rebuild_rollups_command)
+    app.cli.add_command(fold_loan_stats_command)
+    app.cli.add_command(archive_loans_command)
+    app.cli.add_command(purge_refresh_tokens_command)
+    
     with app.app_context():
         if not app.config.get('TESTING', False):
             db.create_all()
+            # create_all không thêm cột/index mới vào bảng đã tồn tại
+            ensure_schema()
         
     return app
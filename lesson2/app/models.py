@@ -1,4 +1,4 @@
-from datetime import date
+from datetime import date, datetime
 from app.extension import db
 
 class Book(db.Model):
@@ -8,8 +8,20 @@ class Book(db.Model):
     title = db.Column(db.String, nullable=False)
     author = db.Column(db.String)
     is_available = db.Column(db.Boolean, default=True)
+    
+    # Validators cho conditional GET: tự tăng/cập nhật mỗi lần UPDATE dòng này.
+    # row_version tăng trong chính câu UPDATE (không dùng version_id_col: ghi đồng thời không bị StaleDataError)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    row_version = db.Column(db.Integer, nullable=False, default=1,
+                            onupdate=db.literal_column("row_version") + 1)
 
     loans = db.relationship("Loan", back_populates="book")
+
+    # Index phục vụ keyset pagination theo (title, id) và (author, id)
+    __table_args__ = (
+        db.Index("ix_books_title_id", title, id),
+        db.Index("ix_books_author_id", db.func.coalesce(author, ""), id),
+    )
     
 class User(db.Model):
     __tablename__ = "users"
@@ -34,4 +46,85 @@ class Loan(db.Model):
     return_date = db.Column(db.Date)
 
     book = db.relationship("Book", back_populates="loans")
-    user = db.relationship("User", back_populates="loans")
\ No newline at end of file
+    user = db.relationship("User", back_populates="loans")
+    
+    # Index cho filter theo user/book và keyset pagination theo (checkout_date, loan_id)
+    # ix_loans_active_checkout_date là partial index chỉ chứa loan chưa trả (cho /loans/overdue),
+    # ix_loans_return_date để job archive tìm loan đã trả lâu
+    __table_args__ = (
+        db.Index("ix_loans_user_id", user_id),
+        db.Index("ix_loans_book_id", book_id),
+        db.Index("ix_loans_checkout_date_id", checkout_date, loan_id),
+        db.Index("ix_loans_active_checkout_date", checkout_date, loan_id,
+                 postgresql_where=return_date.is_(None), sqlite_where=return_date.is_(None)),
+        db.Index("ix_loans_return_date", return_date),
+    )
+
+# Loan đã trả lâu được job archive chuyển sang đây (giữ nguyên loan_id),
+# bảng loans chỉ còn working set: loan đang mượn và loan mới trả
+class LoanArchive(db.Model):
+    __tablename__ = "loans_archive"
+
+    loan_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    book_id = db.Column(db.Integer)
+    user_id = db.Column(db.Integer)
+    checkout_date = db.Column(db.Date, nullable=False)
+    return_date = db.Column(db.Date, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_loans_archive_user_id", user_id),
+        db.Index("ix_loans_archive_book_id", book_id),
+    )
+
+# Rollup theo ngày cho /loans/stats, được cập nhật cộng dồn trong cùng transaction
+# với write path của loans (app/utils/rollups.py), rebuild lại được từ bảng loans
+class LoanDailyStat(db.Model):
+    __tablename__ = "loan_daily_stats"
+
+    day = db.Column(db.Date, primary_key=True)
+    checkouts = db.Column(db.Integer, nullable=False, default=0)
+    returns = db.Column(db.Integer, nullable=False, default=0)
+    # Tổng số ngày mượn của các loan được trả trong ngày -> thời gian mượn trung bình
+    loan_days = db.Column(db.Integer, nullable=False, default=0)
+
+# Delta chưa gộp của loan_daily_stats: write path chỉ INSERT dòng mới, không khóa dòng chung của ngày.
+# `flask fold-loan-stats` gộp định kỳ vào loan_daily_stats, lúc đọc cộng cả hai bảng
+class LoanStatDelta(db.Model):
+    __tablename__ = "loan_stat_deltas"
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    checkouts = db.Column(db.Integer, nullable=False, default=0)
+    returns = db.Column(db.Integer, nullable=False, default=0)
+    loan_days = db.Column(db.Integer, nullable=False, default=0)
+
+class BookDailyStat(db.Model):
+    __tablename__ = "book_daily_stats"
+
+    day = db.Column(db.Date, primary_key=True)
+    book_id = db.Column(db.Integer, primary_key=True)
+    checkouts = db.Column(db.Integer, nullable=False, default=0)
+
+class UserDailyStat(db.Model):
+    __tablename__ = "user_daily_stats"
+
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True)
+    checkouts = db.Column(db.Integer, nullable=False, default=0)
+
+# Mỗi phiên đăng nhập (family refresh token) một dòng, chỉ giữ jti của refresh token hiện hành.
+# Xoay vòng / phát hiện dùng lại là một UPDATE có điều kiện (app/utils/refresh_tokens.py)
+class RefreshTokenFamily(db.Model):
+    __tablename__ = "refresh_token_families"
+
+    family_id = db.Column(db.String(36), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    current_jti = db.Column(db.String(36), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    revoked = db.Column(db.Boolean, nullable=False, default=False)
+
+    __table_args__ = (
+        db.Index("ix_refresh_token_families_user_id", user_id),
+        db.Index("ix_refresh_token_families_expires_at", expires_at),
+    )
@@ -1,90 +1,33 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, g, jsonify, request
 from app.models import User
-from app.extension import db, cache
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.extension import db
 import jwt
 import datetime
-from functools import wraps
 from config import Config
 import uuid
+from app.utils.auth_middleware import require
+from app.utils.principal_cache import invalidate_principal
+from app.utils.revocation import revoke_token
+from app.utils.refresh_tokens import (
+    start_family, rotate_family, revoke_reused_family, revoke_family, revoke_user_families
+)
+from app.utils.token_cache import decode_token
+from app.utils.hashing import HashingBusy, get_hashing
 
 auth_bp = Blueprint("auth", __name__)
 
-def token_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        
-        if not token:
-            return jsonify({"error": "Cần đăng nhập"}), 401
-        
-        try:
-            if token.startswith('Bearer '):
-                token = token[7:]
-            
-            data = jwt.decode(token, Config.SECRET_KEY, algorithms=["HS256"])
-            
-            # MỚI: Kiểm tra xem token có trong blacklist không
-            jti = data.get('jti')
-            if jti:
-                blacklisted = cache.get(f"blacklist:{jti}")
-                if blacklisted:
-                    return jsonify({"error": "Token đã bị vô hiệu hóa"}), 401
-            
-            current_user = User.query.get(data['user_id'])
-            if data.get("token_version") != current_user.token_version:
-                return jsonify({"error": "Token đã cũ, vui lòng đăng nhập lại"}), 401
-            if not current_user:
-                return jsonify({"error": "User không tồn tại"}), 401
-                
-        except jwt.ExpiredSignatureError:
-            return jsonify({"error": "Token đã hết hạn"}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({"error": "Token không hợp lệ"}), 401
-        
-        return f(current_user, *args, **kwargs)
-    
-    return decorated
-
+@auth_bp.errorhandler(HashingBusy)
+def hashing_busy(error):
+    """Pool hash mật khẩu quá tải: từ chối nhanh thay vì giữ worker"""
+    response = jsonify({"error": "Hệ thống đang bận, vui lòng thử lại sau"})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
 
-def admin_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        
-        if not token:
-            return jsonify({"error": "Cần đăng nhập"}), 401
-        
-        try:
-            if token.startswith('Bearer '):
-                token = token[7:]
-            
-            data = jwt.decode(token, Config.SECRET_KEY, algorithms=["HS256"])
-            
-            # MỚI: Kiểm tra blacklist
-            jti = data.get('jti')
-            if jti:
-                blacklisted = cache.get(f"blacklist:{jti}")
-                if blacklisted:
-                    return jsonify({"error": "Token đã bị vô hiệu hóa"}), 401
-            
-            current_user = User.query.get(data['user_id'])
-            
-            if not current_user:
-                return jsonify({"error": "User không tồn tại"}), 401
-            
-            # Kiểm tra quyền admin
-            if current_user.role != "admin":
-                return jsonify({"error": "Bạn không có quyền thực hiện hành động này"}), 403
-                
-        except jwt.ExpiredSignatureError:
-            return jsonify({"error": "Token đã hết hạn"}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({"error": "Token không hợp lệ"}), 401
-        
-        return f(current_user, *args, **kwargs)
-    
-    return decorated
+# Xác thực (decode JWT, blacklist, principal, token_version) chạy một lần trong before_request
+# (app/utils/auth_middleware.py), hai decorator dưới đây chỉ kiểm tra policy trên flask.g
+token_required = require()
+admin_required = require(role="admin")
 
 
 @auth_bp.route("/register", methods=["POST"])
@@ -97,7 +40,7 @@ def register():
     if User.query.filter_by(email=data["email"]).first():
         return jsonify({"error": "Email đã tồn tại"}), 400
     
-    hashed_password = generate_password_hash(data["password"])
+    hashed_password = get_hashing().hash_password(data["password"])
     
     user = User(
         name=data.get("name", "User"),
@@ -126,9 +69,16 @@ def login():
     
     user = User.query.filter_by(email=data["email"]).first()
     
-    if not user or not check_password_hash(user.password, data["password"]):
+    hashing = get_hashing()
+    if not user or not hashing.verify_password(user.password, data["password"]):
         return jsonify({"error": "Email hoặc password không đúng"}), 401
     
+    # Hash cũ (method/tham số khác cấu hình) được thay khi user đăng nhập đúng
+    new_hash = hashing.rehash_if_needed(user.password, data["password"])
+    if new_hash:
+        user.password = new_hash
+        db.session.commit()
+    
     access_token_jti = str(uuid.uuid4())
     access_token = jwt.encode({
         'user_id': user.id,
@@ -138,13 +88,18 @@ def login():
         'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=15)
     }, Config.SECRET_KEY, algorithm="HS256")
     
+    # Mỗi lần login là một family refresh token mới
     refresh_token_jti = str(uuid.uuid4())
+    refresh_token_exp = datetime.datetime.utcnow() + datetime.timedelta(days=7)
+    family_id = start_family(user.id, refresh_token_jti, refresh_token_exp)
+    db.session.commit()
     refresh_token = jwt.encode({
         'user_id': user.id,
         'jti': refresh_token_jti,
+        'fid': family_id,
         'type': 'refresh',
         'token_version': user.token_version,
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(days=7)
+        'exp': refresh_token_exp
     }, Config.SECRET_KEY, algorithm="HS256")
 
     return jsonify({
@@ -173,7 +128,7 @@ def create_admin():
     if not data or not data.get("email") or not data.get("password"):
         return jsonify({"error": "Email và password là bắt buộc"}), 400
     
-    hashed_password = generate_password_hash(data["password"])
+    hashed_password = get_hashing().hash_password(data["password"])
     
     admin = User(
         name=data.get("name", "Admin"),
@@ -203,39 +158,25 @@ def logout(current_user):
     }
     
     Cơ chế:
-    1. Lấy access_token từ header
+    1. Lấy claims của access_token (đã decode ở before_request)
     2. Lấy refresh_token từ body
-    3. Thêm jti của cả 2 tokens vào blacklist (cache)
-    4. Blacklist tự động hết hạn khi token hết hạn
+    3. Thêm jti của access_token vào blacklist (cache), tự hết hạn khi token hết hạn
+    4. Thu hồi family của refresh_token
     """
-    data = request.json
-    
-    # Lấy access token từ header
-    access_token = request.headers.get('Authorization')
-    if access_token and access_token.startswith('Bearer '):
-        access_token = access_token[7:]
+    data = request.get_json(silent=True) or {}
     
     try:
         # MỚI: Blacklist access_token
-        access_payload = jwt.decode(access_token, Config.SECRET_KEY, algorithms=["HS256"])
-        access_jti = access_payload.get('jti')
-        if access_jti:
-            # Thời gian timeout = thời gian còn lại của token
-            exp_timestamp = access_payload.get('exp')
-            remaining_time = exp_timestamp - datetime.datetime.utcnow().timestamp()
-            if remaining_time > 0:
-                cache.set(f"blacklist:{access_jti}", True, timeout=int(remaining_time))
+        # Blacklist hết hạn cùng lúc với token
+        revoke_token(g.claims)
         
-        # MỚI: Blacklist refresh_token nếu có
+        # Thu hồi cả phiên (family) của refresh_token nếu có
         refresh_token = data.get("refresh_token")
         if refresh_token:
-            refresh_payload = jwt.decode(refresh_token, Config.SECRET_KEY, algorithms=["HS256"])
-            refresh_jti = refresh_payload.get('jti')
-            if refresh_jti:
-                exp_timestamp = refresh_payload.get('exp')
-                remaining_time = exp_timestamp - datetime.datetime.utcnow().timestamp()
-                if remaining_time > 0:
-                    cache.set(f"blacklist:{refresh_jti}", True, timeout=int(remaining_time))
+            refresh_payload = decode_token(refresh_token)
+            if refresh_payload.get('fid'):
+                revoke_family(refresh_payload['fid'])
+                db.session.commit()
         
         return jsonify({"message": "Đăng xuất thành công"})
         
@@ -249,16 +190,18 @@ def logout(current_user):
 def logout_all_devices(current_user):
     """
     Cơ chế:
-    - Tăng token_version của user lên 1
-    - Tất cả refresh_tokens cũ (có token_version cũ) sẽ bị reject
-    - Access tokens hiện tại vẫn hoạt động đến khi hết hạn (15 phút)
+    - Tăng token_version của user lên 1: access tokens cũ bị reject
+    - Thu hồi mọi family refresh token của user
     """
-    current_user.token_version += 1
+    user = db.session.get(User, current_user.id)
+    user.token_version += 1
+    revoke_user_families(user.id)
     db.session.commit()
+    invalidate_principal(user.id)
     
     return jsonify({
         "message": "Đã đăng xuất khỏi tất cả thiết bị",
-        "new_token_version": current_user.token_version
+        "new_token_version": user.token_version
     })
     
 @auth_bp.route("/refresh", methods=["POST"])
@@ -272,8 +215,12 @@ def refresh():
     Response:
     {
         "access_token": "eyJhbGc...",
+        "refresh_token": "eyJhbGc...",
         "expires_in": 900
     }
+    
+    Refresh token dùng một lần: mỗi lần refresh trả refresh_token mới cùng family,
+    dùng lại token cũ thì cả family bị thu hồi (phải đăng nhập lại).
     """
     data = request.json
     
@@ -284,48 +231,46 @@ def refresh():
     
     try:
         # Decode và validate refresh token
-        payload = jwt.decode(refresh_token, Config.SECRET_KEY, algorithms=["HS256"])
-        
-        # Kiểm tra đây có phải refresh token không
-        if payload.get('type') != 'refresh':
-            return jsonify({"error": "Token không hợp lệ"}), 401
-        
-        # MỚI: Kiểm tra refresh token có trong blacklist không
-        jti = payload.get('jti')
-        if jti:
-            blacklisted = cache.get(f"blacklist:{jti}")
-            if blacklisted:
-                return jsonify({"error": "Refresh token đã bị vô hiệu hóa"}), 401
-        
-        # Lấy user
-        user = User.query.get(payload['user_id'])
-        if not user:
-            return jsonify({"error": "User không tồn tại"}), 401
-        
-        # MỚI: Kiểm tra token_version - nếu không khớp, refresh token đã cũ
-        token_version = payload.get('token_version', 0)
-        if token_version != user.token_version:
-            return jsonify({"error": "Refresh token đã hết hạn (version cũ)"}), 401
-        
-        # KHUYẾN NGHỊ: Trong production, nên blacklist refresh token sau khi dùng
-        # và issue một refresh token mới (token rotation)
-        # cache.set(f"blacklist:{jti}", True, timeout=7*24*60*60)
-        
-        # Tạo access_token mới
-        new_access_token_jti = str(uuid.uuid4())
-        new_access_token = jwt.encode({
-            'user_id': user.id,
-            'jti': new_access_token_jti,
-            'type': 'access',
-            'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=15)
-        }, Config.SECRET_KEY, algorithm="HS256")
-        
-        return jsonify({
-            "access_token": new_access_token,
-            "expires_in": 900
-        })
-        
+        payload = decode_token(refresh_token)
     except jwt.ExpiredSignatureError:
         return jsonify({"error": "Refresh token đã hết hạn, vui lòng đăng nhập lại"}), 401
     except jwt.InvalidTokenError:
-        return jsonify({"error": "Refresh token không hợp lệ"}), 401
\ No newline at end of file
+        return jsonify({"error": "Refresh token không hợp lệ"}), 401
+    
+    # Kiểm tra đây có phải refresh token (có family) không
+    if payload.get('type') != 'refresh' or not payload.get('fid'):
+        return jsonify({"error": "Token không hợp lệ"}), 401
+    
+    # Xoay vòng: CAS jti hiện hành của family sang jti mới
+    new_refresh_token_jti = str(uuid.uuid4())
+    new_refresh_token_exp = datetime.datetime.utcnow() + datetime.timedelta(days=7)
+    if not rotate_family(payload['fid'], payload['jti'], new_refresh_token_jti, new_refresh_token_exp):
+        reused = revoke_reused_family(payload['fid'], payload['jti'])
+        db.session.commit()
+        if reused:
+            return jsonify({"error": "Refresh token đã được sử dụng, phiên đăng nhập đã bị thu hồi"}), 401
+        return jsonify({"error": "Refresh token đã bị vô hiệu hóa"}), 401
+    db.session.commit()
+    
+    # Family còn sống nghĩa là user chưa logout-all/bị xóa, token_version trong token vẫn đúng
+    new_access_token = jwt.encode({
+        'user_id': payload['user_id'],
+        'jti': str(uuid.uuid4()),
+        'type': 'access',
+        'token_version': payload.get('token_version', 0),
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=15)
+    }, Config.SECRET_KEY, algorithm="HS256")
+    new_refresh_token = jwt.encode({
+        'user_id': payload['user_id'],
+        'jti': new_refresh_token_jti,
+        'fid': payload['fid'],
+        'type': 'refresh',
+        'token_version': payload.get('token_version', 0),
+        'exp': new_refresh_token_exp
+    }, Config.SECRET_KEY, algorithm="HS256")
+    
+    return jsonify({
+        "access_token": new_access_token,
+        "refresh_token": new_refresh_token,
+        "expires_in": 900
+    })
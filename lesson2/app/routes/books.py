@@ -1,33 +1,86 @@
-from flask import Blueprint, jsonify, request, make_response
+from flask import Blueprint, jsonify, request, make_response, abort, current_app
 from app.models import Book
-from app.extension import db, cache
+from sqlalchemy import select
+from app.extension import db
 from app.routes.auth import token_required, admin_required
+from app.utils.pagination import keyset_paginate, InvalidCursor
+from app.utils.counts import COUNT_MODES, get_total, adjust_total, invalidate_filtered_totals
+from app.utils.tag_cache import cached_with_tags, invalidate_tags, normalized_query_key
+from app.utils.search import get_search
+from app.utils.search_cache import normalize_query, get_or_compute, bump_generation
+from app.utils.versions import get_book_version, invalidate_book_version, book_etag
+from app.utils.collection_etag import conditional_collection, bump_tables
+from app.utils.bulk_import import import_books
+from app.utils.export import export_response
+from app.utils.fields import BOOK_FIELDS, InvalidFields, parse_fields, load_only_option, project
 from datetime import datetime
-import hashlib
-import base64
+import math
 
 books_bp = Blueprint("books", __name__)
 
-def generate_etag(data):
-    """Tạo ETag từ dữ liệu"""
-    return hashlib.md5(str(data).encode()).hexdigest()
+# Các kiểu sắp xếp cho cursor mode, cột cuối luôn là khóa duy nhất (id)
+BOOK_SORTS = {
+    "id": (Book.id,),
+    "title": (Book.title, Book.id),
+    "author": (db.func.coalesce(Book.author, ""), Book.id),
+}
 
-def encode_cursor(book_id):
-    """Encode book_id thành cursor string"""
-    return base64.b64encode(str(book_id).encode()).decode()
+# Các tham số ảnh hưởng tới kết quả của get_books (kèm giá trị mặc định)
+BOOKS_LIST_PARAMS = {
+    "type": "page", "page": "1", "per_page": "10",
+    "cursor": "", "sort": "id", "offset": "0", "limit": "10", "total": "exact",
+    "fields": "",
+}
 
-def decode_cursor(cursor):
-    """Decode cursor string thành book_id"""
-    try:
-        return int(base64.b64decode(cursor.encode()).decode())
-    except:
-        return None
+# Header cache chung của các endpoint danh sách sách (gửi kèm cả 304)
+BOOKS_LIST_HEADERS = {'Cache-Control': 'public, max-age=60', 'Vary': 'Accept-Language'}
+
+def books_changed(book_ids=(), list_changed=False, count_delta=0):
+    """
+    Xóa mọi cache phụ thuộc sách sau khi ghi, gọi một lần cho mỗi request ghi:
+    - book_ids: sách có dữ liệu đổi (tag book:<id>, version cho conditional GET)
+    - list_changed: tập sách hoặc thứ tự sắp xếp đổi (tag books:list, tổng theo filter)
+    - count_delta: số sách thêm/bớt để cộng dồn vào tổng
+    """
+    for book_id in book_ids:
+        invalidate_tags(f"book:{book_id}")
+        invalidate_book_version(book_id)
+    if list_changed:
+        invalidate_tags("books:list")
+    if count_delta:
+        adjust_total("books", count_delta)
+    elif list_changed:
+        invalidate_filtered_totals("books")
+    bump_generation()
+    # Cũng xóa các báo cáo SWR hiện tên sách (/loans/active, /users/all-loans-v2) qua tables_changed
+    bump_tables("books")
+
+def books_list_cache_key():
+    return normalized_query_key("books_list", BOOKS_LIST_PARAMS)
+
+def books_list_tags(payload):
+    """Trang danh sách phụ thuộc vào tập sách (books:list) và từng sách trên trang"""
+    return ["books:list"] + [f"book:{b['id']}" for b in payload["data"]]
 
 @books_bp.route("/", methods=["GET"])
+@conditional_collection(["books"], books_list_cache_key, BOOKS_LIST_HEADERS)
+@cached_with_tags(books_list_cache_key, books_list_tags, timeout=60)
 def get_books():
     # Xác định pagination strategy
     pagination_type = request.args.get('type', 'page')  # page, cursor, offset
     
+    # Sparse fieldset: chỉ load các cột client cần
+    try:
+        fields = parse_fields(BOOK_FIELDS)
+    except InvalidFields as e:
+        return jsonify({"error": str(e)}), 400
+    books_query = Book.query.options(load_only_option(Book, fields))
+    
+    # Chế độ đếm tổng: exact (cache), estimate (thống kê), none (không đếm)
+    total_mode = request.args.get('total', 'exact')
+    if total_mode not in COUNT_MODES:
+        total_mode = 'exact'
+    
     # Strategy 1: PAGE-BASED (offset/limit với page number)
     if pagination_type == 'page':
         page = request.args.get('page', 1, type=int)
@@ -39,19 +92,15 @@ def get_books():
         if per_page < 1 or per_page > 100:
             per_page = 10
         
-        # Query với pagination
-        pagination = Book.query.paginate(
-            page=page, 
-            per_page=per_page, 
-            error_out=False
-        )
+        # Lấy thêm 1 dòng để biết có trang sau, tổng lấy từ count subsystem
+        books = books_query.order_by(Book.id).offset((page - 1) * per_page).limit(per_page + 1).all()
+        has_next = len(books) > per_page
+        books = books[:per_page]
+        has_prev = page > 1
+        total = get_total(Book.query, "books", mode=total_mode)
+        total_pages = math.ceil(total / per_page) if total is not None else None
         
-        books_data = [{
-            "id": b.id, 
-            "title": b.title, 
-            "author": b.author, 
-            "is_available": b.is_available
-        } for b in pagination.items]
+        books_data = [project(b, fields) for b in books]
         
         response_data = {
             "data": books_data,
@@ -59,65 +108,58 @@ def get_books():
                 "type": "page-based",
                 "current_page": page,
                 "per_page": per_page,
-                "total_pages": pagination.pages,
-                "total_items": pagination.total,
-                "has_next": pagination.has_next,
-                "has_prev": pagination.has_prev,
-                "next_page": page + 1 if pagination.has_next else None,
-                "prev_page": page - 1 if pagination.has_prev else None
+                "total_mode": total_mode,
+                "total_pages": total_pages,
+                "total_items": total,
+                "has_next": has_next,
+                "has_prev": has_prev,
+                "next_page": page + 1 if has_next else None,
+                "prev_page": page - 1 if has_prev else None
             },
             "links": {
                 "self": f"/books?type=page&page={page}&per_page={per_page}",
-                "next": f"/books?type=page&page={page+1}&per_page={per_page}" if pagination.has_next else None,
-                "prev": f"/books?type=page&page={page-1}&per_page={per_page}" if pagination.has_prev else None,
+                "next": f"/books?type=page&page={page+1}&per_page={per_page}" if has_next else None,
+                "prev": f"/books?type=page&page={page-1}&per_page={per_page}" if has_prev else None,
                 "first": f"/books?type=page&page=1&per_page={per_page}",
-                "last": f"/books?type=page&page={pagination.pages}&per_page={per_page}"
+                "last": f"/books?type=page&page={max(total_pages, 1)}&per_page={per_page}" if total_pages is not None else None
             }
         }
     
-    # Strategy 2: CURSOR-BASED
+    # Strategy 2: CURSOR-BASED (keyset, cursor có chữ ký HMAC)
     elif pagination_type == 'cursor':
         limit = request.args.get('limit', 10, type=int)
         cursor = request.args.get('cursor', None)
+        sort = request.args.get('sort', 'id')
         
         if limit < 1 or limit > 100:
             limit = 10
+        if sort not in BOOK_SORTS:
+            return jsonify({"error": f"sort phải là một trong {list(BOOK_SORTS)}"}), 400
         
-        # Build query
-        query = Book.query.order_by(Book.id)
-        
-        if cursor:
-            cursor_id = decode_cursor(cursor)
-            if cursor_id:
-                query = query.filter(Book.id > cursor_id)
-        
-        # Lấy limit + 1 để biết có next page không
-        books = query.limit(limit + 1).all()
-        
-        has_next = len(books) > limit
-        if has_next:
-            books = books[:limit]
+        try:
+            page = keyset_paginate(books_query, BOOK_SORTS[sort], sort, limit, cursor)
+        except InvalidCursor as e:
+            return jsonify({"error": str(e)}), 400
         
-        books_data = [{
-            "id": b.id,
-            "title": b.title,
-            "author": b.author,
-            "is_available": b.is_available
-        } for b in books]
+        books_data = [project(b, fields) for b in page.items]
         
-        next_cursor = encode_cursor(books[-1].id) if books and has_next else None
+        base_link = f"/books?type=cursor&sort={sort}&limit={limit}"
         
         response_data = {
             "data": books_data,
             "pagination": {
                 "type": "cursor-based",
+                "sort": sort,
                 "limit": limit,
-                "has_next": has_next,
-                "next_cursor": next_cursor
+                "has_next": page.has_next,
+                "has_prev": page.has_prev,
+                "next_cursor": page.next_cursor,
+                "prev_cursor": page.prev_cursor
             },
             "links": {
-                "self": f"/books?type=cursor&limit={limit}" + (f"&cursor={cursor}" if cursor else ""),
-                "next": f"/books?type=cursor&limit={limit}&cursor={next_cursor}" if next_cursor else None
+                "self": base_link + (f"&cursor={cursor}" if cursor else ""),
+                "next": f"{base_link}&cursor={page.next_cursor}" if page.next_cursor else None,
+                "prev": f"{base_link}&cursor={page.prev_cursor}" if page.prev_cursor else None
             }
         }
     
@@ -131,18 +173,13 @@ def get_books():
         if limit < 1 or limit > 100:
             limit = 10
         
-        # Query
-        total = Book.query.count()
-        books = Book.query.offset(offset).limit(limit).all()
-        
-        books_data = [{
-            "id": b.id,
-            "title": b.title,
-            "author": b.author,
-            "is_available": b.is_available
-        } for b in books]
+        # Query: lấy thêm 1 dòng để biết có trang sau, không cần COUNT(*)
+        total = get_total(Book.query, "books", mode=total_mode)
+        books = books_query.order_by(Book.id).offset(offset).limit(limit + 1).all()
+        has_next = len(books) > limit
+        books = books[:limit]
         
-        has_next = (offset + limit) < total
+        books_data = [project(b, fields) for b in books]
         
         response_data = {
             "data": books_data,
@@ -150,6 +187,7 @@ def get_books():
                 "type": "offset-based",
                 "offset": offset,
                 "limit": limit,
+                "total_mode": total_mode,
                 "total_items": total,
                 "has_next": has_next,
                 "next_offset": offset + limit if has_next else None
@@ -175,6 +213,40 @@ def get_book(book_id):
     - Client gửi If-None-Match (ETag) hoặc If-Modified-Since
     - Server trả 304 Not Modified nếu chưa đổi
     """
+    # Fast path: chỉ đọc (row_version, updated_at) - cache theo id hoặc lookup theo PK
+    version = get_book_version(book_id)
+    if version is None:
+        abort(404)
+    row_version, updated_at = version
+    
+    etag = book_etag(book_id, row_version, updated_at)
+    # Last-Modified/If-Modified-Since chỉ chính xác tới giây
+    updated_at = updated_at.replace(microsecond=0)
+    last_modified = updated_at.strftime('%a, %d %b %Y %H:%M:%S GMT')
+    
+    # Kiểm tra If-None-Match (ETag validation), ưu tiên hơn If-Modified-Since
+    if request.if_none_match:
+        if request.if_none_match.contains_weak(etag):
+            # DEMO: 304 Not Modified - không gửi body, không dựng payload
+            response = make_response('', 304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, max-age=30, must-revalidate'
+            return response
+    
+    # Kiểm tra If-Modified-Since (Last-Modified validation)
+    else:
+        if_modified_since = request.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                ims_date = datetime.strptime(if_modified_since, '%a, %d %b %Y %H:%M:%S GMT')
+                if updated_at <= ims_date:
+                    response = make_response('', 304)
+                    response.headers['Last-Modified'] = last_modified
+                    response.headers['Cache-Control'] = 'private, max-age=30, must-revalidate'
+                    return response
+            except ValueError:
+                pass
+    
     book = Book.query.get_or_404(book_id)
     book_data = {
         "id": book.id, 
@@ -183,38 +255,10 @@ def get_book(book_id):
         "is_available": book.is_available
     }
     
-    # Tạo ETag từ dữ liệu sách
-    etag = generate_etag(book_data)
-    
-    # Giả sử last_modified (thực tế nên có timestamp trong DB)
-    last_modified = datetime.utcnow().replace(microsecond=0)
-    
-    # Kiểm tra If-None-Match (ETag validation)
-    if_none_match = request.headers.get('If-None-Match')
-    if if_none_match == etag:
-        # DEMO: 304 Not Modified - không gửi body
-        response = make_response('', 304)
-        response.headers['ETag'] = etag
-        response.headers['Cache-Control'] = 'private, max-age=30, must-revalidate'
-        return response
-    
-    # Kiểm tra If-Modified-Since (Last-Modified validation)
-    if_modified_since = request.headers.get('If-Modified-Since')
-    if if_modified_since:
-        try:
-            ims_date = datetime.strptime(if_modified_since, '%a, %d %b %Y %H:%M:%S GMT')
-            if last_modified <= ims_date:
-                response = make_response('', 304)
-                response.headers['Last-Modified'] = last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
-                response.headers['Cache-Control'] = 'private, max-age=30, must-revalidate'
-                return response
-        except ValueError:
-            pass
-    
     # Trả dữ liệu mới với validators
     response = make_response(jsonify(book_data))
-    response.headers['ETag'] = etag
-    response.headers['Last-Modified'] = last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
+    response.set_etag(etag)
+    response.headers['Last-Modified'] = last_modified
     
     # DEMO Cache-Control: private (chỉ browser cache), must-revalidate
     response.headers['Cache-Control'] = 'private, max-age=30, must-revalidate'
@@ -234,9 +278,10 @@ def add_book(current_user):
                 is_available=data.get("is_available", True))
     db.session.add(book)
     db.session.commit()
+    get_search().index_book(book)
     
-    # Xóa cache danh sách sách khi thêm mới
-    cache.delete_memoized(get_books)
+    # Xóa cache danh sách sách khi thêm mới, cộng dồn tổng số sách
+    books_changed(list_changed=True, count_delta=1)
     
     response = make_response(jsonify({"message": "Book added", "id": book.id}), 201)
     
@@ -245,11 +290,56 @@ def add_book(current_user):
     
     return response
 
+@books_bp.route("/bulk", methods=["POST"])
+@admin_required
+def bulk_import_books(current_user):
+    """
+    Import sách hàng loạt từ body NDJSON (mặc định) hoặc CSV (có header title,author,is_available)
+    - Chọn định dạng qua ?format=ndjson|csv hoặc Content-Type text/csv
+    - Insert theo batch (?batch_size=, mặc định BULK_IMPORT_BATCH_SIZE)
+    - Trả về số dòng đã thêm và lỗi theo từng dòng
+    """
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = 'csv' if 'csv' in (request.content_type or '') else 'ndjson'
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({"error": "format phải là ndjson hoặc csv"}), 400
+    
+    batch_size = request.args.get('batch_size', current_app.config['BULK_IMPORT_BATCH_SIZE'], type=int)
+    if batch_size < 1 or batch_size > 10000:
+        batch_size = current_app.config['BULK_IMPORT_BATCH_SIZE']
+    
+    result = import_books(request.stream, fmt, batch_size,
+                          max_errors=current_app.config['BULK_IMPORT_MAX_ERRORS'])
+    
+    # Xóa cache một lần cho cả lần import thay vì theo từng dòng
+    if result["inserted"]:
+        get_search().rebuild()
+        books_changed(list_changed=True, count_delta=result["inserted"])
+    
+    status = 201 if result["inserted"] else 400
+    response = make_response(jsonify({"message": "Bulk import hoàn tất", **result}), status)
+    response.headers['Cache-Control'] = 'no-store'
+    
+    return response
+
+@books_bp.route("/export", methods=["GET"])
+@admin_required
+def export_books(current_user):
+    """Stream toàn bộ catalog (NDJSON/CSV, có thể gzip) qua server-side cursor"""
+    columns = ["id", "title", "author", "is_available"]
+    statement = select(Book.id, Book.title, Book.author, Book.is_available).order_by(Book.id)
+    return export_response(statement, columns, "books")
+
 @books_bp.route("/<int:book_id>", methods=["PUT"])
 @admin_required
 def update_book(current_user, book_id):
     data = request.json
     book = Book.query.get_or_404(book_id)
+    
+    # Đổi title/author làm đổi thứ tự sắp xếp và kết quả search
+    order_changed = bool(data.get("title")) and data["title"] != book.title
+    order_changed = order_changed or ("author" in data and data["author"] != book.author)
    
     if "title" in data and data["title"]:  
         book.title = data["title"]
@@ -261,9 +351,10 @@ def update_book(current_user, book_id):
         book.is_available = bool(data["is_available"])
    
     db.session.commit()
+    get_search().index_book(book)
     
-    # Xóa cache khi cập nhật
-    cache.delete_memoized(get_books)
+    # Chỉ các trang chứa sách này bị xóa cache, trừ khi thứ tự sắp xếp thay đổi
+    books_changed([book_id], list_changed=order_changed)
     
     response = make_response(jsonify({"message": "Book updated"}))
     response.headers['Cache-Control'] = 'no-store'
@@ -276,68 +367,78 @@ def delete_book(current_user, book_id):
     book = Book.query.get_or_404(book_id)
     db.session.delete(book)
     db.session.commit()
+    get_search().remove_book(book_id)
     
     # Xóa cache khi xóa sách
-    cache.delete_memoized(get_books)
+    books_changed([book_id], list_changed=True, count_delta=-1)
     
     response = make_response(jsonify({"message": "Book deleted"}))
     response.headers['Cache-Control'] = 'no-store'
     
     return response
 
+def search_params():
+    """(author đã chuẩn hóa, page, per_page) của request search hiện tại"""
+    author = normalize_query(request.args.get('name', ''))
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 10, type=int)
+    if page < 1:
+        page = 1
+    if per_page < 1 or per_page > 100:
+        per_page = 10
+    return author, page, per_page
+
+def search_cache_key():
+    author, page, per_page = search_params()
+    fields = ",".join(sorted(f.strip() for f in request.args.get('fields', '').split(",") if f.strip()))
+    return f"search_books:{author}:page{page}:per{per_page}:fields={fields}"
+
 # DEMO: Cache với query parameters khác nhau 
 @books_bp.route("/author", methods=["GET"]) 
+@conditional_collection(["books"], search_cache_key, BOOKS_LIST_HEADERS) 
 def search_books(): 
     """ DEMO: Cache key bao gồm query parameters /books/author?name=X và /books/author?name=Y là 2 cache entries khác nhau 
     GET /books/author?name=Martin&page=1&per_page=5 Cache key bao gồm query parameters """ 
-    author = request.args.get('name', '').strip() 
-    page = request.args.get('page', 1, type=int) 
-    per_page = request.args.get('per_page', 10, type=int) 
-    if page < 1: 
-        page = 1 
-    if per_page < 1 or per_page > 100: 
-        per_page = 10 
-    # Tạo cache key duy nhất dựa trên các tham số 
-    cache_key = f"search_books_{author}_page{page}_per{per_page}" 
-    cached_result = cache.get(cache_key) 
-    if cached_result: 
-        response = make_response(jsonify({ 
-            "data": cached_result["books"], 
-            "search": {"author": author if author else None}, 
-            "pagination": cached_result["pagination"], 
-            "from_cache": True 
-        })) 
-    else: 
-        # Truy vấn DB 
-        query = Book.query 
+    author, page, per_page = search_params() 
+    try: 
+        fields = parse_fields(BOOK_FIELDS) 
+    except InvalidFields as e: 
+        return jsonify({"error": str(e)}), 400 
+    books_query = Book.query.options(load_only_option(Book, fields)) 
+    # Cache key từ tham số đã chuẩn hóa, kết quả rỗng cũng được cache 
+    cache_key = search_cache_key() 
+    
+    def compute(): 
+        # Tìm qua search index (title + author, có xếp hạng) thay vì ILIKE quét cả bảng 
         if author: 
-            query = query.filter(Book.author.ilike(f'%{author}%')) 
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False) 
-        books_data = [{ 
-            "id": b.id, 
-            "title": b.title, 
-            "author": b.author, 
-            "is_available": b.is_available 
-        } for b in pagination.items] 
+            search = get_search() 
+            ids = search.search(author, per_page, (page - 1) * per_page) 
+            by_id = {b.id: b for b in books_query.filter(Book.id.in_(ids))} if ids else {} 
+            books = [by_id[i] for i in ids if i in by_id] 
+            total = get_total(None, "books", {"search": author}, count_func=lambda: search.count(author)) 
+        else: 
+            books = books_query.order_by(Book.id).offset((page - 1) * per_page).limit(per_page).all() 
+            total = get_total(Book.query, "books") 
+        total_pages = math.ceil(total / per_page) 
+        books_data = [project(b, fields) for b in books] 
         pagination_data = { 
             "current_page": page, 
             "per_page": per_page, 
-            "total_pages": pagination.pages, 
-            "total_items": pagination.total, 
-            "has_next": pagination.has_next, 
-            "has_prev": pagination.has_prev 
+            "total_pages": total_pages, 
+            "total_items": total, 
+            "has_next": page < total_pages, 
+            "has_prev": page > 1 
         } 
-        # Lưu vào cache 
-        cache.set(cache_key, { 
-            "books": books_data, 
-            "pagination": pagination_data 
-        }, timeout=60) 
-        response = make_response(jsonify({ 
-            "data": books_data, 
-            "search": {"author": author if author else None}, 
-            "pagination": pagination_data, 
-            "from_cache": False 
-        })) 
+        return {"books": books_data, "pagination": pagination_data} 
+    
+    result, cache_status = get_or_compute(cache_key, compute, timeout=60) 
+    response = make_response(jsonify({ 
+        "data": result["books"], 
+        "search": {"author": author if author else None}, 
+        "pagination": result["pagination"], 
+        "from_cache": cache_status != "MISS" 
+    })) 
+    response.headers['X-Cache-Status'] = cache_status 
     response.headers['Cache-Control'] = 'public, max-age=60' 
     response.headers['Vary'] = 'Accept-Language' 
     return response
\ No newline at end of file
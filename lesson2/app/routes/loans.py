@@ -1,11 +1,45 @@
-from flask import Blueprint, jsonify, request, make_response
-from app.models import Loan, Book, User
-from app.extension import db, cache
-from datetime import date, datetime
+from flask import Blueprint, jsonify, request, make_response, current_app, abort
+from app.models import Loan, LoanArchive, Book, User, BookDailyStat, UserDailyStat
+from app.extension import db
+from datetime import date, datetime, timedelta
 from app.routes.auth import token_required, admin_required
+from app.utils.tag_cache import get_tagged, set_tagged
+from app.utils.collection_etag import conditional_collection, tables_changed
+from app.utils.export import export_response
+from app.utils.fields import LOAN_FIELDS, InvalidFields, parse_fields
+from app.utils.pagination import keyset_paginate, decode_keyset, encode_cursor, InvalidCursor
+from app.utils.swr_cache import swr_cached, swr_invalidate
+from app.utils.loan_events import emit_loan_change, user_loans_key, user_loans_tag
+from app.utils.checkout import claim_books, release_books, parse_id_list, run_with_retry
+from app.utils.rollups import record_checkouts, record_returns, forget_loan, stats_range, daily_totals
+from app.utils.archive import ARCHIVE_COLUMNS, include_archived, archived_loans, archived_loan_item
+from sqlalchemy import select, insert, update, tuple_, func, union_all
+import time
 
 loans_bp = Blueprint("loans", __name__)
 
+# Cột tương ứng với từng field của loan (book_title/user_name cần join)
+LOAN_COLUMNS = {
+    "loan_id": Loan.loan_id,
+    "book_id": Loan.book_id,
+    "book_title": Book.title,
+    "user_id": Loan.user_id,
+    "user_name": User.name,
+    "checkout_date": Loan.checkout_date,
+    "return_date": Loan.return_date,
+}
+
+# Các kiểu sắp xếp cho keyset pagination, cột cuối là khóa duy nhất
+LOAN_SORTS = {
+    "loan_id": (Loan.loan_id,),
+    "checkout_date": (Loan.checkout_date, Loan.loan_id),
+}
+
+def format_loan_value(value):
+    """Ngày được trả dạng chuỗi như các endpoint loans khác"""
+    return str(value) if isinstance(value, date) else value
+
+
 # DEMO: no-cache - phải revalidate mỗi lần dùng
 @loans_bp.route("/", methods=["GET"])
 @admin_required
@@ -14,21 +48,77 @@ def get_loans(current_user):
     DEMO: Cache-Control: no-cache
     - Được cache nhưng phải revalidate với server mỗi lần
     - Đảm bảo dữ liệu luôn mới nhất
+    
+    GET /loans/?user_id=1&book_id=2&active=true&from=2024-01-01&to=2024-12-31
+               &sort=checkout_date&limit=50&cursor=...&fields=...
+    Một query duy nhất (join khi cần), keyset pagination, limit tối đa LOANS_MAX_PAGE_SIZE
     """
-    loans = Loan.query.all()
-    result = []
-    for loan in loans:
-        result.append({
-            "loan_id": loan.loan_id,
-            "book_id": loan.book_id,
-            "book_title": loan.book.title,
-            "user_id": loan.user_id,
-            "user_name": loan.user.name,
-            "checkout_date": str(loan.checkout_date),
-            "return_date": str(loan.return_date) if loan.return_date else None
-        })
+    try:
+        fields = parse_fields(LOAN_FIELDS, primary_key="loan_id")
+    except InvalidFields as e:
+        return jsonify({"error": str(e)}), 400
+    
+    sort = request.args.get('sort', 'loan_id')
+    if sort not in LOAN_SORTS:
+        return jsonify({"error": f"sort phải là một trong {list(LOAN_SORTS)}"}), 400
+    
+    max_page_size = current_app.config['LOANS_MAX_PAGE_SIZE']
+    limit = request.args.get('limit', 50, type=int)
+    if limit < 1:
+        limit = 50
+    limit = min(limit, max_page_size)
+    
+    # Filter phía server
+    query = db.session.query(*[LOAN_COLUMNS[f] for f in fields]).select_from(Loan)
+    user_id = request.args.get('user_id', type=int)
+    if user_id is not None:
+        query = query.filter(Loan.user_id == user_id)
+    book_id = request.args.get('book_id', type=int)
+    if book_id is not None:
+        query = query.filter(Loan.book_id == book_id)
+    active = request.args.get('active')
+    if active is not None:
+        is_active = active.lower() in ('1', 'true', 'yes')
+        query = query.filter(Loan.return_date.is_(None) if is_active else Loan.return_date.isnot(None))
+    try:
+        date_from = request.args.get('from')
+        if date_from:
+            query = query.filter(Loan.checkout_date >= date.fromisoformat(date_from))
+        date_to = request.args.get('to')
+        if date_to:
+            query = query.filter(Loan.checkout_date <= date.fromisoformat(date_to))
+    except ValueError:
+        return jsonify({"error": "from/to phải có dạng YYYY-MM-DD"}), 400
+    
+    # Chỉ join books/users khi cần title/name
+    if "book_title" in fields:
+        query = query.outerjoin(Book, Loan.book_id == Book.id)
+    if "user_name" in fields:
+        query = query.outerjoin(User, Loan.user_id == User.id)
+    
+    cursor = request.args.get('cursor')
+    try:
+        page = keyset_paginate(query, LOAN_SORTS[sort], sort, limit, cursor)
+    except InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
+    
+    result = [
+        {f: format_loan_value(v) for f, v in zip(fields, row)}
+        for row in page.items
+    ]
     
-    response = make_response(jsonify(result))
+    response = make_response(jsonify({
+        "data": result,
+        "pagination": {
+            "type": "cursor-based",
+            "sort": sort,
+            "limit": limit,
+            "has_next": page.has_next,
+            "has_prev": page.has_prev,
+            "next_cursor": page.next_cursor,
+            "prev_cursor": page.prev_cursor
+        }
+    }))
     
     # DEMO: no-cache - cache nhưng phải revalidate
     response.headers['Cache-Control'] = 'private, no-cache'
@@ -36,6 +126,191 @@ def get_loans(current_user):
     
     return response
 
+@loans_bp.route("/export", methods=["GET"])
+@admin_required
+def export_loans(current_user):
+    """
+    Stream lịch sử mượn (NDJSON/CSV, có thể gzip) qua server-side cursor,
+    ?include_archived=true để gồm cả loans_archive
+    """
+    columns = ARCHIVE_COLUMNS
+    statement = select(*[getattr(Loan, c) for c in columns])
+    if include_archived():
+        statement = union_all(statement, select(*[getattr(LoanArchive, c) for c in columns]))
+        statement = select(*statement.subquery().c)
+    statement = statement.order_by(columns[0])
+    return export_response(statement, columns, "loans")
+
+@loans_bp.route("/overdue", methods=["GET"])
+@admin_required
+def get_overdue_loans(current_user):
+    """
+    Loan chưa trả và đã mượn quá N ngày: GET /loans/overdue?days=14&limit=1000&cursor=...
+    - Chỉ đọc partial index ix_loans_active_checkout_date (loan chưa trả), không quét lịch sử
+    - Sắp xếp và phân trang keyset theo (checkout_date, loan_id)
+    - Body stream NDJSON/CSV như /loans/export, cursor trang sau nằm ở header X-Next-Cursor
+    """
+    days = request.args.get('days', 14, type=int)
+    if days < 0:
+        return jsonify({"error": "days phải >= 0"}), 400
+    
+    max_page_size = current_app.config['LOANS_OVERDUE_PAGE_SIZE']
+    limit = request.args.get('limit', max_page_size, type=int)
+    if limit < 1:
+        limit = max_page_size
+    limit = min(limit, max_page_size)
+    
+    key = (Loan.checkout_date, Loan.loan_id)
+    conditions = [Loan.return_date.is_(None), Loan.checkout_date < date.today() - timedelta(days=days)]
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            _, after = decode_keyset(cursor, "overdue", key)
+        except InvalidCursor as e:
+            return jsonify({"error": str(e)}), 400
+        conditions.append(tuple_(*key) > tuple_(*after))
+    
+    # Dò trước khóa cuối trang (chỉ chạm index) để biết cursor trang sau trước khi stream body
+    boundary = db.session.execute(
+        select(*key).where(*conditions).order_by(*key).offset(limit - 1).limit(2)
+    ).all()
+    
+    columns = ["loan_id", "book_id", "book_title", "user_id", "user_name", "user_email", "checkout_date"]
+    statement = (
+        select(Loan.loan_id, Loan.book_id, Book.title, Loan.user_id, User.name, User.email, Loan.checkout_date)
+        .outerjoin(Book, Loan.book_id == Book.id)
+        .outerjoin(User, Loan.user_id == User.id)
+        .where(*conditions)
+        .order_by(*key)
+        .limit(limit)
+    )
+    response = export_response(statement, columns, "overdue_loans")
+    if len(boundary) == 2:
+        response.headers['X-Next-Cursor'] = encode_cursor("overdue", "next", boundary[0])
+    return response
+
+def stats_request():
+    """(date_from, date_to, limit) từ query string cho các endpoint /loans/stats"""
+    date_from, date_to = stats_range(request.args)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    return date_from, date_to, limit
+
+@loans_bp.route("/stats", methods=["GET"])
+@admin_required
+def get_loan_stats(current_user):
+    """
+    Tổng hợp trong khoảng ?from=&to= (mặc định 30 ngày gần nhất), chỉ đọc bảng rollup
+    - /loans/stats: tổng số lượt mượn/trả và thời gian mượn trung bình
+    - /loans/stats/daily: từng ngày
+    - /loans/stats/top-books, /loans/stats/top-borrowers: ?limit= (mặc định 10)
+    """
+    try:
+        date_from, date_to, _ = stats_request()
+    except ValueError:
+        return jsonify({"error": "from/to phải có dạng YYYY-MM-DD"}), 400
+    
+    days = daily_totals(date_from, date_to)
+    checkouts, returns, loan_days = db.session.execute(
+        select(func.coalesce(func.sum(days.c.checkouts), 0),
+               func.coalesce(func.sum(days.c.returns), 0),
+               func.coalesce(func.sum(days.c.loan_days), 0))
+    ).one()
+    
+    response = make_response(jsonify({
+        "from": str(date_from),
+        "to": str(date_to),
+        "checkouts": checkouts,
+        "returns": returns,
+        "avg_loan_days": round(loan_days / returns, 2) if returns else None
+    }))
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response
+
+@loans_bp.route("/stats/daily", methods=["GET"])
+@admin_required
+def get_daily_loan_stats(current_user):
+    try:
+        date_from, date_to, _ = stats_request()
+    except ValueError:
+        return jsonify({"error": "from/to phải có dạng YYYY-MM-DD"}), 400
+    
+    days = daily_totals(date_from, date_to)
+    rows = db.session.execute(select(days).order_by(days.c.day)).all()
+    
+    response = make_response(jsonify([
+        {
+            "day": str(row.day),
+            "checkouts": row.checkouts,
+            "returns": row.returns,
+            "avg_loan_days": round(row.loan_days / row.returns, 2) if row.returns else None
+        }
+        for row in rows
+    ]))
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response
+
+@loans_bp.route("/stats/top-books", methods=["GET"])
+@admin_required
+def get_top_books(current_user):
+    try:
+        date_from, date_to, limit = stats_request()
+    except ValueError:
+        return jsonify({"error": "from/to phải có dạng YYYY-MM-DD"}), 400
+    
+    total = func.sum(BookDailyStat.checkouts).label("checkouts")
+    top = (
+        select(BookDailyStat.book_id, total)
+        .where(BookDailyStat.day.between(date_from, date_to))
+        .group_by(BookDailyStat.book_id)
+        .having(total > 0)
+        .order_by(total.desc(), BookDailyStat.book_id)
+        .limit(limit)
+        .subquery()
+    )
+    rows = db.session.execute(
+        select(top.c.book_id, Book.title, top.c.checkouts)
+        .outerjoin(Book, Book.id == top.c.book_id)
+        .order_by(top.c.checkouts.desc(), top.c.book_id)
+    ).all()
+    
+    response = make_response(jsonify([
+        {"book_id": row.book_id, "title": row.title, "checkouts": row.checkouts}
+        for row in rows
+    ]))
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response
+
+@loans_bp.route("/stats/top-borrowers", methods=["GET"])
+@admin_required
+def get_top_borrowers(current_user):
+    try:
+        date_from, date_to, limit = stats_request()
+    except ValueError:
+        return jsonify({"error": "from/to phải có dạng YYYY-MM-DD"}), 400
+    
+    total = func.sum(UserDailyStat.checkouts).label("checkouts")
+    top = (
+        select(UserDailyStat.user_id, total)
+        .where(UserDailyStat.day.between(date_from, date_to))
+        .group_by(UserDailyStat.user_id)
+        .having(total > 0)
+        .order_by(total.desc(), UserDailyStat.user_id)
+        .limit(limit)
+        .subquery()
+    )
+    rows = db.session.execute(
+        select(top.c.user_id, User.name, top.c.checkouts)
+        .outerjoin(User, User.id == top.c.user_id)
+        .order_by(top.c.checkouts.desc(), top.c.user_id)
+    ).all()
+    
+    response = make_response(jsonify([
+        {"user_id": row.user_id, "user_name": row.name, "checkouts": row.checkouts}
+        for row in rows
+    ]))
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response
+
 @loans_bp.route("/<int:loan_id>", methods=["GET"])
 @token_required
 def get_loan(current_user, loan_id):
@@ -66,24 +341,30 @@ def checkout_book(current_user):
     
     book_id = data["book_id"]
     
-    book = Book.query.get_or_404(book_id)
-    
-    if not book.is_available:
-        return jsonify({"error": "Sách này đang được mượn"}), 400
-    
-    loan = Loan(
-        book_id=book_id,
-        user_id=current_user.id,
-        checkout_date=date.today()
-    )
-    
-    book.is_available = False
-    
-    db.session.add(loan)
-    db.session.commit()
-    
-    # Xóa cache liên quan
-    cache.delete_memoized(get_active_loans)
+    def checkout():
+        # Claim sách bằng một UPDATE có điều kiện, rồi tạo loan trong cùng transaction
+        if not claim_books([book_id]):
+            db.session.rollback()
+            return None
+        loan = Loan(
+            book_id=book_id,
+            user_id=current_user.id,
+            checkout_date=date.today()
+        )
+        db.session.add(loan)
+        record_checkouts([(book_id, current_user.id, loan.checkout_date)])
+        db.session.commit()
+        return loan
+    
+    loan = run_with_retry(checkout)
+    if loan is None:
+        # Chỉ khi claim thất bại mới cần phân biệt không tồn tại và đang được mượn
+        if db.session.get(Book, book_id) is None:
+            abort(404)
+        return jsonify({"error": "Sách này đang được mượn", "code": "BOOK_UNAVAILABLE"}), 409
+    
+    # Xóa cache liên quan (kể cả các trang danh sách sách chứa sách này)
+    emit_loan_change(user_ids=[current_user.id], book_ids=[book_id])
     
     response = make_response(jsonify({
         "message": "Mượn sách thành công",
@@ -98,39 +379,175 @@ def checkout_book(current_user):
 @loans_bp.route("/return/<int:loan_id>", methods=["PUT"])
 @admin_required
 def return_book(current_user, loan_id):
-    loan = Loan.query.get_or_404(loan_id)
-    
-    if loan.return_date:
+    today = date.today()
+    
+    # Đóng loan bằng UPDATE có điều kiện: hai request trả cùng lúc chỉ một request cập nhật được dòng,
+    # nên rollup chỉ được cộng một lần
+    def give_back():
+        row = db.session.execute(
+            update(Loan)
+            .where(Loan.loan_id == loan_id, Loan.return_date.is_(None))
+            .values(return_date=today)
+            .returning(Loan.book_id, Loan.user_id, Loan.checkout_date)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if row is not None:
+            release_books([row.book_id])
+            record_returns([(row.checkout_date, today)])
+        db.session.commit()
+        return row
+    
+    row = run_with_retry(give_back)
+    if row is None:
+        if db.session.get(Loan, loan_id) is None:
+            abort(404)
         return jsonify({"error": "Sách này đã được trả rồi"}), 400
     
-    loan.return_date = date.today()
+    # Xóa cache
+    emit_loan_change(user_ids=[row.user_id], book_ids=[row.book_id])
     
-    book = Book.query.get(loan.book_id)
-    book.is_available = True
+    response = make_response(jsonify({
+        "message": "Trả sách thành công",
+        "return_date": str(today)
+    }))
     
-    db.session.commit()
+    response.headers['Cache-Control'] = 'no-store'
     
-    # Xóa cache
-    cache.delete_memoized(get_active_loans)
+    return response
+
+@loans_bp.route("/checkout/batch", methods=["POST"])
+@token_required
+def checkout_books_batch(current_user):
+    """
+    Mượn nhiều sách trong một request: {"book_ids": [1, 2, 3]}
+    - Claim tất cả bằng một UPDATE, tạo loan bằng một bulk INSERT, một transaction
+    - Sách nào không mượn được thì báo trong "failed", các sách còn lại vẫn được mượn
+    - 201 nếu mượn được ít nhất một sách, 409 nếu không sách nào
+    """
+    try:
+        book_ids = parse_id_list(request.get_json(silent=True), "book_ids",
+                                 current_app.config['LOANS_MAX_BATCH_SIZE'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    today = date.today()
+    
+    def checkout():
+        claimed = claim_books(book_ids)
+        if not claimed:
+            db.session.rollback()
+            return []
+        rows = db.session.execute(
+            insert(Loan).returning(Loan.loan_id, Loan.book_id),
+            [{"book_id": book_id, "user_id": current_user.id, "checkout_date": today}
+             for book_id in book_ids if book_id in claimed]
+        ).all()
+        record_checkouts([(row.book_id, current_user.id, today) for row in rows])
+        db.session.commit()
+        return rows
+    
+    rows = run_with_retry(checkout)
+    claimed = {row.book_id for row in rows}
+    
+    failed = []
+    missing_ids = [book_id for book_id in book_ids if book_id not in claimed]
+    if missing_ids:
+        existing = set(db.session.scalars(select(Book.id).where(Book.id.in_(missing_ids))))
+        failed = [
+            {"book_id": book_id, "code": "BOOK_UNAVAILABLE" if book_id in existing else "BOOK_NOT_FOUND"}
+            for book_id in missing_ids
+        ]
+    
+    if claimed:
+        emit_loan_change(user_ids=[current_user.id], book_ids=claimed)
     
     response = make_response(jsonify({
-        "message": "Trả sách thành công",
-        "return_date": str(loan.return_date)
+        "message": f"Mượn thành công {len(rows)}/{len(book_ids)} sách",
+        "loans": [
+            {"loan_id": row.loan_id, "book_id": row.book_id, "checkout_date": str(today)}
+            for row in rows
+        ],
+        "failed": failed
+    }), 201 if rows else 409)
+    
+    response.headers['Cache-Control'] = 'no-store'
+    
+    return response
+
+@loans_bp.route("/return/batch", methods=["PUT"])
+@admin_required
+def return_books_batch(current_user):
+    """
+    Trả nhiều sách trong một request: {"loan_ids": [10, 11]}
+    Một UPDATE đóng các loan còn mở, một UPDATE trả sách về trạng thái còn trống
+    """
+    try:
+        loan_ids = parse_id_list(request.get_json(silent=True), "loan_ids",
+                                 current_app.config['LOANS_MAX_BATCH_SIZE'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    today = date.today()
+    
+    def give_back():
+        rows = db.session.execute(
+            update(Loan)
+            .where(Loan.loan_id.in_(loan_ids), Loan.return_date.is_(None))
+            .values(return_date=today)
+            .returning(Loan.loan_id, Loan.book_id, Loan.user_id, Loan.checkout_date)
+            .execution_options(synchronize_session=False)
+        ).all()
+        release_books([row.book_id for row in rows])
+        record_returns([(row.checkout_date, today) for row in rows])
+        db.session.commit()
+        return rows
+    
+    rows = run_with_retry(give_back)
+    returned = {row.loan_id for row in rows}
+    
+    failed = []
+    missing_ids = [loan_id for loan_id in loan_ids if loan_id not in returned]
+    if missing_ids:
+        existing = set(db.session.scalars(select(Loan.loan_id).where(Loan.loan_id.in_(missing_ids))))
+        failed = [
+            {"loan_id": loan_id, "code": "ALREADY_RETURNED" if loan_id in existing else "LOAN_NOT_FOUND"}
+            for loan_id in missing_ids
+        ]
+    
+    if rows:
+        emit_loan_change(user_ids=[row.user_id for row in rows], book_ids=[row.book_id for row in rows])
+    
+    response = make_response(jsonify({
+        "message": f"Trả thành công {len(rows)}/{len(loan_ids)} sách",
+        "returned": sorted(returned),
+        "return_date": str(today),
+        "failed": failed
     }))
     
     response.headers['Cache-Control'] = 'no-store'
     
     return response
 
+# Các bảng mà /loans/active đọc (ETag và body cache phải đổi cùng nhau)
+ACTIVE_LOANS_TABLES = ["loans", "books", "users"]
+
+@tables_changed.connect
+def _evict_active_loans(sender, tables):
+    if tables.intersection(ACTIVE_LOANS_TABLES):
+        swr_invalidate("loans_active")
+
 # DEMO: Cache với stale-while-revalidate
 @loans_bp.route("/active", methods=["GET"])
 @admin_required
-@cache.cached(timeout=45)
+@conditional_collection(ACTIVE_LOANS_TABLES, lambda: "loans_active",
+                        {'Cache-Control': 'private, max-age=45, stale-while-revalidate=30'})
+@swr_cached("loans_active", soft_ttl=45, hard_ttl=75)
 def get_active_loans(current_user):
     """
     DEMO: stale-while-revalidate
     - Trả bản cũ trong khi revalidate ngầm
     - UX tốt hơn vì không phải chờ
+    - Phía server cũng vậy: sau 45s trả bản cũ và refresh ở thread nền, sau 75s mới tính đồng bộ
     """
     active_loans = Loan.query.filter(Loan.return_date == None).all()
     result = []
@@ -159,16 +576,21 @@ def get_my_loans(current_user):
     - Chỉ cache ở browser của user
     - Không cache ở CDN/proxy vì dữ liệu riêng tư
     """
-    # Tạo cache key riêng cho từng user
-    cache_key = f"user_loans_{current_user.id}"
-    cached_data = cache.get(cache_key)
+    # Tạo cache key riêng cho từng user, bị xóa bởi sự kiện loan_changed của user này
+    # và gắn tag từng sách để đổi tên sách cũng làm mất hiệu lực
+    archived = include_archived()
+    cache_key = user_loans_key(current_user.id, archived)
+    cached_data = get_tagged(cache_key)
     
     if cached_data:
         response = make_response(jsonify(cached_data))
         response.headers['X-Cache-Status'] = 'HIT'
     else:
+        # Mốc trước khi query: loan/sách đổi trong lúc đọc thì không lưu bản có thể đã cũ
+        since = time.time_ns()
         loans = Loan.query.filter_by(user_id=current_user.id).all()
-        result = []
+        history = archived_loans([current_user.id]) if archived else []
+        result = [archived_loan_item(row) for row in history]
         for loan in loans:
             result.append({
                 "loan_id": loan.loan_id,
@@ -182,7 +604,9 @@ def get_my_loans(current_user):
             "loans": result
         }
         
-        cache.set(cache_key, data, timeout=60)
+        book_ids = {loan.book_id for loan in loans} | {row.book_id for row in history}
+        set_tagged(cache_key, data, [user_loans_tag(current_user.id)] + [f"book:{book_id}" for book_id in book_ids],
+                   timeout=current_app.config['MY_LOANS_CACHE_TIMEOUT'], since=since)
         
         response = make_response(jsonify(data))
         response.headers['X-Cache-Status'] = 'MISS'
@@ -198,7 +622,7 @@ def get_my_loans(current_user):
 def get_user_loans(current_user, user_id):
     user = User.query.get_or_404(user_id)
     loans = Loan.query.filter_by(user_id=user_id).all()
-    result = []
+    result = [archived_loan_item(row) for row in archived_loans([user_id])] if include_archived() else []
     for loan in loans:
         result.append({
             "loan_id": loan.loan_id,
@@ -225,10 +649,12 @@ def delete_loan(current_user, loan_id):
         book = Book.query.get(loan.book_id)
         book.is_available = True
     
+    book_id, user_id = loan.book_id, loan.user_id
+    forget_loan(loan)
     db.session.delete(loan)
     db.session.commit()
     
-    cache.delete_memoized(get_active_loans)
+    emit_loan_change(user_ids=[user_id], book_ids=[book_id])
     
     response = make_response(jsonify({"message": "Đã xóa giao dịch"}))
     response.headers['Cache-Control'] = 'no-store'
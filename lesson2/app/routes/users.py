@@ -2,6 +2,13 @@ from flask import Blueprint, jsonify, request
 from app.models import User, Loan
 from app.extension import db
 from app.routes.auth import token_required, admin_required
+from app.utils.collection_etag import bump_tables, tables_changed
+from app.utils.swr_cache import swr_cached, swr_invalidate
+from app.utils.loan_events import evict_user_loans
+from app.utils.archive import include_archived, archived_loans, archived_loan_item
+from app.utils.principal_cache import invalidate_principal
+from app.utils.refresh_tokens import revoke_user_families
+from app.utils.fields import USER_FIELDS, InvalidFields, parse_fields, load_only_option, project
 from sqlalchemy.orm import joinedload
 import jwt  # MỚI: Để decode token trong demo
 from config import Config
@@ -12,8 +19,13 @@ users_bp = Blueprint("users", __name__)
 @users_bp.route("/", methods=["GET"])
 @admin_required
 def get_users(current_user):
-    users = User.query.all()
-    return jsonify([{"id": u.id, "name": u.name, "email": u.email, "role": u.role} for u in users])
+    # Sparse fieldset: password không nằm trong allow-list nên không bao giờ được load
+    try:
+        fields = parse_fields(USER_FIELDS)
+    except InvalidFields as e:
+        return jsonify({"error": str(e)}), 400
+    users = User.query.options(load_only_option(User, fields)).all()
+    return jsonify([project(u, fields) for u in users])
 
 # USER - Xem thông tin user (user xem được tất cả)
 @users_bp.route("/<int:user_id>", methods=["GET"])
@@ -36,18 +48,23 @@ def get_current_user(current_user):
 @token_required
 def update_current_user(current_user):
     data = request.json
+    # current_user là principal chỉ đọc, cần entity để cập nhật
+    user = db.session.get(User, current_user.id)
     
     if "name" in data and data["name"]:
-        current_user.name = data["name"]
+        user.name = data["name"]
     
     if "email" in data and data["email"]:
         # Kiểm tra email mới có trùng với user khác không
         existing = User.query.filter(User.email == data["email"], User.id != current_user.id).first()
         if existing:
             return jsonify({"error": "Email đã tồn tại"}), 400
-        current_user.email = data["email"]
+        user.email = data["email"]
     
     db.session.commit()
+    invalidate_principal(current_user.id)
+    bump_tables("users")
+    evict_user_loans(current_user.id)
     return jsonify({"message": "User updated"})
 
 @users_bp.route("/<int:user_id>", methods=["PUT"])
@@ -69,6 +86,9 @@ def update_user(current_user, user_id):
         user.role = data["role"]
     
     db.session.commit()
+    invalidate_principal(user_id)
+    bump_tables("users")
+    evict_user_loans(user_id)
     return jsonify({"message": "User updated"})
 
 @users_bp.route("/<int:user_id>", methods=["DELETE"])
@@ -76,16 +96,29 @@ def update_user(current_user, user_id):
 def delete_user(current_user, user_id):
     user = User.query.get_or_404(user_id)
     db.session.delete(user)
+    revoke_user_families(user_id)
     db.session.commit()
+    invalidate_principal(user_id)
+    bump_tables("users")
+    evict_user_loans(user_id)
     return jsonify({"message": "User deleted"})
 
+def archived_loans_by_user():
+    """{user_id: [dòng archive]} khi ?include_archived=true, ngược lại rỗng (chỉ đọc loans)"""
+    history = {}
+    if include_archived():
+        for row in archived_loans():
+            history.setdefault(row.user_id, []).append(row)
+    return history
+
 @users_bp.route("/all-loans-v1", methods=["GET"])
 @admin_required
 def get_all_loans_v1(current_user):
     users = User.query.all()
+    history = archived_loans_by_user()
     output = []
     for user in users:
-        user_loans = []
+        user_loans = [archived_loan_item(row) for row in history.get(user.id, [])]
         for loan in user.loans:
             user_loans.append({
                 "loan_id": loan.loan_id,
@@ -100,15 +133,25 @@ def get_all_loans_v1(current_user):
         })
     return jsonify(output)
 
+# Báo cáo đọc tên user, loan và tên sách: ghi lên bảng nào trong số này cũng phải xóa bản cache
+ALL_LOANS_REPORT_TABLES = ["users", "loans", "books"]
+
+@tables_changed.connect
+def _evict_all_loans_report(sender, tables):
+    if tables.intersection(ALL_LOANS_REPORT_TABLES):
+        swr_invalidate("all_loans_report")
+
 @users_bp.route("/all-loans-v2", methods=["GET"])
 @admin_required
+@swr_cached("all_loans_report", soft_ttl=60, hard_ttl=300, bypass=include_archived)
 def get_all_loans_v2(current_user):
     users = User.query.options(
         joinedload(User.loans).joinedload(Loan.book)
     ).all()
+    history = archived_loans_by_user()
     output = []
     for user in users:
-        user_loans = []
+        user_loans = [archived_loan_item(row) for row in history.get(user.id, [])]
         for loan in user.loans:
             user_loans.append({
                 "loan_id": loan.loan_id,
@@ -130,7 +173,7 @@ def get_user_loans(current_user, user_id):
         joinedload(User.loans).joinedload(Loan.book)
     ).get_or_404(user_id)
     
-    user_loans = []
+    user_loans = [archived_loan_item(row) for row in archived_loans([user_id])] if include_archived() else []
     for loan in user.loans:
         user_loans.append({
             "loan_id": loan.loan_id,
@@ -0,0 +1,92 @@
+from datetime import date, timedelta
+from flask import current_app, request
+from flask.cli import with_appcontext
+from sqlalchemy import delete, insert, select
+from app.extension import db
+from app.models import Book, Loan, LoanArchive
+from app.utils.loan_events import emit_loan_change
+import click
+
+# Hot/cold: loan trả quá N ngày được chuyển từ loans sang loans_archive theo batch.
+# Các read path mặc định chỉ đọc loans (working set nhỏ), ?include_archived=true thì đọc thêm archive.
+# Rollup (app/utils/rollups.py) không đổi khi archive vì lịch sử vẫn còn, chỉ đổi chỗ.
+
+ARCHIVE_COLUMNS = ["loan_id", "book_id", "user_id", "checkout_date", "return_date"]
+
+
+def include_archived():
+    return request.args.get("include_archived", "").lower() in ("1", "true", "yes")
+
+
+def archive_returned_loans(older_than_days=None, batch_size=None):
+    """
+    Chuyển loan đã trả trước (hôm nay - older_than_days) sang loans_archive.
+    Mỗi batch là một transaction INSERT ... SELECT + DELETE, khóa ngắn và chạy lại được.
+    Trả về số loan đã chuyển.
+    """
+    if older_than_days is None:
+        older_than_days = current_app.config["LOANS_ARCHIVE_AFTER_DAYS"]
+    if batch_size is None:
+        batch_size = current_app.config["LOANS_ARCHIVE_BATCH_SIZE"]
+    cutoff = date.today() - timedelta(days=older_than_days)
+
+    moved = 0
+    user_ids = set()
+    while True:
+        rows = db.session.execute(
+            select(Loan.loan_id, Loan.user_id)
+            .where(Loan.return_date < cutoff)
+            .order_by(Loan.loan_id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        loan_ids = [row.loan_id for row in rows]
+        db.session.execute(insert(LoanArchive).from_select(
+            ARCHIVE_COLUMNS,
+            select(*[getattr(Loan, c) for c in ARCHIVE_COLUMNS]).where(Loan.loan_id.in_(loan_ids)),
+        ))
+        db.session.execute(
+            delete(Loan).where(Loan.loan_id.in_(loan_ids)).execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        moved += len(loan_ids)
+        user_ids.update(row.user_id for row in rows if row.user_id is not None)
+
+    if moved:
+        # my-loans/report của các user này đổi khi không include_archived
+        emit_loan_change(user_ids=user_ids)
+    return moved
+
+
+def archived_loans(user_ids=None):
+    """Các dòng (loan_id, book_id, user_id, title, checkout_date, return_date) trong loans_archive"""
+    statement = (
+        select(LoanArchive.loan_id, LoanArchive.book_id, LoanArchive.user_id, Book.title,
+               LoanArchive.checkout_date, LoanArchive.return_date)
+        .outerjoin(Book, Book.id == LoanArchive.book_id)
+        .order_by(LoanArchive.loan_id)
+    )
+    if user_ids is not None:
+        statement = statement.where(LoanArchive.user_id.in_(user_ids))
+    return db.session.execute(statement).all()
+
+
+def archived_loan_item(row):
+    """Cùng dạng với lịch sử mượn trong các endpoint"""
+    return {
+        "loan_id": row.loan_id,
+        "book_title": row.title,
+        "checkout_date": str(row.checkout_date),
+        "return_date": str(row.return_date)
+    }
+
+
+@click.command("archive-loans")
+@click.option("--days", type=int, default=None, help="Archive loan đã trả quá số ngày này")
+@click.option("--batch-size", type=int, default=None)
+@with_appcontext
+def archive_loans_command(days, batch_size):
+    """Chuyển loan đã trả lâu sang loans_archive"""
+    moved = archive_returned_loans(days, batch_size)
+    click.echo(f"Đã archive {moved} loan")
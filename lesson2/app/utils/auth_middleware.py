@@ -0,0 +1,69 @@
+from flask import g, jsonify, request
+from functools import wraps
+from app.utils.principal_cache import load_principal
+from app.utils.revocation import is_token_revoked
+from app.utils.token_cache import decode_token
+import jwt
+
+# Xác thực một lần cho mỗi request (before_request):
+# header -> decode JWT (có cache) -> kiểm tra blacklist -> principal (có cache) -> token_version
+# Kết quả nằm trên flask.g: g.principal, g.claims, g.token, hoặc g.auth_error nếu token hỏng.
+# token_required/admin_required chỉ còn là kiểm tra policy trên g, không decode/query lại.
+
+
+def authenticate_request():
+    g.principal = g.claims = g.token = g.auth_error = None
+
+    header = request.headers.get('Authorization')
+    if not header:
+        return
+    token = header[7:] if header.startswith('Bearer ') else header
+
+    try:
+        claims = decode_token(token)
+    except jwt.ExpiredSignatureError:
+        g.auth_error = "Token đã hết hạn"
+        return
+    except jwt.InvalidTokenError:
+        g.auth_error = "Token không hợp lệ"
+        return
+
+    # Chỉ access token được dùng làm Bearer; refresh token chỉ đổi được ở /auth/refresh
+    if claims.get('type') != 'access':
+        g.auth_error = "Token không hợp lệ"
+        return
+
+    if is_token_revoked(claims):
+        g.auth_error = "Token đã bị vô hiệu hóa"
+        return
+
+    principal = load_principal(claims.get('user_id'), claims.get('token_version'))
+    if principal is None:
+        g.auth_error = "User không tồn tại"
+        return
+    if claims.get('token_version') != principal.token_version:
+        g.auth_error = "Token đã cũ, vui lòng đăng nhập lại"
+        return
+
+    g.principal, g.claims, g.token = principal, claims, token
+
+
+def init_auth(app):
+    app.before_request(authenticate_request)
+
+
+def require(role=None):
+    """Policy: cần đăng nhập (và đúng role nếu có), view nhận principal làm tham số đầu"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if g.get('auth_error'):
+                return jsonify({"error": g.auth_error}), 401
+            principal = g.get('principal')
+            if principal is None:
+                return jsonify({"error": "Cần đăng nhập"}), 401
+            if role is not None and principal.role != role:
+                return jsonify({"error": "Bạn không có quyền thực hiện hành động này"}), 403
+            return f(principal, *args, **kwargs)
+        return decorated
+    return decorator
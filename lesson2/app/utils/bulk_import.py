@@ -0,0 +1,144 @@
+from datetime import datetime
+from sqlalchemy import insert
+from app.extension import db
+from app.models import Book
+import csv
+import io
+import json
+
+# Import sách hàng loạt: đọc body theo dòng (không buffer cả file),
+# validate từng dòng, insert theo batch bằng executemany hoặc COPY (Postgres)
+
+TRUE_VALUES = {"1", "true", "yes", "y"}
+FALSE_VALUES = {"0", "false", "no", "n"}
+
+
+INVALID_UTF8 = "Dòng chứa byte không phải UTF-8"
+
+
+def iter_records(stream, fmt):
+    """Sinh (số dòng, dict) hoặc (số dòng, lỗi dạng str) từ stream NDJSON/CSV"""
+    # Byte lỗi thành U+FFFD thay vì raise giữa chừng, dòng chứa nó bị báo lỗi riêng
+    text = io.TextIOWrapper(stream, encoding="utf-8", errors="replace", newline="")
+    if fmt == "csv":
+        # Dòng 1 là header
+        for line_no, row in enumerate(csv.DictReader(text), start=2):
+            if any("\ufffd" in (value or "") for value in row.values() if isinstance(value, str)):
+                yield line_no, INVALID_UTF8
+                continue
+            yield line_no, row
+        return
+
+    for line_no, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        if "\ufffd" in line:
+            yield line_no, INVALID_UTF8
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_no, "JSON không hợp lệ"
+            continue
+        yield line_no, record if isinstance(record, dict) else "Mỗi dòng phải là một object"
+
+
+def _scalar(record, field, default=None):
+    """Giá trị của field, chỉ nhận str/số/bool (list, object -> ValueError)"""
+    value = record.get(field, default)
+    if value is not None and not isinstance(value, (str, int, float, bool)):
+        raise ValueError(f"{field} không hợp lệ")
+    return value
+
+
+def parse_book(record):
+    """Chuẩn hóa một record thành các cột của books, sai thì raise ValueError"""
+    title = _scalar(record, "title")
+    if isinstance(title, bool):
+        raise ValueError("title không hợp lệ")
+    title = str(title).strip() if title is not None else ""
+    if not title:
+        raise ValueError("Thiếu title")
+
+    author = _scalar(record, "author")
+    if isinstance(author, bool):
+        raise ValueError("author không hợp lệ")
+    author = (str(author).strip() or None) if author is not None else None
+
+    is_available = _scalar(record, "is_available", True)
+    if isinstance(is_available, str):
+        value = is_available.strip().lower()
+        if value in TRUE_VALUES or value == "":
+            is_available = True
+        elif value in FALSE_VALUES:
+            is_available = False
+        else:
+            raise ValueError("is_available không hợp lệ")
+
+    return {"title": title, "author": author, "is_available": bool(is_available)}
+
+
+def _copy_rows(rows):
+    """COPY FROM STDIN qua connection psycopg2 của session (cùng transaction)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    now = datetime.utcnow()
+    for row in rows:
+        # Ô rỗng không quote = NULL trong COPY csv
+        writer.writerow([row["title"], row["author"], row["is_available"], now, 1])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(
+        "COPY books (title, author, is_available, updated_at, row_version) FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+
+
+def insert_batch(rows):
+    """Insert một batch trong một transaction"""
+    if db.engine.dialect.name == "postgresql":
+        _copy_rows(rows)
+    else:
+        db.session.execute(insert(Book), rows)
+    db.session.commit()
+
+
+def import_books(stream, fmt, batch_size, max_errors=100):
+    """
+    Trả về dict tổng kết: inserted, failed, batches, errors (tối đa max_errors lỗi đầu).
+    Batch lỗi ở DB bị rollback, các batch trước đó vẫn được giữ.
+    """
+    result = {"inserted": 0, "failed": 0, "batches": 0, "errors": []}
+
+    def record_error(line_no, message):
+        result["failed"] += 1
+        if len(result["errors"]) < max_errors:
+            result["errors"].append({"line": line_no, "error": message})
+
+    def flush(batch):
+        try:
+            insert_batch([row for _, row in batch])
+            result["inserted"] += len(batch)
+        except Exception as e:
+            db.session.rollback()
+            for line_no, _ in batch:
+                record_error(line_no, f"Lỗi khi ghi batch: {e.__class__.__name__}")
+        result["batches"] += 1
+
+    batch = []
+    for line_no, record in iter_records(stream, fmt):
+        if isinstance(record, str):
+            record_error(line_no, record)
+            continue
+        try:
+            batch.append((line_no, parse_book(record)))
+        except ValueError as e:
+            record_error(line_no, str(e))
+            continue
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    return result
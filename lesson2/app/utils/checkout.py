@@ -0,0 +1,74 @@
+from datetime import datetime
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError
+from app.extension import db
+from app.models import Book
+import random
+import time
+
+# Checkout không race: "kiểm tra rồi ghi" được gộp thành một câu UPDATE có điều kiện
+#   UPDATE books SET is_available = false WHERE id IN (...) AND is_available = true RETURNING id
+# Hai người mượn cùng lúc thì chỉ một UPDATE khớp dòng, người kia nhận conflict.
+# Không cần SELECT ... FOR UPDATE: bản thân UPDATE đã giữ row lock đến khi commit.
+
+CHECKOUT_RETRIES = 3
+
+
+def claim_books(book_ids):
+    """
+    Đánh dấu các sách còn trống là đã mượn, trả về set id claim được.
+    row_version/updated_at tăng ngay trong câu UPDATE này.
+    """
+    if not book_ids:
+        return set()
+    statement = (
+        update(Book)
+        .where(Book.id.in_(book_ids), Book.is_available == True)  # noqa: E712
+        .values(is_available=False, row_version=Book.row_version + 1, updated_at=datetime.utcnow())
+        .returning(Book.id)
+        .execution_options(synchronize_session=False)
+    )
+    return {row.id for row in db.session.execute(statement)}
+
+
+def release_books(book_ids):
+    """Đánh dấu các sách là còn trống (khi trả), một câu UPDATE cho cả nhóm"""
+    if not book_ids:
+        return
+    db.session.execute(
+        update(Book)
+        .where(Book.id.in_(book_ids))
+        .values(is_available=True, row_version=Book.row_version + 1, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+
+
+def parse_id_list(data, key, max_size):
+    """
+    Đọc danh sách id từ body JSON, bỏ trùng nhưng giữ thứ tự.
+    Raise ValueError với thông báo cho client nếu không hợp lệ.
+    """
+    ids = (data or {}).get(key)
+    if not isinstance(ids, list) or not ids:
+        raise ValueError(f"Cần có {key} là danh sách không rỗng")
+    if any(not isinstance(i, int) or isinstance(i, bool) for i in ids):
+        raise ValueError(f"{key} chỉ gồm số nguyên")
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > max_size:
+        raise ValueError(f"Tối đa {max_size} {key} mỗi request")
+    return ids
+
+
+def run_with_retry(operation, attempts=CHECKOUT_RETRIES, base_delay=0.02):
+    """
+    Chạy operation trong transaction, thử lại khi DB báo lỗi tạm thời
+    (deadlock, serialization failure, SQLite database is locked) với backoff có jitter
+    """
+    for attempt in range(attempts):
+        try:
+            return operation()
+        except OperationalError:
+            db.session.rollback()
+            if attempt == attempts - 1:
+                raise
+            time.sleep(base_delay * (2 ** attempt) * (1 + random.random()))
@@ -0,0 +1,68 @@
+from blinker import Namespace
+from flask import current_app, request, make_response
+from functools import wraps
+from app.extension import cache
+import hashlib
+import time
+
+# ETag cho endpoint danh sách = hash(change counter của các bảng liên quan + query đã chuẩn hóa)
+# Client gửi lại If-None-Match khớp -> 304 mà không chạy query trang
+# Endpoint có cache body riêng (SWR...) phải connect tables_changed để xóa body cùng lúc đổi counter,
+# nếu không ETag mới sẽ được gắn lên body cũ và client giữ bản cũ qua 304.
+
+_signals = Namespace()
+tables_changed = _signals.signal("tables-changed")
+
+
+def _counter_key(table):
+    return f"change_counter:{table}"
+
+
+def table_versions(tables):
+    """Counter hiện tại của các bảng, counter mất (bị evict) thì khởi tạo giá trị mới"""
+    values = cache.get_many(*[_counter_key(t) for t in tables])
+    versions = []
+    for table, value in zip(tables, values):
+        if value is None:
+            value = time.time_ns()
+            cache.set(_counter_key(table), value, timeout=0)
+        versions.append(value)
+    return versions
+
+
+def bump_tables(*tables):
+    """Gọi sau mọi thao tác ghi lên các bảng: mọi ETag danh sách liên quan đổi"""
+    # Xóa cache body trước khi đổi counter: request đọc được counter mới chắc chắn không gặp body cũ
+    tables_changed.send(current_app._get_current_object(), tables=set(tables))
+    for table in tables:
+        cache.set(_counter_key(table), time.time_ns(), timeout=0)
+
+
+def collection_etag(tables, query_key):
+    raw = f"{query_key}|" + "|".join(str(v) for v in table_versions(tables))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def conditional_collection(tables, key_func, headers=None):
+    """
+    Decorator: gắn ETag cho response danh sách và trả 304 khi If-None-Match khớp.
+    `headers` là các header cache (Cache-Control, Vary...) gửi kèm 304.
+    Phải đứng ngoài các decorator cache/query để 304 không tốn query nào.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            # Đọc counter trước khi query: ghi xen giữa chỉ làm ETag cũ đi, không sai dữ liệu
+            etag = collection_etag(tables, key_func())
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+                response.set_etag(etag)
+                response.headers.update(headers or {})
+                return response
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return decorated
+    return decorator
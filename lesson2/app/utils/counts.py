@@ -0,0 +1,86 @@
+from flask import current_app
+from sqlalchemy import text
+from app.extension import db, cache
+import time
+
+# Các chế độ đếm client có thể chọn qua ?total=
+COUNT_MODES = ("exact", "estimate", "none")
+
+
+def _generation(table):
+    """
+    Thế hệ của các tổng có filter, đổi mỗi khi dữ liệu đổi theo kiểu không cộng dồn được.
+    Là mốc time_ns: key bị evict thì khởi tạo mốc mới thay vì quay về thế hệ cũ
+    """
+    key = f"count_gen:{table}"
+    generation = cache.get(key)
+    if generation is None:
+        generation = time.time_ns()
+        cache.set(key, generation, timeout=0)
+    return generation
+
+
+def count_key(table, filters=None):
+    """
+    Cache key cho tổng số dòng:
+    - Không filter: count:books (bị xóa khi thêm/bớt dòng)
+    - Có filter:    count:books:g<gen>:author=x (hết hiệu lực khi tăng generation)
+    """
+    if not filters:
+        return f"count:{table}"
+    parts = "&".join(f"{k}={v}" for k, v in sorted(filters.items()))
+    return f"count:{table}:g{_generation(table)}:{parts}"
+
+
+def _planner_estimate(table):
+    """Ước lượng số dòng từ thống kê của planner (chỉ có trên Postgres)"""
+    if db.engine.dialect.name != "postgresql":
+        return None
+    estimate = db.session.execute(
+        text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:t)"),
+        {"t": table}
+    ).scalar()
+    # reltuples = -1 khi bảng chưa được ANALYZE
+    return estimate if estimate is not None and estimate >= 0 else None
+
+
+def get_total(query, table, filters=None, mode="exact", count_func=None):
+    """
+    Trả về tổng số dòng cho query theo chế độ:
+    - exact:    đọc từ cache, chỉ COUNT(*) khi cache trống
+    - estimate: thống kê planner trên Postgres, hoặc counter trong cache (SQLite)
+    - none:     không đếm, trả None
+    count_func thay cho query.count() khi nguồn đếm không phải ORM query (vd search index)
+    """
+    if mode == "none":
+        return None
+
+    key = count_key(table, filters)
+    total = cache.get(key)
+    if total is not None:
+        return total
+
+    if mode == "estimate" and not filters:
+        estimate = _planner_estimate(table)
+        if estimate is not None:
+            return estimate
+
+    total = count_func() if count_func else query.order_by(None).count()
+    cache.set(key, total, timeout=current_app.config.get("COUNT_CACHE_TIMEOUT", 300))
+    return total
+
+
+def adjust_total(table, delta):
+    """
+    Số dòng đổi delta: bỏ tổng không filter để lần đọc sau COUNT lại, và bỏ các tổng có filter.
+    Không cộng dồn bằng inc: key hết hạn giữa lúc kiểm tra và inc thì inc tạo key mới chỉ chứa delta
+    (trên Redis còn không có TTL), tổng sai mãi
+    """
+    if delta:
+        cache.delete(count_key(table))
+    invalidate_filtered_totals(table)
+
+
+def invalidate_filtered_totals(table):
+    """Đổi generation để mọi tổng có filter của bảng được tính lại"""
+    cache.set(f"count_gen:{table}", time.time_ns(), timeout=0)
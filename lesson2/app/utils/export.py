@@ -0,0 +1,74 @@
+from datetime import date, datetime
+from flask import Response, request, stream_with_context
+from app.extension import db
+import csv
+import io
+import json
+import zlib
+
+# Export dữ liệu dạng stream: server-side cursor (yield_per) -> generator NDJSON/CSV
+# -> (tùy chọn) gzip từng chunk. Bộ nhớ không phụ thuộc số dòng.
+
+EXPORT_BATCH_SIZE = 1000
+
+
+def _jsonable(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def iter_export(statement, columns, fmt, batch_size=EXPORT_BATCH_SIZE):
+    """Sinh các chunk text, mỗi chunk tương ứng một batch dòng từ cursor"""
+    result = db.session.execute(
+        statement.execution_options(yield_per=batch_size, stream_results=True)
+    )
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for rows in result.partitions():
+            writer.writerows([_jsonable(v) for v in row] for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        for rows in result.partitions():
+            yield "".join(
+                json.dumps({c: _jsonable(v) for c, v in zip(columns, row)}, ensure_ascii=False) + "\n"
+                for row in rows
+            )
+
+
+def gzip_chunks(chunks):
+    """Nén gzip tăng dần, không giữ cả file trong bộ nhớ"""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_response(statement, columns, filename):
+    """
+    Response stream cho statement, định dạng theo ?format=ndjson|csv (mặc định ndjson),
+    gzip khi client gửi Accept-Encoding: gzip
+    """
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in ("ndjson", "csv"):
+        fmt = "ndjson"
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+
+    chunks = iter_export(statement, columns, fmt)
+    use_gzip = "gzip" in request.accept_encodings
+    if use_gzip:
+        chunks = gzip_chunks(chunks)
+
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}.{fmt}"
+    response.headers["Cache-Control"] = "no-store"
+    if use_gzip:
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
@@ -0,0 +1,37 @@
+from flask import request
+from sqlalchemy.orm import load_only
+
+# Sparse fieldsets: ?fields=id,title
+# Mỗi resource có allow-list riêng, cột nhạy cảm (vd User.password) không bao giờ nằm trong đó.
+# Khóa chính luôn được trả về để client (và cache tag) định danh được bản ghi.
+
+BOOK_FIELDS = ("id", "title", "author", "is_available")
+USER_FIELDS = ("id", "name", "email", "role")
+LOAN_FIELDS = ("loan_id", "book_id", "book_title", "user_id", "user_name", "checkout_date", "return_date")
+
+
+class InvalidFields(ValueError):
+    """Client yêu cầu field không có trong allow-list"""
+
+
+def parse_fields(allowed, primary_key="id"):
+    """Đọc ?fields= và trả về tuple field theo thứ tự của allow-list"""
+    raw = request.args.get("fields", "")
+    if not raw.strip():
+        return allowed
+    requested = {f.strip() for f in raw.split(",") if f.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise InvalidFields(f"fields không hợp lệ: {sorted(unknown)}, cho phép: {list(allowed)}")
+    requested.add(primary_key)
+    return tuple(f for f in allowed if f in requested)
+
+
+def load_only_option(model, fields):
+    """load_only cho các field là cột của model (bỏ qua field dẫn xuất như book_title)"""
+    columns = [getattr(model, f) for f in fields if f in model.__table__.columns]
+    return load_only(*columns)
+
+
+def project(obj, fields):
+    return {f: getattr(obj, f) for f in fields}
@@ -0,0 +1,116 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+import multiprocessing
+import threading
+
+# Hash mật khẩu (scrypt/PBKDF2) chạy trong ProcessPoolExecutor riêng:
+# - Worker web không tự tính hash nặng, không tranh CPU/GIL với các request khác
+# - Giới hạn số việc đang chờ: quá HASHING_MAX_PENDING thì từ chối ngay (503) thay vì xếp hàng
+# - HASHING_WORKERS = 0: tính ngay trong process (dev/test)
+# - Process con tạo bằng forkserver/spawn, không fork từ server nhiều thread (có thể thừa hưởng lock đang bị giữ)
+
+
+class HashingBusy(Exception):
+    """Pool hash đang quá tải hoặc quá thời gian chờ, route trả 503"""
+
+
+class HashingService:
+    def __init__(self, workers, max_pending, timeout, method):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.method = method
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.stats = {"completed": 0, "rejected": 0, "timeouts": 0, "rehashed": 0}
+
+    def _get_executor(self):
+        # Tạo lười để không fork process con khi chỉ import app (CLI, test)
+        if self._executor is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context(method))
+        return self._executor
+
+    def run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise HashingBusy()
+            self._pending += 1
+            executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+            result = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # cancel() không dừng được việc đang chạy hoặc đã vào hàng của process con:
+            # việc vẫn giữ chỗ trong HASHING_MAX_PENDING tới khi future thật sự xong
+            future.cancel()
+            future.add_done_callback(self._release)
+            with self._lock:
+                self.stats["timeouts"] += 1
+            raise HashingBusy()
+        except BaseException:
+            self._release()
+            raise
+        self._release()
+        with self._lock:
+            self.stats["completed"] += 1
+        return result
+
+    def _release(self, future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def hash_password(self, password):
+        return self.run(generate_password_hash, password, self.method)
+
+    def verify_password(self, stored_hash, password):
+        return self.run(check_password_hash, stored_hash, password)
+
+    def needs_rehash(self, stored_hash):
+        """Hash lưu trong DB dùng method/tham số khác cấu hình hiện tại"""
+        return stored_hash.split("$", 1)[0] != self.method
+
+    def rehash_if_needed(self, stored_hash, password):
+        """
+        Gọi sau khi login đúng mật khẩu: trả về hash mới nếu tham số đã cũ, ngược lại None.
+        Pool bận thì bỏ qua, lần login sau làm lại.
+        """
+        if not self.needs_rehash(stored_hash):
+            return None
+        try:
+            new_hash = self.hash_password(password)
+        except HashingBusy:
+            return None
+        with self._lock:
+            self.stats["rehashed"] += 1
+        return new_hash
+
+    def report(self):
+        with self._lock:
+            return {**self.stats, "pending": self._pending, "max_pending": self.max_pending,
+                    "workers": self.workers, "method": self.method}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def init_hashing(app):
+    app.extensions["hashing"] = HashingService(
+        app.config["HASHING_WORKERS"],
+        app.config["HASHING_MAX_PENDING"],
+        app.config["HASHING_TIMEOUT"],
+        app.config["PASSWORD_HASH_METHOD"],
+    )
+
+
+def get_hashing():
+    return current_app.extensions["hashing"]
@@ -0,0 +1,62 @@
+from blinker import Namespace
+from flask import current_app
+from app.extension import cache
+from app.utils.collection_etag import bump_tables
+from app.utils.search_cache import bump_generation
+from app.utils.tag_cache import invalidate_tags
+from app.utils.versions import invalidate_book_version
+
+# Sự kiện "loan thay đổi": mọi write path của loans (mượn, trả, xóa, batch) phát một lần
+# kèm đúng user_ids và book_ids bị ảnh hưởng. Các subscriber bên dưới xóa cache tương ứng,
+# muốn thêm cache mới phụ thuộc loans thì chỉ cần connect thêm subscriber.
+
+_signals = Namespace()
+loan_changed = _signals.signal("loan-changed")
+
+
+def user_loans_key(user_id, archived=False):
+    return f"user_loans_{user_id}_archived" if archived else f"user_loans_{user_id}"
+
+
+def user_loans_tag(user_id):
+    return f"user_loans:{user_id}"
+
+
+def emit_loan_change(user_ids=(), book_ids=()):
+    """Gọi sau khi commit, một lần cho mỗi request ghi"""
+    loan_changed.send(
+        current_app._get_current_object(),
+        user_ids=sorted(set(user_ids)),
+        book_ids=sorted(set(book_ids)),
+    )
+
+
+def evict_user_loans(*user_ids):
+    """Xóa cache /loans/my-loans của các user (cũng dùng khi đổi tên user)"""
+    if user_ids:
+        cache.delete_many(*[user_loans_key(user_id, archived)
+                            for user_id in user_ids for archived in (False, True)])
+        # Đổi cả tag: request đang đọc dở không ghi lại bản cũ sau khi key đã bị xóa
+        invalidate_tags(*[user_loans_tag(user_id) for user_id in user_ids])
+
+
+@loan_changed.connect
+def _evict_user_caches(sender, user_ids, book_ids):
+    evict_user_loans(*user_ids)
+
+
+@loan_changed.connect
+def _evict_loan_views(sender, user_ids, book_ids):
+    # /loans/active và báo cáo all-loans xóa body qua tables_changed
+    bump_tables("loans")
+
+
+@loan_changed.connect
+def _evict_book_availability(sender, user_ids, book_ids):
+    if not book_ids:
+        return
+    invalidate_tags(*[f"book:{book_id}" for book_id in book_ids])
+    for book_id in book_ids:
+        invalidate_book_version(book_id)
+    bump_generation()
+    bump_tables("books")
@@ -0,0 +1,127 @@
+from collections import namedtuple
+from datetime import date, datetime
+from flask import current_app
+from sqlalchemy import tuple_
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+
+# Kết quả của một trang keyset
+KeysetPage = namedtuple("KeysetPage", [
+    "items", "has_next", "has_prev", "next_cursor", "prev_cursor"
+])
+
+
+class InvalidCursor(ValueError):
+    """Cursor bị sửa, sai định dạng hoặc không khớp kiểu sắp xếp"""
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload):
+    """HMAC-SHA256 với SECRET_KEY, cắt còn 16 bytes cho cursor ngắn"""
+    key = current_app.config["SECRET_KEY"].encode()
+    return hmac.new(key, payload, hashlib.sha256).digest()[:16]
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Không encode được {type(value).__name__} vào cursor")
+
+
+def _restore(column, value):
+    """Đưa giá trị trong cursor về kiểu Python của cột (ngày tháng được lưu dạng ISO)"""
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if value is not None and python_type in (date, datetime):
+        return python_type.fromisoformat(value)
+    return value
+
+
+def encode_cursor(sort, direction, values):
+    """Đóng gói (sort, hướng, bộ giá trị sắp xếp) thành cursor có chữ ký"""
+    payload = json.dumps([sort, direction, list(values)], separators=(",", ":"),
+                         default=_json_default).encode()
+    return f"{_b64encode(payload)}.{_b64encode(_sign(payload))}"
+
+
+def decode_cursor(cursor, sort):
+    """Kiểm tra chữ ký và trả về (direction, values)"""
+    try:
+        body, signature = cursor.split(".")
+        payload = _b64decode(body)
+        if not hmac.compare_digest(_sign(payload), _b64decode(signature)):
+            raise InvalidCursor("Cursor không hợp lệ")
+        cursor_sort, direction, values = json.loads(payload)
+    except (ValueError, TypeError, binascii.Error):
+        raise InvalidCursor("Cursor không hợp lệ")
+
+    if cursor_sort != sort or direction not in ("next", "prev"):
+        raise InvalidCursor("Cursor không khớp với kiểu sắp xếp")
+    return direction, values
+
+
+def decode_keyset(cursor, sort, columns):
+    """decode_cursor + kiểm tra số giá trị và đưa về kiểu của từng cột"""
+    direction, values = decode_cursor(cursor, sort)
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise InvalidCursor("Cursor không khớp với kiểu sắp xếp")
+    try:
+        return direction, [_restore(c, v) for c, v in zip(columns, values)]
+    except (TypeError, ValueError):
+        raise InvalidCursor("Cursor không hợp lệ")
+
+
+def keyset_paginate(query, columns, sort, limit, cursor=None):
+    """
+    Keyset pagination trên bộ cột `columns` (cột cuối phải là khóa duy nhất).
+    - Trang sau:  WHERE (c1, c2) > (v1, v2) ORDER BY c1, c2
+    - Trang trước: WHERE (c1, c2) < (v1, v2) ORDER BY c1 DESC, c2 DESC
+    Mỗi trang chỉ là một lần quét khoảng trên index, không phụ thuộc độ sâu.
+    `query` có thể là query một entity hoặc query nhiều cột (db.session.query(c1, c2...)).
+    """
+    direction, values = "next", None
+    if cursor:
+        direction, values = decode_keyset(cursor, sort, columns)
+
+    key = tuple_(*columns) if len(columns) > 1 else columns[0]
+    if values is not None:
+        bound = tuple_(*values) if len(columns) > 1 else values[0]
+
+    if direction == "next":
+        if values is not None:
+            query = query.filter(key > bound)
+        query = query.order_by(*columns)
+    else:
+        query = query.filter(key < bound).order_by(*[c.desc() for c in columns])
+
+    # Lấy kèm giá trị sort để dựng cursor, +1 dòng để biết còn trang không
+    rows = query.add_columns(*columns).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == "prev":
+        rows.reverse()
+
+    if direction == "next":
+        has_next, has_prev = has_more, values is not None
+    else:
+        has_next, has_prev = True, has_more
+
+    # Query một entity -> item là entity, query nhiều cột -> item là tuple các cột đó
+    width = len(rows[0]) - len(columns) if rows else 1
+    items = [row[0] if width == 1 else tuple(row[:width]) for row in rows]
+    next_cursor = encode_cursor(sort, "next", rows[-1][width:]) if rows and has_next else None
+    prev_cursor = encode_cursor(sort, "prev", rows[0][width:]) if rows and has_prev else None
+
+    return KeysetPage(items, has_next, has_prev, next_cursor, prev_cursor)
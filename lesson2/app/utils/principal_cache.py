@@ -0,0 +1,83 @@
+from collections import OrderedDict, namedtuple
+from flask import current_app
+from app.extension import db
+from app.models import User
+import threading
+import time
+
+# Cache principal trong process cho bước xác thực (auth_middleware):
+# - Key (user_id, token_version): token cũ (version cũ) không bao giờ trúng entry mới
+# - Chỉ giữ các field policy cần, TTL ngắn + giới hạn LRU
+# - Mỗi worker một bản: write path gọi invalidate_principal, worker khác tự hết hạn sau TTL
+
+Principal = namedtuple("Principal", ["id", "name", "email", "role", "token_version"])
+
+
+class PrincipalCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, token_version):
+        key = (user_id, token_version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, principal):
+        key = (principal.id, principal.token_version)
+        with self._lock:
+            self._entries[key] = (principal, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == user_id]:
+                del self._entries[key]
+
+    def stats(self):
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def init_principal_cache(app):
+    app.extensions["principal_cache"] = PrincipalCache(
+        app.config["PRINCIPAL_CACHE_SIZE"], app.config["PRINCIPAL_CACHE_TTL"]
+    )
+
+
+def load_principal(user_id, token_version):
+    """
+    Principal của user hoặc None nếu user không tồn tại.
+    Chỉ cache khi version trong DB khớp token, token lệch version luôn đọc lại DB.
+    """
+    principal_cache = current_app.extensions["principal_cache"]
+    principal = principal_cache.get(user_id, token_version)
+    if principal is not None:
+        return principal
+
+    row = db.session.query(
+        User.id, User.name, User.email, User.role, User.token_version
+    ).filter(User.id == user_id).first()
+    if row is None:
+        return None
+    principal = Principal(*row)
+    if principal.token_version == token_version:
+        principal_cache.put(principal)
+    return principal
+
+
+def invalidate_principal(user_id):
+    """Gọi sau khi đổi role/tên/email, tăng token_version hoặc xóa user"""
+    current_app.extensions["principal_cache"].invalidate(user_id)
@@ -0,0 +1,208 @@
+from collections import OrderedDict
+from flask import current_app, g, jsonify, request
+from app.utils.token_cache import decode_token
+import jwt
+import math
+import threading
+import time
+
+# Rate limit kiểu token bucket, chạy trong before_request TRƯỚC bước xác thực:
+# - Bucket có `burst` token, nạp lại `rate` token mỗi `per` giây, mỗi request lấy 1 token
+# - Limit cấu hình theo blueprint hoặc endpoint (RATELIMIT_LIMITS), endpoint được ưu tiên
+# - Key: "ip" (địa chỉ client), "user" (user_id trong JWT, chỉ verify chữ ký, không query DB;
+#   không có token hợp lệ thì dùng ip), "route" (một bucket chung cho cả endpoint)
+# - Hết token -> 429 + Retry-After ngay, chưa chạm DB hay hash mật khẩu
+# - Backend: MemoryBucketStore (mỗi worker một bản) hoặc RedisBucketStore (chung, script Lua nguyên tử)
+# - Response có header RateLimit-Limit / RateLimit-Remaining / RateLimit-Reset
+
+
+def take_token(tokens, updated_at, now, rate, burst, cost=1):
+    """
+    Một bước token bucket: trả về (tokens mới, allowed, retry_after, reset_after).
+    tokens=None nghĩa là bucket mới (đầy). Script Lua của RedisBucketStore làm đúng phép tính này.
+    """
+    if tokens is None:
+        tokens, updated_at = burst, now
+    tokens = min(burst, tokens + max(0.0, now - updated_at) * rate)
+    if tokens >= cost:
+        tokens -= cost
+        allowed, retry_after = True, 0.0
+    else:
+        allowed, retry_after = False, (cost - tokens) / rate
+    return tokens, allowed, retry_after, (burst - tokens) / rate
+
+
+class MemoryBucketStore:
+    """Bucket trong RAM của process, LRU giới hạn số key (key bị đẩy ra coi như bucket đầy)"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (None, None))
+            tokens, allowed, retry_after, reset_after = take_token(tokens, updated_at, now, rate, burst, cost)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed, tokens, retry_after, reset_after
+
+    def size(self):
+        return len(self._buckets)
+
+
+# KEYS[1] = key bucket; ARGV = rate, burst, cost. Dùng giờ của Redis để các worker cùng một đồng hồ.
+# Key tự hết hạn khi bucket đã nạp đầy lại.
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+local reset_after = (burst - tokens) / rate
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(reset_after * 1000) + 1000)
+return {allowed, tostring(tokens), tostring(retry_after), tostring(reset_after)}
+"""
+
+
+class RedisBucketStore:
+    """
+    Bucket dùng chung giữa các worker/máy. Mỗi lần lấy token là một lần chạy script (nguyên tử trong Redis).
+    client chỉ cần có register_script(source) như redis-py.
+    """
+
+    def __init__(self, client, prefix="ratelimit:"):
+        self.prefix = prefix
+        self._script = client.register_script(_TAKE_SCRIPT)
+
+    def take(self, key, rate, burst, cost=1):
+        allowed, tokens, retry_after, reset_after = self._script(
+            keys=[self.prefix + key], args=[rate, burst, cost]
+        )
+        return bool(int(allowed)), float(tokens), float(retry_after), float(reset_after)
+
+    def size(self):
+        return None
+
+
+class RateLimiter:
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self.stats = {"allowed": 0, "limited": 0, "errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def hit(self, key, rate, burst):
+        """(allowed, remaining, retry_after, reset_after); backend lỗi thì cho qua (fail open)"""
+        try:
+            result = self.store.take(key, rate, burst)
+        except Exception:
+            current_app.logger.exception("Rate limit backend lỗi, bỏ qua limit")
+            self._count("errors")
+            return None
+        self._count("allowed" if result[0] else "limited")
+        return result
+
+    def report(self):
+        with self._lock:
+            return {**self.stats, "backend": type(self.store).__name__, "keys": self.store.size()}
+
+
+def _create_store(app):
+    url = app.config.get("RATELIMIT_STORAGE_URL")
+    if not url:
+        return MemoryBucketStore(app.config["RATELIMIT_MEMORY_SIZE"])
+    import redis  # Chỉ cần cài khi dùng backend chung
+    return RedisBucketStore(redis.Redis.from_url(url))
+
+
+def _find_limit(limits):
+    """(scope, limit) của request: theo endpoint trước, sau đó theo blueprint"""
+    if request.endpoint in limits:
+        return request.endpoint, limits[request.endpoint]
+    if request.blueprint in limits:
+        return request.blueprint, limits[request.blueprint]
+    return None, None
+
+
+def _client_ip():
+    return request.remote_addr or "unknown"
+
+
+def _user_key():
+    header = request.headers.get("Authorization", "")
+    token = header[7:] if header.startswith("Bearer ") else header
+    if token:
+        try:
+            return f"user:{decode_token(token)['user_id']}"
+        except (jwt.InvalidTokenError, KeyError, TypeError):
+            pass
+    return f"ip:{_client_ip()}"
+
+
+def _bucket_key(scope, kind):
+    if kind == "route":
+        return f"route:{request.endpoint}"
+    if kind == "user":
+        return f"{scope}:{_user_key()}"
+    return f"{scope}:ip:{_client_ip()}"
+
+
+def check_rate_limit():
+    if not current_app.config.get("RATELIMIT_ENABLED") or request.method == "OPTIONS":
+        return None
+    scope, limit = _find_limit(current_app.config["RATELIMIT_LIMITS"])
+    if limit is None:
+        return None
+
+    rate = limit["rate"] / limit.get("per", 1)
+    burst = limit.get("burst", limit["rate"])
+    result = current_app.extensions["rate_limiter"].hit(_bucket_key(scope, limit.get("key", "ip")), rate, burst)
+    if result is None:
+        return None
+    allowed, remaining, retry_after, reset_after = result
+    g.rate_limit = (burst, int(remaining), math.ceil(reset_after))
+    if allowed:
+        return None
+
+    response = jsonify({"error": "Quá nhiều request, vui lòng thử lại sau"})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def add_rate_limit_headers(response):
+    info = g.get("rate_limit")
+    if info is not None:
+        limit, remaining, reset = info
+        response.headers["RateLimit-Limit"] = str(limit)
+        response.headers["RateLimit-Remaining"] = str(remaining)
+        response.headers["RateLimit-Reset"] = str(reset)
+    return response
+
+
+def init_rate_limit(app):
+    """Gọi trước init_auth để limit chạy trước bước xác thực"""
+    app.extensions["rate_limiter"] = RateLimiter(_create_store(app))
+    app.before_request(check_rate_limit)
+    app.after_request(add_rate_limit_headers)
@@ -0,0 +1,108 @@
+from datetime import datetime
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, select, update
+from app.extension import db
+from app.models import RefreshTokenFamily
+import click
+import uuid
+
+# Refresh token xoay vòng theo family (một family = một phiên đăng nhập):
+# - Login tạo family, claim "fid" của refresh token trỏ tới family
+# - /auth/refresh: UPDATE ... WHERE current_jti = jti cũ (compare-and-set) -> thay jti mới
+# - CAS trượt mà family còn sống với jti khác = token cũ bị dùng lại -> thu hồi cả family (một UPDATE)
+# - Kiểm tra luôn theo khóa chính, không phụ thuộc số phiên của user; không cần đọc dòng users
+# - Các hàm ghi không commit, route commit cùng transaction của nó
+# - Family hết hạn được xóa theo batch: flask purge-refresh-tokens
+
+
+def _live(family_id):
+    return (
+        (RefreshTokenFamily.family_id == family_id)
+        & (RefreshTokenFamily.revoked.is_(False))
+        & (RefreshTokenFamily.expires_at > datetime.utcnow())
+    )
+
+
+def start_family(user_id, jti, expires_at):
+    """Tạo family cho refresh token đầu tiên của phiên, trả về family_id"""
+    family_id = str(uuid.uuid4())
+    db.session.add(RefreshTokenFamily(
+        family_id=family_id, user_id=user_id, current_jti=jti, expires_at=expires_at
+    ))
+    return family_id
+
+
+def rotate_family(family_id, old_jti, new_jti, expires_at):
+    """CAS jti hiện hành old_jti -> new_jti; False nếu token không còn là token hiện hành"""
+    result = db.session.execute(
+        update(RefreshTokenFamily)
+        .where(_live(family_id), RefreshTokenFamily.current_jti == old_jti)
+        .values(current_jti=new_jti, expires_at=expires_at)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def revoke_reused_family(family_id, jti):
+    """Gọi khi rotate thất bại: token cũ của family còn sống bị dùng lại -> thu hồi family, trả về True"""
+    result = db.session.execute(
+        update(RefreshTokenFamily)
+        .where(_live(family_id), RefreshTokenFamily.current_jti != jti)
+        .values(revoked=True)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def revoke_family(family_id):
+    db.session.execute(
+        update(RefreshTokenFamily)
+        .where(RefreshTokenFamily.family_id == family_id)
+        .values(revoked=True)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def revoke_user_families(user_id):
+    """Logout mọi thiết bị / xóa user: thu hồi mọi phiên của user"""
+    db.session.execute(
+        update(RefreshTokenFamily)
+        .where(RefreshTokenFamily.user_id == user_id, RefreshTokenFamily.revoked.is_(False))
+        .values(revoked=True)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def purge_expired_families(batch_size=None):
+    """Xóa family đã hết hạn (kể cả đã thu hồi), mỗi batch một transaction. Trả về số dòng đã xóa"""
+    if batch_size is None:
+        batch_size = current_app.config["REFRESH_TOKEN_GC_BATCH_SIZE"]
+    now = datetime.utcnow()
+
+    purged = 0
+    while True:
+        family_ids = db.session.execute(
+            select(RefreshTokenFamily.family_id)
+            .where(RefreshTokenFamily.expires_at <= now)
+            .limit(batch_size)
+        ).scalars().all()
+        if not family_ids:
+            break
+        db.session.execute(
+            delete(RefreshTokenFamily)
+            .where(RefreshTokenFamily.family_id.in_(family_ids))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        purged += len(family_ids)
+    return purged
+
+
+@click.command("purge-refresh-tokens")
+@click.option("--batch-size", type=int, default=None)
+@with_appcontext
+def purge_refresh_tokens_command(batch_size):
+    """Xóa các family refresh token đã hết hạn"""
+    purged = purge_expired_families(batch_size)
+    click.echo(f"Đã xóa {purged} family refresh token")
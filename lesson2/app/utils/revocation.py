@@ -0,0 +1,178 @@
+from flask import current_app
+from app.extension import cache
+import hashlib
+import math
+import threading
+import time
+
+# Thu hồi JWT (blacklist theo jti) có Bloom filter đứng trước:
+# - Cache chung (blacklist:<jti>) vẫn là nguồn sự thật
+# - Mỗi worker giữ Bloom filter trong RAM, chia bucket theo giờ hết hạn của token:
+#   token chỉ cần tra bucket của exp, bucket hết hạn thì bỏ cả bucket
+# - Filter nói "chắc chắn không có" -> bỏ qua cache; "có thể có" -> hỏi cache
+# - Đồng bộ giữa các worker: mỗi lần revoke ghi một dòng log có số thứ tự trong cache,
+#   (slot giành bằng cache.add), worker đọc phần log mới tối đa mỗi REVOCATION_SYNC_INTERVAL giây
+#   (token bị thu hồi ở worker khác có thể còn qua được trong khoảng đó)
+# - Cần CACHE_TYPE dùng chung giữa các worker (RedisCache...); với SimpleCache mỗi worker một log riêng
+
+_SEQ_KEY = "revocation:seq"
+_SYNC_CHUNK = 500
+_SYNC_PROBE = 8
+
+
+def _log_key(seq):
+    return f"revocation:log:{seq}"
+
+
+def _blacklist_key(jti):
+    return f"blacklist:{jti}"
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Double hashing: h1 + i*h2 từ một digest blake2b
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def estimated_fpr(self):
+        """Xác suất false positive lý thuyết với số phần tử hiện tại"""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+class RevocationFilter:
+    def __init__(self, bucket_seconds, capacity, error_rate, sync_interval):
+        self.bucket_seconds = bucket_seconds
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self._buckets = {}
+        self._seq = 0
+        self._next_sync = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"checks": 0, "definite_negatives": 0, "maybe": 0, "false_positives": 0}
+
+    def _bucket_id(self, exp):
+        return int(exp // self.bucket_seconds)
+
+    def _add(self, jti, exp):
+        bucket_id = self._bucket_id(exp)
+        bloom = self._buckets.get(bucket_id)
+        if bloom is None:
+            bloom = self._buckets[bucket_id] = BloomFilter(self.capacity, self.error_rate)
+        bloom.add(jti)
+
+    def _expire_buckets(self, now):
+        current = self._bucket_id(now)
+        for bucket_id in [b for b in self._buckets if b < current]:
+            del self._buckets[bucket_id]
+
+    def sync(self, force=False):
+        """Nạp các revoke mới từ log trong cache chung (tối đa mỗi sync_interval giây)"""
+        now = time.time()
+        with self._lock:
+            if not force and now < self._next_sync:
+                return
+            self._next_sync = now + self.sync_interval
+            latest = cache.get(_SEQ_KEY) or 0
+            # Đọc tới seq gợi ý, sau đó dò thêm từng chunk nhỏ phòng khi seq ghi trễ
+            while True:
+                if self._seq < latest:
+                    end = min(latest, self._seq + _SYNC_CHUNK)
+                else:
+                    end = self._seq + _SYNC_PROBE
+                entries = cache.get_many(*[_log_key(s) for s in range(self._seq + 1, end + 1)])
+                last = None
+                for seq, entry in enumerate(entries, start=self._seq + 1):
+                    # Dòng log hết hạn cùng token nên None nghĩa là token đã hết hạn
+                    if entry is not None:
+                        self._add(*entry)
+                        last = seq
+                if end <= latest:
+                    self._seq = end
+                elif last is not None:
+                    self._seq = last
+                else:
+                    break
+            self._expire_buckets(now)
+
+    def revoke(self, jti, exp):
+        remaining = int(exp - time.time())
+        if remaining <= 0:
+            return
+        cache.set(_blacklist_key(jti), True, timeout=remaining)
+        # Giành một slot log bằng add (nguyên tử), seq chỉ là gợi ý vị trí mới nhất
+        seq = (cache.get(_SEQ_KEY) or 0) + 1
+        while not cache.add(_log_key(seq), (jti, exp), timeout=remaining):
+            seq += 1
+        cache.set(_SEQ_KEY, seq, timeout=0)
+        with self._lock:
+            self._add(jti, exp)
+
+    def is_revoked(self, jti, exp):
+        self.sync()
+        with self._lock:
+            self.stats["checks"] += 1
+            bloom = self._buckets.get(self._bucket_id(exp))
+            if bloom is None or jti not in bloom:
+                self.stats["definite_negatives"] += 1
+                return False
+            self.stats["maybe"] += 1
+        revoked = bool(cache.get(_blacklist_key(jti)))
+        if not revoked:
+            with self._lock:
+                self.stats["false_positives"] += 1
+        return revoked
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+            negatives = stats["definite_negatives"] + stats["false_positives"]
+            stats["observed_fpr"] = round(stats["false_positives"] / negatives, 6) if negatives else 0.0
+            stats["buckets"] = {
+                bucket_id * self.bucket_seconds: {
+                    "items": bloom.count, "estimated_fpr": round(bloom.estimated_fpr(), 6)
+                }
+                for bucket_id, bloom in sorted(self._buckets.items())
+            }
+            stats["synced_seq"] = self._seq
+            return stats
+
+
+def init_revocation(app):
+    if app.config.get("CACHE_TYPE") == "SimpleCache" and not (app.testing or app.debug):
+        app.logger.warning("CACHE_TYPE=SimpleCache: thu hồi JWT không được đồng bộ giữa các worker")
+    app.extensions["revocation"] = RevocationFilter(
+        app.config["REVOCATION_BUCKET_SECONDS"],
+        app.config["REVOCATION_BLOOM_CAPACITY"],
+        app.config["REVOCATION_BLOOM_ERROR_RATE"],
+        app.config["REVOCATION_SYNC_INTERVAL"],
+    )
+
+
+def revoke_token(claims):
+    """Thu hồi token theo claims đã decode (cần jti và exp)"""
+    if claims.get("jti") and claims.get("exp"):
+        current_app.extensions["revocation"].revoke(claims["jti"], claims["exp"])
+
+
+def is_token_revoked(claims):
+    jti = claims.get("jti")
+    if not jti:
+        return False
+    return current_app.extensions["revocation"].is_revoked(jti, claims.get("exp", time.time()))
@@ -0,0 +1,191 @@
+from collections import Counter
+from datetime import date, timedelta
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import Integer, cast, delete, func, insert, literal, select, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.extension import db
+from app.models import Loan, LoanArchive, LoanDailyStat, LoanStatDelta, BookDailyStat, UserDailyStat
+import click
+
+# Rollup analytics cho loans: bảng tổng hợp theo ngày / (ngày, sách) / (ngày, user)
+# - Write path gọi record_* trước commit -> rollup luôn khớp với loans
+# - Tổng theo ngày là dòng chung của mọi giao dịch trong ngày: ghi thành delta append-only
+#   (loan_stat_deltas), `flask fold-loan-stats` gộp lại; theo sách/user thì upsert thẳng
+# - Dashboard đọc rollup: chi phí O(số ngày) thay vì quét toàn bộ loans
+# - `flask rebuild-rollups` tính lại từ đầu (backfill hoặc khi nghi lệch), gồm cả loans_archive
+
+
+def _upsert(model, keys, counters):
+    """
+    INSERT ... ON CONFLICT DO UPDATE cộng dồn, counters: {khóa: {cột: delta}}.
+    Gộp delta theo khóa trước vì Postgres không cho một câu upsert chạm một dòng hai lần.
+    """
+    if not counters:
+        return
+    insert_for = pg_insert if db.engine.dialect.name == "postgresql" else sqlite_insert
+    columns = sorted({c for deltas in counters.values() for c in deltas})
+    rows = [
+        {**dict(zip(keys, key)), **{c: deltas.get(c, 0) for c in columns}}
+        for key, deltas in counters.items()
+    ]
+    statement = insert_for(model).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=keys,
+        set_={c: model.__table__.c[c] + statement.excluded[c] for c in columns},
+    )
+    db.session.execute(statement)
+
+
+def _apply(checkouts=(), returns=(), sign=1):
+    """checkouts: (book_id, user_id, checkout_date), returns: (checkout_date, return_date)"""
+    daily, books, users = {}, Counter(), Counter()
+    for book_id, user_id, checkout_date in checkouts:
+        day = daily.setdefault((checkout_date,), Counter())
+        day["checkouts"] += sign
+        if book_id is not None:
+            books[(checkout_date, book_id)] += sign
+        if user_id is not None:
+            users[(checkout_date, user_id)] += sign
+    for checkout_date, return_date in returns:
+        day = daily.setdefault((return_date,), Counter())
+        day["returns"] += sign
+        day["loan_days"] += sign * (return_date - checkout_date).days
+
+    if daily:
+        db.session.execute(insert(LoanStatDelta), [
+            {"day": day, "checkouts": d["checkouts"], "returns": d["returns"], "loan_days": d["loan_days"]}
+            for (day,), d in daily.items()
+        ])
+    _upsert(BookDailyStat, ["day", "book_id"], {k: {"checkouts": v} for k, v in books.items()})
+    _upsert(UserDailyStat, ["day", "user_id"], {k: {"checkouts": v} for k, v in users.items()})
+
+
+def record_checkouts(rows):
+    """Gọi trong transaction mượn sách, rows: (book_id, user_id, checkout_date)"""
+    _apply(checkouts=rows)
+
+
+def record_returns(rows):
+    """Gọi trong transaction trả sách, rows: (checkout_date, return_date)"""
+    _apply(returns=rows)
+
+
+def forget_loan(loan):
+    """Trừ một loan bị xóa khỏi rollup"""
+    returns = [(loan.checkout_date, loan.return_date)] if loan.return_date else []
+    _apply(checkouts=[(loan.book_id, loan.user_id, loan.checkout_date)], returns=returns, sign=-1)
+
+
+def fold_loan_stats(batch_size=None):
+    """
+    Gộp loan_stat_deltas vào loan_daily_stats, mỗi batch một transaction. Trả về số delta đã gộp.
+    DELETE ... RETURNING nhận delta: hai lần fold chạy cùng lúc không gộp một delta hai lần
+    """
+    if batch_size is None:
+        batch_size = current_app.config["LOAN_STATS_FOLD_BATCH_SIZE"]
+
+    folded = 0
+    while True:
+        delta_ids = db.session.execute(
+            select(LoanStatDelta.id).order_by(LoanStatDelta.id).limit(batch_size)
+        ).scalars().all()
+        if not delta_ids:
+            break
+        rows = db.session.execute(
+            delete(LoanStatDelta)
+            .where(LoanStatDelta.id.in_(delta_ids))
+            .returning(LoanStatDelta.day, LoanStatDelta.checkouts, LoanStatDelta.returns, LoanStatDelta.loan_days)
+            .execution_options(synchronize_session=False)
+        ).all()
+        daily = {}
+        for row in rows:
+            day = daily.setdefault((row.day,), Counter())
+            day.update(checkouts=row.checkouts, returns=row.returns, loan_days=row.loan_days)
+        _upsert(LoanDailyStat, ["day"], daily)
+        db.session.commit()
+        folded += len(rows)
+    return folded
+
+
+def daily_totals(date_from, date_to):
+    """Subquery (day, checkouts, returns, loan_days) trong khoảng ngày: phần đã gộp + delta chưa gộp"""
+    columns = ("checkouts", "returns", "loan_days")
+    parts = union_all(*[
+        select(model.day, *[getattr(model, c) for c in columns]).where(model.day.between(date_from, date_to))
+        for model in (LoanDailyStat, LoanStatDelta)
+    ]).subquery()
+    return (
+        select(parts.c.day, *[func.sum(parts.c[c]).label(c) for c in columns])
+        .group_by(parts.c.day)
+        .subquery()
+    )
+
+
+def _loan_days(history):
+    """Số ngày giữa checkout_date và return_date theo dialect"""
+    if db.engine.dialect.name == "postgresql":
+        return history.c.return_date - history.c.checkout_date
+    return func.julianday(history.c.return_date) - func.julianday(history.c.checkout_date)
+
+
+def rebuild_rollups():
+    """Xóa và tính lại toàn bộ rollup từ loans + loans_archive bằng INSERT ... SELECT"""
+    for model in (LoanDailyStat, LoanStatDelta, BookDailyStat, UserDailyStat):
+        db.session.execute(delete(model))
+
+    columns = ["book_id", "user_id", "checkout_date", "return_date"]
+    history = union_all(
+        select(*[getattr(Loan, c) for c in columns]),
+        select(*[getattr(LoanArchive, c) for c in columns]),
+    ).subquery()
+
+    checkouts = select(history.c.checkout_date.label("day"), func.count().label("checkouts"),
+                       literal(0).label("returns"), literal(0).label("loan_days")) \
+        .group_by(history.c.checkout_date)
+    returns = select(history.c.return_date.label("day"), literal(0).label("checkouts"),
+                     func.count().label("returns"), func.sum(_loan_days(history)).label("loan_days")) \
+        .where(history.c.return_date.isnot(None)).group_by(history.c.return_date)
+    merged = checkouts.union_all(returns).subquery()
+    db.session.execute(insert(LoanDailyStat).from_select(
+        ["day", "checkouts", "returns", "loan_days"],
+        select(merged.c.day, func.sum(merged.c.checkouts), func.sum(merged.c.returns),
+               cast(func.sum(merged.c.loan_days), Integer)).group_by(merged.c.day),
+    ))
+    db.session.execute(insert(BookDailyStat).from_select(
+        ["day", "book_id", "checkouts"],
+        select(history.c.checkout_date, history.c.book_id, func.count())
+        .where(history.c.book_id.isnot(None)).group_by(history.c.checkout_date, history.c.book_id),
+    ))
+    db.session.execute(insert(UserDailyStat).from_select(
+        ["day", "user_id", "checkouts"],
+        select(history.c.checkout_date, history.c.user_id, func.count())
+        .where(history.c.user_id.isnot(None)).group_by(history.c.checkout_date, history.c.user_id),
+    ))
+    db.session.commit()
+    return db.session.scalar(select(func.count()).select_from(LoanDailyStat))
+
+
+def stats_range(args, default_days=30):
+    """Đọc ?from=&to= (YYYY-MM-DD), mặc định default_days ngày gần nhất, sai định dạng raise ValueError"""
+    date_to = date.fromisoformat(args["to"]) if args.get("to") else date.today()
+    date_from = date.fromisoformat(args["from"]) if args.get("from") else date_to - timedelta(days=default_days - 1)
+    return date_from, date_to
+
+
+@click.command("rebuild-rollups")
+@with_appcontext
+def rebuild_rollups_command():
+    """Tính lại các bảng rollup của loans"""
+    days = rebuild_rollups()
+    click.echo(f"Đã rebuild rollup cho {days} ngày")
+
+
+@click.command("fold-loan-stats")
+@click.option("--batch-size", type=int, default=None)
+@with_appcontext
+def fold_loan_stats_command(batch_size):
+    """Gộp delta thống kê theo ngày vào loan_daily_stats"""
+    folded = fold_loan_stats(batch_size)
+    click.echo(f"Đã gộp {folded} delta thống kê")
@@ -0,0 +1,49 @@
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from app.extension import db
+
+# create_all chỉ tạo bảng chưa có, không thêm cột/index mới vào bảng đã tồn tại
+# (vd volume Postgres của docker-compose). ensure_schema bù phần thiếu lúc khởi động, chạy lại được.
+
+# Cột thêm sau khi bảng đã có dữ liệu: {bảng: {cột: giá trị điền cho các dòng cũ}}
+ADDED_COLUMNS = {
+    "books": {
+        "updated_at": datetime.utcnow,
+        "row_version": 1,
+    },
+}
+
+
+def add_missing_columns(connection):
+    inspector = inspect(connection)
+    postgres = connection.dialect.name == "postgresql"
+    for table_name, backfills in ADDED_COLUMNS.items():
+        if not inspector.has_table(table_name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table_name)}
+        table = db.metadata.tables[table_name]
+        for name, backfill in backfills.items():
+            if name in existing:
+                continue
+            column_type = table.c[name].type.compile(dialect=connection.dialect)
+            if_not_exists = "IF NOT EXISTS " if postgres else ""
+            connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {if_not_exists}{name} {column_type}"))
+            value = backfill() if callable(backfill) else backfill
+            connection.execute(text(f"UPDATE {table_name} SET {name} = :value WHERE {name} IS NULL"),
+                               {"value": value})
+            # SQLite không đổi được ràng buộc cột sau khi tạo, chỉ Postgres thêm NOT NULL
+            if postgres and not table.c[name].nullable:
+                connection.execute(text(f"ALTER TABLE {table_name} ALTER COLUMN {name} SET NOT NULL"))
+
+
+def create_missing_indexes(connection):
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+def ensure_schema():
+    with db.engine.begin() as connection:
+        add_missing_columns(connection)
+        create_missing_indexes(connection)
@@ -0,0 +1,238 @@
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import text
+from app.extension import db
+from app.models import Book
+import threading
+
+# Search backend cho /books/author, tìm theo cả title và author, có xếp hạng.
+# Chọn qua config SEARCH_BACKEND: auto | postgres | sqlite_fts | memory
+# Mọi backend có cùng interface:
+#   search(q, limit, offset) -> list id đã xếp hạng
+#   count(q)                 -> tổng số kết quả
+#   index_book(book) / remove_book(book_id) -> gọi từ các write path
+
+
+class SearchBackend:
+    name = "base"
+
+    def __init__(self):
+        self._ready = False
+        self._lock = threading.RLock()
+
+    def ensure_ready(self):
+        """Khởi tạo index lần đầu dùng (lúc đó bảng books chắc chắn đã tồn tại)"""
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    self.setup()
+                    self._ready = True
+
+    def setup(self):
+        pass
+
+    def index_book(self, book):
+        pass
+
+    def remove_book(self, book_id):
+        pass
+
+    def rebuild(self):
+        """Sau khi ghi hàng loạt không qua index_book (vd bulk import)"""
+        pass
+
+
+# Biểu thức document, phải giống hệt biểu thức trong index để Postgres dùng được index
+PG_DOCUMENT = "(coalesce(title, '') || ' ' || coalesce(author, ''))"
+
+
+class PostgresSearch(SearchBackend):
+    """
+    pg_trgm + tsvector trên expression index:
+    - GIN trigram index phục vụ ILIKE '%q%' (không còn seq scan)
+    - GIN tsvector index phục vụ ranking theo từ
+    Index tự cập nhật theo bảng nên write path không cần làm gì.
+    """
+    name = "postgres"
+
+    def setup(self):
+        db.session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        db.session.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_books_search_trgm ON books "
+            f"USING gin ({PG_DOCUMENT} gin_trgm_ops)"
+        ))
+        db.session.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_books_search_tsv ON books "
+            f"USING gin (to_tsvector('simple', {PG_DOCUMENT}))"
+        ))
+        db.session.commit()
+
+    _WHERE = (
+        f"WHERE to_tsvector('simple', {PG_DOCUMENT}) @@ plainto_tsquery('simple', :q) "
+        f"OR {PG_DOCUMENT} ILIKE :pattern"
+    )
+
+    def _params(self, q):
+        escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return {"q": q, "pattern": f"%{escaped}%"}
+
+    def search(self, q, limit, offset):
+        rows = db.session.execute(text(
+            f"SELECT id FROM books {self._WHERE} "
+            f"ORDER BY ts_rank(to_tsvector('simple', {PG_DOCUMENT}), plainto_tsquery('simple', :q)) DESC, "
+            f"similarity({PG_DOCUMENT}, :q) DESC, id "
+            f"LIMIT :limit OFFSET :offset"
+        ), {**self._params(q), "limit": limit, "offset": offset})
+        return [row.id for row in rows]
+
+    def count(self, q):
+        return db.session.execute(
+            text(f"SELECT count(*) FROM books {self._WHERE}"), self._params(q)
+        ).scalar()
+
+
+class SqliteFtsSearch(SearchBackend):
+    """
+    SQLite FTS5 (tokenizer trigram) dạng external content trên bảng books.
+    Trigger giữ index đồng bộ với mọi thao tác ghi, kể cả ghi trực tiếp qua ORM.
+    Query ngắn hơn 3 ký tự không có trigram nên quét bảng FTS bằng LIKE.
+    """
+    name = "sqlite_fts"
+
+    def setup(self):
+        statements = [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5("
+            "title, author, content='books', content_rowid='id', tokenize='trigram')",
+            "CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN "
+            "INSERT INTO books_fts(rowid, title, author) VALUES (new.id, new.title, new.author); END",
+            "CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN "
+            "INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author); END",
+            "CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE ON books BEGIN "
+            "INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author); "
+            "INSERT INTO books_fts(rowid, title, author) VALUES (new.id, new.title, new.author); END",
+            # Đồng bộ các dòng đã có trước khi tạo index
+            "INSERT INTO books_fts(books_fts) VALUES ('rebuild')",
+        ]
+        for statement in statements:
+            db.session.execute(text(statement))
+        db.session.commit()
+
+    def _where(self, q):
+        if len(q) >= 3:
+            return "books_fts MATCH :q", {"q": '"' + q.replace('"', '""') + '"'}
+        escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return ("(title LIKE :pattern ESCAPE '\\' OR author LIKE :pattern ESCAPE '\\')",
+                {"pattern": f"%{escaped}%"})
+
+    def search(self, q, limit, offset):
+        where, params = self._where(q)
+        # bm25: điểm càng nhỏ càng liên quan, author có trọng số cao hơn title
+        order = "bm25(books_fts, 1.0, 2.0), rowid" if len(q) >= 3 else "rowid"
+        rows = db.session.execute(text(
+            f"SELECT rowid FROM books_fts WHERE {where} ORDER BY {order} LIMIT :limit OFFSET :offset"
+        ), {**params, "limit": limit, "offset": offset})
+        return [row[0] for row in rows]
+
+    def count(self, q):
+        where, params = self._where(q)
+        return db.session.execute(text(f"SELECT count(*) FROM books_fts WHERE {where}"), params).scalar()
+
+
+class MemorySearch(SearchBackend):
+    """
+    Inverted index trigram trong process (fallback khi không có index trong DB).
+    Build một lần từ DB, sau đó được các write path cập nhật.
+    Chỉ đúng khi chạy một worker, nhiều worker nên dùng backend trong DB.
+    """
+    name = "memory"
+
+    def __init__(self):
+        super().__init__()
+        self.docs = {}
+        self.postings = defaultdict(set)
+
+    @staticmethod
+    def _grams(value):
+        return {value[i:i + 3] for i in range(len(value) - 2)}
+
+    def setup(self):
+        for book in Book.query.with_entities(Book.id, Book.title, Book.author).yield_per(1000):
+            self.index_book(book)
+
+    def index_book(self, book):
+        with self._lock:
+            self._remove(book.id)
+            title, author = (book.title or "").lower(), (book.author or "").lower()
+            self.docs[book.id] = (title, author)
+            for gram in self._grams(title) | self._grams(author):
+                self.postings[gram].add(book.id)
+
+    def remove_book(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+
+    def rebuild(self):
+        # Xóa index, lần dùng sau build lại từ DB
+        with self._lock:
+            self.docs.clear()
+            self.postings.clear()
+            self._ready = False
+
+    def _remove(self, book_id):
+        old = self.docs.pop(book_id, None)
+        if old:
+            for gram in self._grams(old[0]) | self._grams(old[1]):
+                self.postings[gram].discard(book_id)
+
+    def _matches(self, q):
+        q = q.lower()
+        with self._lock:
+            grams = self._grams(q)
+            if grams:
+                candidates = set.intersection(*(self.postings.get(g, set()) for g in grams))
+            else:
+                candidates = set(self.docs)
+            scored = []
+            for book_id in candidates:
+                title, author = self.docs[book_id]
+                score = 2 * (q in author) + (q in title)
+                if score:
+                    scored.append((-score, book_id))
+        return [book_id for _, book_id in sorted(scored)]
+
+    def search(self, q, limit, offset):
+        return self._matches(q)[offset:offset + limit]
+
+    def count(self, q):
+        return len(self._matches(q))
+
+
+BACKENDS = {
+    "postgres": PostgresSearch,
+    "sqlite_fts": SqliteFtsSearch,
+    "memory": MemorySearch,
+}
+
+
+def init_search(app):
+    """Chọn search backend theo config và dialect của database"""
+    name = app.config.get("SEARCH_BACKEND", "auto")
+    if name == "auto":
+        uri = app.config.get("SQLALCHEMY_DATABASE_URI", "")
+        name = "postgres" if uri.startswith("postgres") else "memory"
+    app.extensions["search"] = BACKENDS[name]()
+
+
+def get_search():
+    """Backend của app hiện tại, nếu index trong DB không tạo được thì chuyển sang memory"""
+    backend = current_app.extensions["search"]
+    try:
+        backend.ensure_ready()
+    except Exception as e:
+        if isinstance(backend, MemorySearch):
+            raise
+        db.session.rollback()
+        current_app.logger.warning("Search backend %s lỗi (%s), dùng memory index", backend.name, e)
+        backend = current_app.extensions["search"] = MemorySearch()
+        backend.ensure_ready()
+    return backend
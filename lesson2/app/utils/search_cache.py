@@ -0,0 +1,68 @@
+from app.extension import cache
+import time
+
+# Cache kết quả search:
+# - Key chuẩn hóa: trim, gộp khoảng trắng, casefold -> "Martin", "martin ", "MARTIN" là một entry
+# - Kết quả rỗng cũng được cache (negative caching)
+# - Hết hiệu lực theo generation, đổi mỗi khi sách thay đổi
+# - Single-flight: chỉ một worker tính lại key đang thiếu, các worker khác
+#   trả bản cũ (nếu có) hoặc chờ một chút để lấy kết quả vừa tính
+
+GENERATION_KEY = "search_gen"
+
+
+def normalize_query(value):
+    return " ".join(value.split()).casefold()
+
+
+def current_generation():
+    """
+    Generation là một mốc time_ns, không phải bộ đếm: key bị evict thì khởi tạo mốc mới
+    (mọi entry cũ thành stale) thay vì quay về giá trị cũ và làm sống lại kết quả cũ
+    """
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = time.time_ns()
+        cache.set(GENERATION_KEY, generation, timeout=0)
+    return generation
+
+
+def bump_generation():
+    """Gọi từ các write path của sách: mọi kết quả search cũ thành stale"""
+    cache.set(GENERATION_KEY, time.time_ns(), timeout=0)
+
+
+def get_or_compute(key, compute, timeout=60, stale_timeout=300, lock_timeout=10, wait=2.0):
+    """
+    Trả về (value, status) với status là HIT, STALE hoặc MISS.
+    Entry được giữ thêm stale_timeout giây sau khi hết hạn để phục vụ bản cũ.
+    """
+    generation = current_generation()
+    entry = cache.get(key)
+    if entry is not None and entry["gen"] == generation and entry["expires"] > time.time():
+        return entry["value"], "HIT"
+
+    lock_key = f"lock:{key}"
+    locked = cache.add(lock_key, True, timeout=lock_timeout)
+    if not locked:
+        # Worker khác đang tính lại key này
+        if entry is not None:
+            return entry["value"], "STALE"
+        deadline = time.time() + wait
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None and entry["gen"] == generation:
+                return entry["value"], "HIT"
+
+    try:
+        value = compute()
+        cache.set(key, {
+            "gen": generation,
+            "value": value,
+            "expires": time.time() + timeout,
+        }, timeout=timeout + stale_timeout)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return value, "MISS"
@@ -0,0 +1,97 @@
+from collections import defaultdict
+from flask import make_response, copy_current_request_context, current_app
+from functools import wraps
+from app.extension import cache
+import threading
+import time
+
+# Stale-while-revalidate phía server:
+# - Trước soft_ttl: trả bản trong cache (HIT)
+# - Từ soft_ttl đến hard_ttl: trả ngay bản cũ (STALE), một thread nền tính lại
+# - Sau hard_ttl hoặc chưa có: tính đồng bộ (MISS)
+# Chỉ một worker được refresh mỗi key (lock trong cache), metrics đếm theo key.
+
+SWR_METRICS = defaultdict(lambda: defaultdict(int))
+_refresh_threads = {}
+
+
+def swr_invalidate(*keys):
+    """Gọi từ write path: lần đọc sau tính lại đồng bộ"""
+    for key in keys:
+        # Đổi generation để refresh đang chạy dở không ghi đè bằng dữ liệu cũ
+        cache.set(f"swr_gen:{key}", time.time_ns(), timeout=0)
+        cache.delete(f"swr:{key}")
+
+
+def join_refresh(key, timeout=None):
+    """Chờ thread refresh nền của key (nếu có) chạy xong"""
+    thread = _refresh_threads.get(key)
+    if thread is not None:
+        thread.join(timeout)
+
+
+def _store(key, response, soft_ttl, hard_ttl, generation):
+    if cache.get(f"swr_gen:{key}") != generation:
+        return
+    headers = {k: v for k, v in response.headers.items() if k not in ('Content-Length', 'Set-Cookie')}
+    cache.set(f"swr:{key}", {
+        "body": response.get_data(),
+        "headers": headers,
+        "fresh_until": time.time() + soft_ttl,
+    }, timeout=hard_ttl)
+
+
+def swr_cached(key, soft_ttl, hard_ttl, lock_timeout=30, bypass=None):
+    """
+    Decorator SWR cho view trả JSON, chỉ cache response 200.
+    bypass(): True thì gọi thẳng view, không đọc/ghi cache (biến thể hiếm dùng của request)
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if bypass is not None and bypass():
+                return f(*args, **kwargs)
+            metrics = SWR_METRICS[key]
+            generation = cache.get(f"swr_gen:{key}")
+            entry = cache.get(f"swr:{key}")
+
+            if entry is not None:
+                if entry["fresh_until"] > time.time():
+                    status = "HIT"
+                else:
+                    status = "STALE"
+                    lock_key = f"swr_lock:{key}"
+                    if cache.add(lock_key, True, timeout=lock_timeout):
+                        @copy_current_request_context
+                        def refresh():
+                            started = time.time()
+                            try:
+                                response = make_response(f(*args, **kwargs))
+                                if response.status_code == 200:
+                                    _store(key, response, soft_ttl, hard_ttl, generation)
+                                metrics["refreshes"] += 1
+                            except Exception:
+                                metrics["refresh_errors"] += 1
+                                current_app.logger.exception("SWR refresh lỗi cho %s", key)
+                            finally:
+                                metrics["last_refresh_ms"] = int((time.time() - started) * 1000)
+                                cache.delete(lock_key)
+
+                        thread = threading.Thread(target=refresh, daemon=True)
+                        _refresh_threads[key] = thread
+                        thread.start()
+
+                metrics[status.lower()] += 1
+                response = make_response(entry["body"])
+                response.headers.update(entry["headers"])
+                response.headers['X-Cache-Status'] = status
+                return response
+
+            metrics["miss"] += 1
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                _store(key, response, soft_ttl, hard_ttl, generation)
+            response.headers['X-Cache-Status'] = 'MISS'
+            return response
+        return decorated
+    return decorator
@@ -0,0 +1,91 @@
+from flask import request, make_response
+from functools import wraps
+from app.extension import cache
+import time
+
+# Cache có gắn tag:
+# - Mỗi tag (vd "books:list", "book:5") có một version lưu trong cache
+# - Entry lưu kèm version của các tag tại thời điểm ghi
+# - Invalidate tag = đổi version (mốc time_ns), mọi entry mang tag đó tự thành miss
+# - Lúc ghi so version với mốc bắt đầu đọc dữ liệu: tag bị invalidate giữa chừng thì không lưu
+
+
+def _tag_key(tag):
+    return f"tag:{tag}"
+
+
+def _tag_versions(tags, init=None):
+    """Lấy version hiện tại của các tag, tag chưa có (hoặc bị evict) thì khởi tạo mới (mặc định là bây giờ)"""
+    keys = [_tag_key(t) for t in tags]
+    versions = dict(zip(tags, cache.get_many(*keys))) if keys else {}
+    for tag, version in versions.items():
+        if version is None:
+            versions[tag] = init or time.time_ns()
+            cache.set(_tag_key(tag), versions[tag], timeout=0)
+    return versions
+
+
+def invalidate_tags(*tags):
+    """Làm mất hiệu lực mọi entry mang một trong các tag"""
+    for tag in tags:
+        cache.set(_tag_key(tag), time.time_ns(), timeout=0)
+
+
+def get_tagged(key):
+    """Trả về value nếu entry còn và mọi tag của nó chưa bị invalidate"""
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    stored = entry["tags"]
+    if _tag_versions(list(stored)) != stored:
+        return None
+    return entry["value"]
+
+
+def set_tagged(key, value, tags, timeout=60, since=None):
+    """
+    since: time.time_ns() lấy TRƯỚC khi đọc dữ liệu. Nếu có tag bị invalidate sau mốc đó thì dữ liệu
+    có thể đã cũ -> không lưu, trả về False.
+    """
+    versions = _tag_versions(list(tags), init=since)
+    if since is not None and any(version > since for version in versions.values()):
+        return False
+    cache.set(key, {"value": value, "tags": versions}, timeout=timeout)
+    return True
+
+
+def normalized_query_key(prefix, defaults):
+    """
+    Cache key từ query string đã chuẩn hóa: chỉ giữ các tham số trong `defaults`,
+    điền giá trị mặc định và sắp xếp theo tên -> ?page=1 và không có page là một key
+    """
+    params = {name: request.args.get(name, default) for name, default in defaults.items()}
+    return prefix + "?" + "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+
+
+def cached_with_tags(key_func, tags_func, timeout=60):
+    """
+    Decorator cache response JSON (chỉ status 200) theo key_func(),
+    tags_func(payload) trả về danh sách tag của entry.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            key = key_func()
+            cached = get_tagged(key)
+            if cached is not None:
+                body, headers = cached
+                response = make_response(body)
+                response.headers.update(headers)
+                response.headers['X-Cache-Status'] = 'HIT'
+                return response
+
+            since = time.time_ns()
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                headers = {k: v for k, v in response.headers.items() if k not in ('Content-Length', 'Set-Cookie')}
+                set_tagged(key, (response.get_data(), headers), tags_func(response.get_json()), timeout, since)
+            response.headers['X-Cache-Status'] = 'MISS'
+            return response
+        return decorated
+    return decorator
@@ -0,0 +1,75 @@
+from collections import OrderedDict
+from flask import current_app
+from config import Config
+import hashlib
+import jwt
+import threading
+import time
+
+# Cache claims của JWT đã verify trong process:
+# - Key là digest của chuỗi token (không giữ token gốc), giới hạn LRU
+# - Entry hết hạn đúng lúc token hết hạn (claim exp)
+# - Chỉ thay jwt.decode, việc kiểm tra blacklist/token_version vẫn làm mỗi request
+
+
+def _digest(token):
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+class VerifiedTokenCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        key = _digest(token)
+        with self._lock:
+            claims = self._entries.get(key)
+            if claims is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return claims
+
+    def put(self, token, claims):
+        key = _digest(token)
+        with self._lock:
+            self._entries[key] = claims
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, token):
+        with self._lock:
+            self._entries.pop(_digest(token), None)
+
+    def stats(self):
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def init_token_cache(app):
+    app.extensions["token_cache"] = VerifiedTokenCache(app.config["VERIFIED_TOKEN_CACHE_SIZE"])
+
+
+def decode_token(token):
+    """
+    jwt.decode có cache, raise jwt.ExpiredSignatureError / jwt.InvalidTokenError như jwt.decode.
+    Claims trả về dùng chung giữa các request, không được sửa.
+    """
+    token_cache = current_app.extensions["token_cache"]
+    claims = token_cache.get(token)
+    if claims is not None:
+        if claims["exp"] <= time.time():
+            token_cache.discard(token)
+            raise jwt.ExpiredSignatureError("Signature has expired")
+        return claims
+
+    claims = jwt.decode(token, Config.SECRET_KEY, algorithms=["HS256"])
+    # Không có exp thì không biết khi nào bỏ entry -> không cache
+    if isinstance(claims.get("exp"), (int, float)):
+        token_cache.put(token, claims)
+    return claims
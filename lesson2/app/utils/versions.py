@@ -0,0 +1,33 @@
+from app.extension import db, cache
+from app.models import Book
+
+# Version nhỏ gọn của từng sách (row_version, updated_at) để trả lời
+# If-None-Match / If-Modified-Since mà không cần load và dựng payload
+
+
+def _version_key(book_id):
+    return f"book_version:{book_id}"
+
+
+def get_book_version(book_id):
+    """Trả về (row_version, updated_at) hoặc None nếu không có sách, cache theo id"""
+    key = _version_key(book_id)
+    version = cache.get(key)
+    if version is None:
+        row = db.session.query(Book.row_version, Book.updated_at).filter(Book.id == book_id).first()
+        if row is None:
+            return None
+        version = (row.row_version, row.updated_at)
+        cache.set(key, version, timeout=300)
+    return version
+
+
+def invalidate_book_version(book_id):
+    """Gọi sau mọi thao tác ghi làm đổi dòng sách"""
+    cache.delete(_version_key(book_id))
+
+
+def book_etag(book_id, row_version, updated_at):
+    # id + row_version chưa đủ: SQLite cấp lại id của sách vừa xóa cho sách mới (cũng v1),
+    # updated_at tới micro giây phân biệt hai dòng đó
+    return f"book-{book_id}-v{row_version}-{updated_at:%Y%m%d%H%M%S%f}"
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Benchmark checkout đồng thời: nhiều thread cùng mượn/trả một nhóm nhỏ sách "hot"
+- Kiểm tra không có double-loan (hai loan cùng active trên một sách):
+  mỗi loan giữ sách một khoảng ngẫu nhiên (--hold-ms) rồi mới trả, trong lúc giữ sách nằm trong `held`
+- Cuối cùng mọi thread cùng mượn mọi sách (không trả) rồi so loan active với trạng thái sách trong DB
+- In throughput theo từng cửa sổ để thấy có ổn định không
+
+Usage:
+    python bench_checkout.py                         # SQLite file (config 'benchmark')
+    python bench_checkout.py --config development    # Postgres trong docker-compose
+    python bench_checkout.py --ops 5000 --threads 32 --books 5
+"""
+
+import argparse
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from app import create_app
+from app.extension import db
+from app.models import Book, User, Loan
+from werkzeug.security import generate_password_hash
+
+
+def setup_data(app, n_books, n_users):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        password = generate_password_hash("bench123")
+        db.session.add(User(name="Admin", email="admin@bench.com", password=password, role="admin"))
+        for i in range(n_users):
+            db.session.add(User(name=f"Bench {i}", email=f"bench{i}@bench.com", password=password))
+        for i in range(n_books):
+            db.session.add(Book(title=f"Hot Book {i}", author="Bench"))
+        db.session.commit()
+        return [b.id for b in Book.query.all()]
+
+
+def login(client, email):
+    response = client.post("/auth/login", json={"email": email, "password": "bench123"})
+    return {"Authorization": f"Bearer {response.get_json()['access_token']}"}
+
+
+def run(args):
+    app = create_app(config_name=args.config)
+    book_ids = setup_data(app, args.books, args.users)
+
+    client = app.test_client()
+    admin_headers = login(client, "admin@bench.com")
+    user_headers = [login(client, f"bench{i}@bench.com") for i in range(args.users)]
+
+    held = set()
+    held_lock = threading.Lock()
+    stats = Counter()
+    completed = []
+
+    def one_op(_):
+        local_client = app.test_client()
+        book_id = random.choice(book_ids)
+        response = local_client.post("/loans/checkout", json={"book_id": book_id},
+                                     headers=random.choice(user_headers))
+        if response.status_code == 201:
+            with held_lock:
+                if book_id in held:
+                    stats["double_loans"] += 1
+                held.add(book_id)
+                stats["checkouts"] += 1
+            # Giữ sách một lúc: checkout khác thành công trong khoảng này là double-loan
+            time.sleep(random.uniform(0, args.hold_ms) / 1000)
+            # Bỏ khỏi held ngay TRƯỚC khi gửi request trả: tới lúc trả xong DB vẫn coi sách đang được mượn
+            with held_lock:
+                held.discard(book_id)
+            loan_id = response.get_json()["loan_id"]
+            local_client.put(f"/loans/return/{loan_id}", headers=admin_headers)
+        else:
+            outcome = "conflicts" if response.status_code == 409 else f"http_{response.status_code}"
+            with held_lock:
+                stats[outcome] += 1
+        completed.append(time.perf_counter())
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(one_op, range(args.ops)))
+    elapsed = time.perf_counter() - started
+
+    # Pha cuối: mọi thread cùng mượn mọi sách và không trả, mỗi sách phải còn đúng một loan active
+    barrier = threading.Barrier(args.threads)
+
+    def final_race(i):
+        local_client = app.test_client()
+        barrier.wait()
+        for book_id in random.sample(book_ids, len(book_ids)):
+            response = local_client.post("/loans/checkout", json={"book_id": book_id},
+                                         headers=user_headers[i % len(user_headers)])
+            if response.status_code == 201:
+                with held_lock:
+                    stats["final_checkouts"] += 1
+
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(final_race, range(args.threads)))
+
+    # Throughput theo cửa sổ
+    completed.sort()
+    window = max(1, args.ops // 10)
+    print(f"\n{'=' * 60}")
+    print(f"  {args.ops} checkout / {args.threads} threads / {args.books} sách hot")
+    print(f"{'=' * 60}")
+    previous = started
+    for i in range(window - 1, len(completed), window):
+        print(f"  ops {i + 1 - window:>6}-{i + 1:<6} {window / (completed[i] - previous):8.0f} ops/s")
+        previous = completed[i]
+    print(f"  Tổng: {args.ops / elapsed:.0f} ops/s trong {elapsed:.2f}s")
+    print(f"  {dict(stats)}")
+
+    with app.app_context():
+        active = Counter(book_id for (book_id,) in
+                         db.session.query(Loan.book_id).filter(Loan.return_date.is_(None)))
+        unavailable = {b.id for b in Book.query.filter_by(is_available=False)}
+    overlapping = {book_id: n for book_id, n in active.items() if n > 1}
+    ok = (not stats["double_loans"] and not overlapping and set(active) == unavailable
+          and stats["final_checkouts"] == len(book_ids))
+    print(f"  Double-loan: {stats['double_loans']}, sách có >1 loan active: {overlapping}")
+    print(f"  {'✓ Không có double-loan' if ok else '✗ Phát hiện double-loan / lệch trạng thái'}\n")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="benchmark")
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--books", type=int, default=5)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--hold-ms", type=float, default=5.0, help="Thời gian giữ sách tối đa trước khi trả (ms)")
+    sys.exit(0 if run(parser.parse_args()) else 1)
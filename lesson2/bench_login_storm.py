@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Benchmark "login storm": latency đọc catalog khi có một loạt login cùng lúc
+- Giả lập server có số worker thread cố định (như gunicorn gthread)
+- So sánh: không có storm / storm với hash trong worker / storm với hashing pool
+- Với pool: login vượt quá HASHING_MAX_PENDING bị 503 ngay, worker không bị giữ,
+  latency đọc catalog gần như không đổi
+
+Usage:
+    python bench_login_storm.py
+    python bench_login_storm.py --server-threads 8 --storm 16 --duration 5
+"""
+
+import argparse
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from app import create_app
+from app.extension import db
+from app.models import Book, User
+from app.utils.hashing import HashingService
+from werkzeug.security import generate_password_hash
+
+
+def setup_data(app, n_books):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(User(name="Storm", email="storm@bench.com",
+                            password=generate_password_hash("storm123", app.config["PASSWORD_HASH_METHOD"])))
+        db.session.add_all([Book(title=f"Catalog {i}", author=f"Author {i % 50}") for i in range(n_books)])
+        db.session.commit()
+
+
+def run_phase(app, args, label, hashing=None, storm=True):
+    if hashing is not None:
+        app.extensions["hashing"] = hashing
+    server = ThreadPoolExecutor(max_workers=args.server_threads)
+    stop = threading.Event()
+    latencies = []
+    logins = Counter()
+
+    def read_catalog():
+        client = app.test_client()
+        page = random.randint(1, max(1, args.books // 10))
+        client.get(f"/books/?page={page}&per_page=10")
+
+    def login():
+        response = app.test_client().post("/auth/login",
+                                          json={"email": "storm@bench.com", "password": "storm123"})
+        logins[response.status_code] += 1
+        return response.status_code
+
+    def storm_client():
+        # Client vòng kín: gửi login, chờ xong rồi gửi tiếp (bị 503 thì đợi ngắn hơn Retry-After)
+        while not stop.is_set():
+            if server.submit(login).result() == 503:
+                time.sleep(args.retry_delay)
+
+    storm_threads = [threading.Thread(target=storm_client) for _ in range(args.storm if storm else 0)]
+    for t in storm_threads:
+        t.start()
+
+    # Đọc catalog đều đặn, latency tính từ lúc gửi (gồm cả thời gian chờ worker rảnh)
+    deadline = time.perf_counter() + args.duration
+    pending = []
+    while time.perf_counter() < deadline:
+        submitted = time.perf_counter()
+        future = server.submit(read_catalog)
+        future.add_done_callback(lambda _, s=submitted: latencies.append(time.perf_counter() - s))
+        pending.append(future)
+        time.sleep(args.interval)
+    for future in pending:
+        future.result()
+    stop.set()
+    for t in storm_threads:
+        t.join()
+    server.shutdown()
+
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(f"  {label:<28} reads={len(latencies):<5} p50={p50:7.1f}ms  p95={p95:7.1f}ms  logins={dict(logins)}")
+    return p95
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="benchmark")
+    parser.add_argument("--books", type=int, default=1000)
+    parser.add_argument("--server-threads", type=int, default=8)
+    parser.add_argument("--storm", type=int, default=16, help="Số client login đồng thời")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--retry-delay", type=float, default=0.1, help="Client login đợi bao lâu sau 503")
+    parser.add_argument("--interval", type=float, default=0.02, help="Khoảng cách giữa 2 lần đọc catalog (giây)")
+    args = parser.parse_args()
+
+    app = create_app(config_name=args.config)
+    setup_data(app, args.books)
+    method = app.config["PASSWORD_HASH_METHOD"]
+
+    print(f"\n{'=' * 80}")
+    print(f"  Login storm: {args.storm} client, server {args.server_threads} thread, {method}")
+    print(f"{'=' * 80}")
+    run_phase(app, args, "Không có storm", storm=False)
+    run_phase(app, args, "Storm, hash trong worker", HashingService(0, 0, 0, method))
+    pool = HashingService(app.config["HASHING_WORKERS"], app.config["HASHING_MAX_PENDING"],
+                          app.config["HASHING_TIMEOUT"], method)
+    run_phase(app, args, "Storm, hashing pool", pool)
+    pool.shutdown()
+    print()
@@ -6,6 +6,81 @@ class Config:
     
     SECRET_KEY = "my-secret-key"
     
+    # Flask-Caching. SimpleCache chỉ nằm trong một process: khi chạy nhiều worker cần backend chung
+    # (vd CACHE_TYPE = "RedisCache", CACHE_REDIS_URL = "redis://localhost:6379/0"), nếu không thì
+    # đồng bộ thu hồi JWT giữa các worker (REVOCATION_*) và các invalidation khác chỉ có hiệu lực trong từng worker
+    CACHE_TYPE = os.environ.get("CACHE_TYPE", "SimpleCache")
+    CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL")
+    CACHE_DEFAULT_TIMEOUT = 300
+    
+    # Thời gian giữ tổng số dòng (COUNT) trong cache, được cập nhật cộng dồn khi ghi
+    COUNT_CACHE_TIMEOUT = 300
+    
+    # Search backend cho /books/author: auto | postgres | sqlite_fts | memory
+    SEARCH_BACKEND = "auto"
+    
+    # POST /books/bulk: số dòng mỗi batch insert và số lỗi tối đa trả về
+    BULK_IMPORT_BATCH_SIZE = 1000
+    BULK_IMPORT_MAX_ERRORS = 100
+    
+    # Số loan tối đa mỗi trang của GET /loans/
+    LOANS_MAX_PAGE_SIZE = 200
+    
+    # Số sách/loan tối đa mỗi request của /loans/checkout/batch và /loans/return/batch
+    LOANS_MAX_BATCH_SIZE = 50
+    
+    # Số dòng tối đa mỗi trang stream của /loans/overdue
+    LOANS_OVERDUE_PAGE_SIZE = 1000
+    
+    # Cache server-side của /loans/my-loans, được xóa khi loan của user thay đổi
+    MY_LOANS_CACHE_TIMEOUT = 600
+    
+    # flask archive-loans: chuyển loan đã trả quá N ngày sang loans_archive theo batch
+    LOANS_ARCHIVE_AFTER_DAYS = 365
+    LOANS_ARCHIVE_BATCH_SIZE = 1000
+    
+    # Cache principal (user đang đăng nhập) trong process cho token_required/admin_required
+    PRINCIPAL_CACHE_SIZE = 1024
+    PRINCIPAL_CACHE_TTL = 30
+    
+    # Bloom filter trước blacklist JWT: bucket theo giờ hết hạn, sức chứa/tỉ lệ false positive
+    # mỗi bucket, chu kỳ đồng bộ revoke từ cache chung giữa các worker
+    REVOCATION_BUCKET_SECONDS = 3600
+    REVOCATION_BLOOM_CAPACITY = 10000
+    REVOCATION_BLOOM_ERROR_RATE = 0.01
+    REVOCATION_SYNC_INTERVAL = 1.0
+    
+    # Số JWT đã verify được giữ claims trong process (LRU, hết hạn theo exp của token)
+    VERIFIED_TOKEN_CACHE_SIZE = 4096
+    
+    # Hash mật khẩu trong process pool riêng: số process, số việc chờ tối đa (quá thì 503),
+    # thời gian chờ tối đa (giây) và method/tham số hiện hành (hash cũ được rehash khi login)
+    HASHING_WORKERS = 2
+    HASHING_MAX_PENDING = 4
+    HASHING_TIMEOUT = 5
+    PASSWORD_HASH_METHOD = "scrypt:32768:8:1"
+    
+    # flask fold-loan-stats: số delta thống kê theo ngày gộp mỗi batch
+    LOAN_STATS_FOLD_BATCH_SIZE = 1000
+    
+    # flask purge-refresh-tokens: số family refresh token hết hạn xóa mỗi batch
+    REFRESH_TOKEN_GC_BATCH_SIZE = 1000
+    
+    # Rate limit token bucket theo blueprint hoặc endpoint (endpoint được ưu tiên):
+    # rate token mỗi per giây, tối đa burst token; key: ip | user | route
+    # RATELIMIT_STORAGE_URL = "redis://localhost:6379/0" để các worker dùng chung bucket (cần cài redis)
+    RATELIMIT_ENABLED = True
+    RATELIMIT_STORAGE_URL = None
+    RATELIMIT_MEMORY_SIZE = 10000
+    RATELIMIT_LIMITS = {
+        "auth": {"key": "ip", "rate": 30, "per": 60, "burst": 30},
+        "auth.login": {"key": "ip", "rate": 5, "per": 60, "burst": 10},
+        "books": {"key": "ip", "rate": 50, "per": 1, "burst": 100},
+        "books.get_books": {"key": "ip", "rate": 20, "per": 1, "burst": 40},
+        "loans": {"key": "user", "rate": 10, "per": 1, "burst": 30},
+        "users": {"key": "user", "rate": 10, "per": 1, "burst": 30},
+    }
+    
 class TestConfig(Config):
     """Config cho Testing"""
     TESTING = True
@@ -14,14 +89,28 @@ class TestConfig(Config):
     # Hoặc dùng file SQLite nếu muốn debug
     # SQLALCHEMY_DATABASE_URI = 'sqlite:///test.db'
     WTF_CSRF_ENABLED = False
+    SEARCH_BACKEND = "sqlite_fts"
+    # Hash ngay trong process, method rẻ cho test nhanh
+    HASHING_WORKERS = 0
+    PASSWORD_HASH_METHOD = "pbkdf2:sha256:1000"
+    # Test nào cần thì tự bật
+    RATELIMIT_ENABLED = False
     
     
 class DevelopmentConfig(Config):
     """Config cho Development"""
     DEBUG = True
     
+class BenchmarkConfig(Config):
+    """Config cho các script benchmark: SQLite file (nhiều connection, ghi đồng thời thật)"""
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///benchmark.db'
+    SQLALCHEMY_ENGINE_OPTIONS = {"connect_args": {"timeout": 30}}
+    SEARCH_BACKEND = "sqlite_fts"
+    RATELIMIT_ENABLED = False
+    
 config_by_name = {
     'testing': TestConfig,
     'development': DevelopmentConfig,
+    'benchmark': BenchmarkConfig,
 }
 
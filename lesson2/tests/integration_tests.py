@@ -198,7 +198,7 @@ class TestAPIIntegration(unittest.TestCase):
             content_type='application/json',
             headers={'Authorization': f'Bearer {user_token}'})
         
-        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.status_code, 409)
     
     # INTEGRATION TEST - Token Refresh
     def test_refresh_token_flow(self):
@@ -239,5 +239,787 @@ class TestAPIIntegration(unittest.TestCase):
         
         self.assertEqual(data1['data'], data2['data'])
 
+    # INTEGRATION TEST - Keyset pagination
+    def test_get_books_cursor_pagination(self):
+        """Test cursor-based pagination theo title, đi tới và đi lùi"""
+        with self.app.app_context():
+            for i in range(7):
+                db.session.add(Book(title=f"Title {i % 3}", author=f"Author {i}"))
+            db.session.commit()
+        
+        seen = []
+        url = '/books/?type=cursor&sort=title&limit=3'
+        pages = []
+        while url:
+            data = json.loads(self.client.get(url).data)
+            pages.append(data)
+            seen.extend((b['title'], b['id']) for b in data['data'])
+            url = data['links']['next']
+            url = url.replace('/books?', '/books/?') if url else None
+        
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(seen, sorted(seen))
+        
+        # Đi lùi từ trang cuối phải ra đúng trang trước đó
+        prev_cursor = pages[-1]['pagination']['prev_cursor']
+        response = self.client.get(f'/books/?type=cursor&sort=title&limit=3&cursor={prev_cursor}')
+        data = json.loads(response.data)
+        self.assertEqual(data['data'], pages[-2]['data'])
+    
+    def test_get_books_tampered_cursor(self):
+        """Test cursor bị sửa hoặc sai sort bị từ chối"""
+        with self.app.app_context():
+            for i in range(3):
+                db.session.add(Book(title=f"Book {i}", author="Author"))
+            db.session.commit()
+        
+        data = json.loads(self.client.get('/books/?type=cursor&limit=1').data)
+        cursor = data['pagination']['next_cursor']
+        
+        response = self.client.get(f'/books/?type=cursor&limit=1&cursor=x{cursor}')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(f'/books/?type=cursor&sort=title&limit=1&cursor={cursor}')
+        self.assertEqual(response.status_code, 400)
+
+    # INTEGRATION TEST - Count subsystem
+    def test_get_books_total_modes(self):
+        """Test tổng số sách được cập nhật cộng dồn và chế độ total=none"""
+        token = self.login_as_admin()
+        with self.app.app_context():
+            for i in range(5):
+                db.session.add(Book(title=f"Book {i}", author="Author"))
+            db.session.commit()
+        
+        data = json.loads(self.client.get('/books/?per_page=2').data)
+        self.assertEqual(data['pagination']['total_items'], 5)
+        self.assertEqual(data['pagination']['total_pages'], 3)
+        
+        self.client.post('/books/',
+            data=json.dumps({"title": "New Book", "author": "Author"}),
+            content_type='application/json',
+            headers={'Authorization': f'Bearer {token}'})
+        
+        data = json.loads(self.client.get('/books/?per_page=2&total=estimate').data)
+        self.assertEqual(data['pagination']['total_items'], 6)
+        
+        data = json.loads(self.client.get('/books/?per_page=2&total=none').data)
+        self.assertIsNone(data['pagination']['total_items'])
+        self.assertTrue(data['pagination']['has_next'])
+
+    def test_get_books_cache_invalidated_by_tags(self):
+        """Test cache get_books: HIT khi lặp lại, bị xóa đúng tag khi sách thay đổi"""
+        token = self.login_as_admin()
+        with self.app.app_context():
+            book = Book(title="Tagged", author="Author")
+            db.session.add(book)
+            db.session.commit()
+            book_id = book.id
+        
+        response = self.client.get('/books/?page=1')
+        self.assertEqual(response.headers['X-Cache-Status'], 'MISS')
+        # Query string khác nhưng chuẩn hóa giống nhau -> cùng entry
+        response = self.client.get('/books/?per_page=10&type=page')
+        self.assertEqual(response.headers['X-Cache-Status'], 'HIT')
+        
+        self.client.put(f'/books/{book_id}',
+            data=json.dumps({"is_available": False}),
+            content_type='application/json',
+            headers={'Authorization': f'Bearer {token}'})
+        
+        response = self.client.get('/books/')
+        self.assertEqual(response.headers['X-Cache-Status'], 'MISS')
+        self.assertFalse(json.loads(response.data)['data'][0]['is_available'])
+
+    # INTEGRATION TEST - Search index
+    def test_search_books_title_and_author(self):
+        """Test search theo cả title và author, author khớp được xếp trước"""
+        token = self.login_as_admin()
+        with self.app.app_context():
+            db.session.add(Book(title="Martin Eden", author="Jack London"))
+            db.session.add(Book(title="Clean Code", author="Robert C. Martin"))
+            db.session.add(Book(title="Refactoring", author="Martin Fowler"))
+            db.session.commit()
+        
+        data = json.loads(self.client.get('/books/author?name=martin').data)
+        self.assertEqual(data['pagination']['total_items'], 3)
+        self.assertEqual(data['data'][-1]['title'], "Martin Eden")
+        
+        # Sách thêm qua API được index ngay
+        self.client.post('/books/',
+            data=json.dumps({"title": "Domain-Driven Design", "author": "Eric Evans"}),
+            content_type='application/json',
+            headers={'Authorization': f'Bearer {token}'})
+        data = json.loads(self.client.get('/books/author?name=evans').data)
+        self.assertEqual([b['title'] for b in data['data']], ["Domain-Driven Design"])
+
+    def test_search_books_cache_normalized_and_invalidated(self):
+        """Test cache search: key chuẩn hóa, cache kết quả rỗng, xóa khi thêm sách"""
+        token = self.login_as_admin()
+        
+        response = self.client.get('/books/author?name=Martin')
+        self.assertEqual(response.headers['X-Cache-Status'], 'MISS')
+        self.assertEqual(json.loads(response.data)['data'], [])
+        response = self.client.get('/books/author?name=%20 MARTIN ')
+        self.assertEqual(response.headers['X-Cache-Status'], 'HIT')
+        
+        self.client.post('/books/',
+            data=json.dumps({"title": "Clean Code", "author": "Robert C. Martin"}),
+            content_type='application/json',
+            headers={'Authorization': f'Bearer {token}'})
+        
+        response = self.client.get('/books/author?name=martin')
+        self.assertEqual(response.headers['X-Cache-Status'], 'MISS')
+        self.assertEqual(len(json.loads(response.data)['data']), 1)
+
+    # INTEGRATION TEST - Conditional GET
+    def test_get_book_conditional_requests(self):
+        """Test ETag/Last-Modified theo row_version, 304 khi chưa đổi"""
+        token = self.login_as_admin()
+        with self.app.app_context():
+            book = Book(title="Versioned", author="Author")
+            db.session.add(book)
+            db.session.commit()
+            book_id = book.id
+        
+        response = self.client.get(f'/books/{book_id}')
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        
+        response = self.client.get(f'/books/{book_id}', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(f'/books/{book_id}', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+        
+        self.client.put(f'/books/{book_id}',
+            data=json.dumps({"title": "Versioned 2"}),
+            content_type='application/json',
+            headers={'Authorization': f'Bearer {token}'})
+        
+        response = self.client.get(f'/books/{book_id}', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(self.client.get('/books/9999').status_code, 404)
+
+        # SQLite cấp lại id của sách vừa xóa: ETag của sách cũ (cũng v1) không được khớp sách mới
+        admin_headers = {'Authorization': f'Bearer {token}'}
+        response = self.client.post('/books/', json={"title": "Deleted", "author": "Author"}, headers=admin_headers)
+        book_id = json.loads(response.data)['id']
+        etag = self.client.get(f'/books/{book_id}').headers['ETag']
+        self.client.delete(f'/books/{book_id}', headers=admin_headers)
+        response = self.client.post('/books/', json={"title": "Reused Id", "author": "Other"}, headers=admin_headers)
+        self.assertEqual(json.loads(response.data)['id'], book_id)
+        response = self.client.get(f'/books/{book_id}', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['title'], "Reused Id")
+
+    # INTEGRATION TEST - Collection ETag
+    def test_collection_etag_not_modified(self):
+        """Test 304 cho /books/ và /loans/active, ETag đổi khi có checkout"""
+        admin_token = self.login_as_admin()
+        user_token = self.login_as_user()
+        with self.app.app_context():
+            book = Book(title="Polled", author="Author")
+            db.session.add(book)
+            db.session.commit()
+            book_id = book.id
+        
+        etag = self.client.get('/books/').headers['ETag']
+        response = self.client.get('/books/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['Cache-Control'], 'public, max-age=60')
+        
+        admin_headers = {'Authorization': f'Bearer {admin_token}'}
+        loans_etag = self.client.get('/loans/active', headers=admin_headers).headers['ETag']
+        response = self.client.get('/loans/active', headers={**admin_headers, 'If-None-Match': loans_etag})
+        self.assertEqual(response.status_code, 304)
+        
+        self.client.post('/loans/checkout',
+            data=json.dumps({"book_id": book_id}),
+            content_type='application/json',
+            headers={'Authorization': f'Bearer {user_token}'})
+        
+        self.assertEqual(self.client.get('/books/', headers={'If-None-Match': etag}).status_code, 200)
+        response = self.client.get('/loans/active', headers={**admin_headers, 'If-None-Match': loans_etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data)), 1)
+
+        # Đổi tên sách: ETag mới phải đi kèm body mới, ETag cũ không được 304
+        loans_etag = response.headers['ETag']
+        self.client.put(f'/books/{book_id}', json={"title": "Polled v2"}, headers=admin_headers)
+        response = self.client.get('/loans/active', headers={**admin_headers, 'If-None-Match': loans_etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)[0]['book_title'], "Polled v2")
+
+    # INTEGRATION TEST - Bulk import
+    def test_bulk_import_ndjson_and_csv(self):
+        """Test import NDJSON/CSV theo batch, báo lỗi từng dòng"""
+        token = self.login_as_admin()
+        headers = {'Authorization': f'Bearer {token}'}
+        
+        ndjson = "\n".join([
+            json.dumps({"title": "Book A", "author": "Author A"}),
+            "not json",
+            json.dumps({"author": "No Title"}),
+            json.dumps({"title": "Book B", "is_available": False}),
+            json.dumps({"title": "Book C"}),
+        ])
+        response = self.client.post('/books/bulk?batch_size=2', data=ndjson,
+            content_type='application/x-ndjson', headers=headers)
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.data)
+        self.assertEqual(data['inserted'], 3)
+        self.assertEqual(data['batches'], 2)
+        self.assertEqual([e['line'] for e in data['errors']], [2, 3])
+        
+        csv_body = "title,author,is_available\nBook D,Author D,false\n,Missing,true\n"
+        response = self.client.post('/books/bulk', data=csv_body,
+            content_type='text/csv', headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['errors'][0]['line'], 3)
+        
+        # Cache tổng và search được làm mới sau import
+        data = json.loads(self.client.get('/books/').data)
+        self.assertEqual(data['pagination']['total_items'], 4)
+        data = json.loads(self.client.get('/books/author?name=author d').data)
+        self.assertFalse(data['data'][0]['is_available'])
+        
+        # Byte không phải UTF-8 và giá trị không phải scalar là lỗi từng dòng, không phải 500
+        body = b'{"title": "bad \xff"}\n{"title": ["x"]}\n{"title": "Book E"}\n'
+        response = self.client.post('/books/bulk', data=body,
+            content_type='application/x-ndjson', headers=headers)
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.data)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual([e['line'] for e in data['errors']], [1, 2])
+
+    # INTEGRATION TEST - Export
+    def test_export_books_and_loans(self):
+        """Test export NDJSON, CSV và gzip"""
+        import gzip
+        token = self.login_as_admin()
+        headers = {'Authorization': f'Bearer {token}'}
+        with self.app.app_context():
+            for i in range(3):
+                db.session.add(Book(title=f"Book {i}", author="Author"))
+            db.session.commit()
+            user = User.query.filter_by(email="user@test.com").first()
+            db.session.add(Loan(book_id=1, user_id=user.id))
+            db.session.commit()
+        
+        response = self.client.get('/books/export', headers=headers)
+        lines = response.data.decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])['title'], "Book 0")
+        
+        response = self.client.get('/books/export?format=csv',
+            headers={**headers, 'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        rows = gzip.decompress(response.data).decode().splitlines()
+        self.assertEqual(rows[0], "id,title,author,is_available")
+        self.assertEqual(len(rows), 4)
+        
+        response = self.client.get('/loans/export', headers=headers)
+        loan = json.loads(response.data.decode().splitlines()[0])
+        self.assertEqual(loan['book_id'], 1)
+        self.assertIsNone(loan['return_date'])
+
+    # INTEGRATION TEST - Sparse fieldsets
+    def test_sparse_fieldsets(self):
+        """Test ?fields= trả đúng tập field, luôn có khóa chính, chặn field ngoài allow-list"""
+        token = self.login_as_admin()
+        headers = {'Authorization': f'Bearer {token}'}
+        with self.app.app_context():
+            db.session.add(Book(title="Sparse", author="Author"))
+            db.session.commit()
+            user = User.query.filter_by(email="user@test.com").first()
+            db.session.add(Loan(book_id=1, user_id=user.id))
+            db.session.commit()
+        
+        data = json.loads(self.client.get('/books/?fields=title').data)
+        self.assertEqual(data['data'], [{"id": 1, "title": "Sparse"}])
+        data = json.loads(self.client.get('/books/author?name=spa&fields=author').data)
+        self.assertEqual(data['data'], [{"id": 1, "author": "Author"}])
+        
+        data = json.loads(self.client.get('/loans/?fields=book_title,user_name', headers=headers).data)
+        self.assertEqual(data['data'], [{"loan_id": 1, "book_title": "Sparse", "user_name": "User"}])
+        
+        data = json.loads(self.client.get('/users/?fields=email', headers=headers).data)
+        self.assertEqual(set(data[0]), {"id", "email"})
+        response = self.client.get('/users/?fields=password', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    # INTEGRATION TEST - Loans listing
+    def test_get_loans_filters_and_keyset(self):
+        """Test GET /loans/ lọc phía server và phân trang keyset theo checkout_date"""
+        from datetime import date
+        token = self.login_as_admin()
+        headers = {'Authorization': f'Bearer {token}'}
+        with self.app.app_context():
+            user = User.query.filter_by(email="user@test.com").first()
+            book = Book(title="Loaned", author="Author")
+            db.session.add(book)
+            db.session.commit()
+            for day in (5, 3, 1, 4):
+                db.session.add(Loan(book_id=book.id, user_id=user.id, checkout_date=date(2024, 1, day)))
+            db.session.add(Loan(book_id=book.id, user_id=user.id,
+                                checkout_date=date(2024, 1, 2), return_date=date(2024, 1, 9)))
+            db.session.commit()
+        
+        url = '/loans/?sort=checkout_date&limit=2&active=true&from=2024-01-02'
+        data = json.loads(self.client.get(url, headers=headers).data)
+        self.assertEqual([l['checkout_date'] for l in data['data']], ["2024-01-03", "2024-01-04"])
+        self.assertEqual(data['data'][0]['book_title'], "Loaned")
+        
+        cursor = data['pagination']['next_cursor']
+        data = json.loads(self.client.get(f'{url}&cursor={cursor}', headers=headers).data)
+        self.assertEqual([l['checkout_date'] for l in data['data']], ["2024-01-05"])
+        self.assertFalse(data['pagination']['has_next'])
+        
+        response = self.client.get('/loans/?from=yesterday', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    # INTEGRATION TEST - Stale-while-revalidate
+    def test_active_loans_stale_while_revalidate(self):
+        """Test quá soft TTL thì trả bản cũ ngay và refresh ở thread nền"""
+        import time
+        from app.extension import cache
+        from app.utils.swr_cache import join_refresh
+        token = self.login_as_admin()
+        headers = {'Authorization': f'Bearer {token}'}
+        
+        response = self.client.get('/loans/active', headers=headers)
+        self.assertEqual(response.headers['X-Cache-Status'], 'MISS')
+        self.assertEqual(self.client.get('/loans/active', headers=headers).headers['X-Cache-Status'], 'HIT')
+        
+        with self.app.app_context():
+            user = User.query.filter_by(email="user@test.com").first()
+            book = Book(title="Background", author="Author", is_available=False)
+            db.session.add(book)
+            db.session.commit()
+            db.session.add(Loan(book_id=book.id, user_id=user.id))
+            db.session.commit()
+            # Giả lập hết soft TTL
+            entry = cache.get("swr:loans_active")
+            entry["fresh_until"] = time.time() - 1
+            cache.set("swr:loans_active", entry)
+        
+        response = self.client.get('/loans/active', headers=headers)
+        self.assertEqual(response.headers['X-Cache-Status'], 'STALE')
+        self.assertEqual(json.loads(response.data), [])
+        join_refresh("loans_active", timeout=5)
+        
+        response = self.client.get('/loans/active', headers=headers)
+        self.assertEqual(response.headers['X-Cache-Status'], 'HIT')
+        self.assertEqual(len(json.loads(response.data)), 1)
+
+    def test_loan_reports_evicted_on_book_rename(self):
+        """Đổi tên sách thì /loans/active và /users/all-loans-v2 không còn trả tên cũ"""
+        admin_headers = {'Authorization': f'Bearer {self.login_as_admin()}'}
+        user_headers = {'Authorization': f'Bearer {self.login_as_user()}'}
+        with self.app.app_context():
+            book = Book(title="Old Title", author="Author")
+            db.session.add(book)
+            db.session.commit()
+            book_id = book.id
+        self.client.post('/loans/checkout', json={"book_id": book_id}, headers=user_headers)
+
+        for url in ('/loans/active', '/users/all-loans-v2'):
+            self.client.get(url, headers=admin_headers)
+            self.assertEqual(self.client.get(url, headers=admin_headers).headers['X-Cache-Status'], 'HIT')
+
+        self.client.put(f'/books/{book_id}', json={"title": "New Title"}, headers=admin_headers)
+
+        active = json.loads(self.client.get('/loans/active', headers=admin_headers).data)
+        self.assertEqual([loan['book_title'] for loan in active], ["New Title"])
+        report = json.loads(self.client.get('/users/all-loans-v2', headers=admin_headers).data)
+        titles = [loan['book_title'] for user in report for loan in user['loans']]
+        self.assertEqual(titles, ["New Title"])
+
+    def test_checkout_twice_conflicts(self):
+        """Mượn cùng một sách hai lần: lần sau 409, chỉ có một loan active"""
+        user_token = self.login_as_user()
+        headers = {'Authorization': f'Bearer {user_token}'}
+        
+        with self.app.app_context():
+            book = Book(title="Hot", author="Author")
+            db.session.add(book)
+            db.session.commit()
+            book_id = book.id
+        
+        first = self.client.post('/loans/checkout', json={"book_id": book_id}, headers=headers)
+        second = self.client.post('/loans/checkout', json={"book_id": book_id}, headers=headers)
+        missing = self.client.post('/loans/checkout', json={"book_id": 99999}, headers=headers)
+        
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 409)
+        self.assertEqual(json.loads(second.data)['code'], 'BOOK_UNAVAILABLE')
+        self.assertEqual(missing.status_code, 404)
+        with self.app.app_context():
+            self.assertEqual(Loan.query.filter_by(book_id=book_id, return_date=None).count(), 1)
+            self.assertEqual(db.session.get(Book, book_id).row_version, 2)
+
+    def test_batch_checkout_and_return(self):
+        """Mượn/trả nhiều sách trong một request, sách không mượn được nằm trong failed"""
+        user_headers = {'Authorization': f'Bearer {self.login_as_user()}'}
+        admin_headers = {'Authorization': f'Bearer {self.login_as_admin()}'}
+        
+        with self.app.app_context():
+            books = [Book(title=f"Batch {i}", author="Author") for i in range(3)]
+            books[2].is_available = False
+            db.session.add_all(books)
+            db.session.commit()
+            book_ids = [b.id for b in books]
+        
+        response = self.client.post('/loans/checkout/batch',
+            json={"book_ids": book_ids + [book_ids[0], 99999]}, headers=user_headers)
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.data)
+        self.assertEqual([l['book_id'] for l in data['loans']], book_ids[:2])
+        self.assertEqual(data['failed'], [
+            {"book_id": book_ids[2], "code": "BOOK_UNAVAILABLE"},
+            {"book_id": 99999, "code": "BOOK_NOT_FOUND"},
+        ])
+        
+        # Mượn lại: không sách nào còn trống
+        response = self.client.post('/loans/checkout/batch',
+            json={"book_ids": book_ids[:2]}, headers=user_headers)
+        self.assertEqual(response.status_code, 409)
+        
+        loan_ids = [l['loan_id'] for l in data['loans']]
+        response = self.client.put('/loans/return/batch',
+            json={"loan_ids": loan_ids}, headers=admin_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['returned'], sorted(loan_ids))
+        
+        response = self.client.put('/loans/return/batch',
+            json={"loan_ids": loan_ids[:1]}, headers=admin_headers)
+        self.assertEqual(json.loads(response.data)['failed'],
+                         [{"loan_id": loan_ids[0], "code": "ALREADY_RETURNED"}])
+        
+        with self.app.app_context():
+            self.assertTrue(db.session.get(Book, book_ids[0]).is_available)
+            self.assertEqual(Loan.query.filter_by(return_date=None).count(), 0)
+        
+        response = self.client.post('/loans/checkout/batch',
+            json={"book_ids": []}, headers=user_headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_my_loans_cache_evicted_on_loan_change(self):
+        """my-loans được cache nhưng mượn/trả/đổi tên sách làm mất hiệu lực ngay"""
+        user_headers = {'Authorization': f'Bearer {self.login_as_user()}'}
+        admin_headers = {'Authorization': f'Bearer {self.login_as_admin()}'}
+        
+        with self.app.app_context():
+            book = Book(title="Cached", author="Author")
+            db.session.add(book)
+            db.session.commit()
+            book_id = book.id
+        
+        response = self.client.get('/loans/my-loans', headers=user_headers)
+        self.assertEqual(json.loads(response.data)['loans'], [])
+        self.assertEqual(self.client.get('/loans/my-loans', headers=user_headers).headers['X-Cache-Status'], 'HIT')
+        
+        response = self.client.post('/loans/checkout', json={"book_id": book_id}, headers=user_headers)
+        loan_id = json.loads(response.data)['loan_id']
+        response = self.client.get('/loans/my-loans', headers=user_headers)
+        self.assertEqual(response.headers['X-Cache-Status'], 'MISS')
+        self.assertEqual(len(json.loads(response.data)['loans']), 1)
+        
+        self.client.put(f'/books/{book_id}', json={"title": "Renamed"}, headers=admin_headers)
+        response = self.client.get('/loans/my-loans', headers=user_headers)
+        self.assertEqual(json.loads(response.data)['loans'][0]['book_title'], "Renamed")
+        
+        self.client.put(f'/loans/return/{loan_id}', headers=admin_headers)
+        response = self.client.get('/loans/my-loans', headers=user_headers)
+        self.assertEqual(response.headers['X-Cache-Status'], 'MISS')
+        self.assertNotEqual(json.loads(response.data)['loans'][0]['return_date'], "Chưa trả")
+
+    def test_overdue_loans_stream_and_cursor(self):
+        """Chỉ loan chưa trả quá N ngày, theo (checkout_date, loan_id), cursor ở header"""
+        from datetime import date, timedelta
+        headers = {'Authorization': f'Bearer {self.login_as_admin()}'}
+        today = date.today()
+        with self.app.app_context():
+            user = User.query.filter_by(email="user@test.com").first()
+            book = Book(title="Overdue", author="Author")
+            db.session.add(book)
+            db.session.commit()
+            for days_ago, returned in [(30, False), (20, False), (20, True), (25, False), (3, False)]:
+                db.session.add(Loan(book_id=book.id, user_id=user.id,
+                                    checkout_date=today - timedelta(days=days_ago),
+                                    return_date=today if returned else None))
+            db.session.commit()
+        
+        response = self.client.get('/loans/overdue?days=14&limit=2', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([r['checkout_date'] for r in rows],
+                         [str(today - timedelta(days=30)), str(today - timedelta(days=25))])
+        self.assertEqual(rows[0]['user_email'], "user@test.com")
+        
+        cursor = response.headers['X-Next-Cursor']
+        response = self.client.get(f'/loans/overdue?days=14&limit=2&cursor={cursor}', headers=headers)
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([r['checkout_date'] for r in rows], [str(today - timedelta(days=20))])
+        self.assertNotIn('X-Next-Cursor', response.headers)
+        
+        response = self.client.get('/loans/overdue?cursor=bad', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_loan_stats_rollups(self):
+        """Rollup được cập nhật khi mượn/trả/xóa, rebuild cho kết quả giống hệt"""
+        from datetime import date, timedelta
+        from app.utils.rollups import rebuild_rollups
+        user_headers = {'Authorization': f'Bearer {self.login_as_user()}'}
+        admin_headers = {'Authorization': f'Bearer {self.login_as_admin()}'}
+        today = date.today()
+        with self.app.app_context():
+            books = [Book(title=f"Stats {i}", author="Author") for i in range(3)]
+            db.session.add_all(books)
+            db.session.commit()
+            book_ids = [b.id for b in books]
+        
+        loan_id = json.loads(self.client.post('/loans/checkout', json={"book_id": book_ids[0]},
+                                              headers=user_headers).data)['loan_id']
+        self.client.post('/loans/checkout/batch', json={"book_ids": book_ids[1:]}, headers=user_headers)
+        self.client.put(f'/loans/return/{loan_id}', headers=admin_headers)
+        # Trả lại lần nữa không được cộng thêm vào rollup
+        self.assertEqual(self.client.put(f'/loans/return/{loan_id}', headers=admin_headers).status_code, 400)
+        self.assertEqual(self.client.put('/loans/return/999999', headers=admin_headers).status_code, 404)
+        self.client.post('/loans/checkout', json={"book_id": book_ids[0]}, headers=user_headers)
+
+        stats = json.loads(self.client.get('/loans/stats', headers=admin_headers).data)
+        self.assertEqual((stats['checkouts'], stats['returns'], stats['avg_loan_days']), (4, 1, 0))
+        top = json.loads(self.client.get('/loans/stats/top-books?limit=1', headers=admin_headers).data)
+        self.assertEqual(top, [{"book_id": book_ids[0], "title": "Stats 0", "checkouts": 2}])
+        borrowers = json.loads(self.client.get('/loans/stats/top-borrowers', headers=admin_headers).data)
+        self.assertEqual([b['checkouts'] for b in borrowers], [4])
+        
+        self.client.delete(f'/loans/{loan_id}', headers=admin_headers)
+        daily = json.loads(self.client.get('/loans/stats/daily', headers=admin_headers).data)
+        self.assertEqual(daily, [{"day": str(today), "checkouts": 3, "returns": 0, "avg_loan_days": None}])
+
+        # Gộp delta vào loan_daily_stats không làm đổi kết quả đọc
+        with self.app.app_context():
+            from app.models import LoanStatDelta
+            from app.utils.rollups import fold_loan_stats
+            self.assertEqual(fold_loan_stats(batch_size=2), 5)
+            self.assertEqual(LoanStatDelta.query.count(), 0)
+        self.assertEqual(json.loads(self.client.get('/loans/stats/daily', headers=admin_headers).data), daily)
+
+        # Lịch sử có sẵn trước khi có rollup -> backfill bằng rebuild
+        with self.app.app_context():
+            user = User.query.filter_by(email="user@test.com").first()
+            db.session.add(Loan(book_id=book_ids[2], user_id=user.id,
+                                checkout_date=today - timedelta(days=10), return_date=today - timedelta(days=3)))
+            db.session.commit()
+            rebuild_rollups()
+        
+        stats = json.loads(self.client.get('/loans/stats', headers=admin_headers).data)
+        self.assertEqual((stats['checkouts'], stats['returns'], stats['avg_loan_days']), (4, 1, 7))
+        daily = json.loads(self.client.get('/loans/stats/daily', headers=admin_headers).data)
+        self.assertEqual(len(daily), 3)
+        self.assertEqual(self.client.get('/loans/stats?from=bad', headers=admin_headers).status_code, 400)
+
+    def test_archive_returned_loans(self):
+        """Loan trả lâu chuyển sang loans_archive, read path chỉ thấy lại khi include_archived"""
+        from datetime import date, timedelta
+        from app.models import LoanArchive
+        from app.utils.archive import archive_returned_loans
+        from app.utils.rollups import rebuild_rollups
+        user_headers = {'Authorization': f'Bearer {self.login_as_user()}'}
+        admin_headers = {'Authorization': f'Bearer {self.login_as_admin()}'}
+        today = date.today()
+        with self.app.app_context():
+            user = User.query.filter_by(email="user@test.com").first()
+            user_id = user.id
+            book = Book(title="Old", author="Author")
+            db.session.add(book)
+            db.session.commit()
+            for days_ago in (400, 380, 10):
+                db.session.add(Loan(book_id=book.id, user_id=user_id,
+                                    checkout_date=today - timedelta(days=days_ago + 5),
+                                    return_date=today - timedelta(days=days_ago)))
+            db.session.add(Loan(book_id=book.id, user_id=user_id, checkout_date=today - timedelta(days=500)))
+            db.session.commit()
+        
+        self.assertEqual(len(json.loads(self.client.get('/loans/my-loans', headers=user_headers).data)['loans']), 4)
+        
+        with self.app.app_context():
+            self.assertEqual(archive_returned_loans(older_than_days=365, batch_size=1), 2)
+            self.assertEqual(LoanArchive.query.count(), 2)
+            self.assertEqual(Loan.query.count(), 2)
+            rebuild_rollups()
+        
+        response = self.client.get('/loans/my-loans', headers=user_headers)
+        self.assertEqual(response.headers['X-Cache-Status'], 'MISS')
+        self.assertEqual(len(json.loads(response.data)['loans']), 2)
+        response = self.client.get('/loans/my-loans?include_archived=true', headers=user_headers)
+        self.assertEqual(len(json.loads(response.data)['loans']), 4)
+        response = self.client.get(f'/users/{user_id}/loans?include_archived=1', headers=admin_headers)
+        self.assertEqual(len(json.loads(response.data)['loans']), 4)
+        response = self.client.get('/users/all-loans-v2?include_archived=1', headers=admin_headers)
+        self.assertEqual(sum(len(u['loans']) for u in json.loads(response.data)), 4)
+        response = self.client.get('/loans/export?include_archived=true', headers=admin_headers)
+        loan_ids = [json.loads(line)['loan_id'] for line in response.data.decode().splitlines()]
+        self.assertEqual(loan_ids, sorted(loan_ids))
+        self.assertEqual(len(loan_ids), 4)
+        
+        # Rollup vẫn tính cả lịch sử đã archive
+        response = self.client.get(f'/loans/stats?from={today - timedelta(days=600)}', headers=admin_headers)
+        self.assertEqual(json.loads(response.data)['checkouts'], 4)
+
+    def test_principal_cache_invalidation(self):
+        """Principal được cache theo (user_id, token_version), đổi role/logout-all có hiệu lực ngay"""
+        response = self.client.post('/auth/login', json={"email": "user@test.com", "password": "user123"})
+        tokens = json.loads(response.data)
+        user_headers = {'Authorization': f'Bearer {tokens["access_token"]}'}
+        admin_headers = {'Authorization': f'Bearer {self.login_as_admin()}'}
+        principal_cache = self.app.extensions['principal_cache']
+        
+        self.client.get('/users/me', headers=user_headers)
+        hits = principal_cache.hits
+        self.client.get('/users/me', headers=user_headers)
+        self.assertEqual(principal_cache.hits, hits + 1)
+        self.assertEqual(self.client.get('/loans/active', headers=user_headers).status_code, 403)
+        
+        with self.app.app_context():
+            user_id = User.query.filter_by(email="user@test.com").first().id
+        self.client.put(f'/users/{user_id}', json={"role": "admin"}, headers=admin_headers)
+        self.assertEqual(self.client.get('/loans/active', headers=user_headers).status_code, 200)
+        
+        self.client.put('/users/me', json={"name": "Renamed"}, headers=user_headers)
+        self.assertEqual(json.loads(self.client.get('/users/me', headers=user_headers).data)['name'], "Renamed")
+        
+        self.assertEqual(self.client.post('/auth/logout-all', headers=user_headers).status_code, 200)
+        self.assertEqual(self.client.get('/users/me', headers=user_headers).status_code, 401)
+
+    def test_logout_revokes_tokens(self):
+        """Logout đưa access/refresh token vào blacklist, các token khác vẫn dùng được"""
+        tokens = json.loads(self.client.post('/auth/login',
+            json={"email": "user@test.com", "password": "user123"}).data)
+        headers = {'Authorization': f'Bearer {tokens["access_token"]}'}
+        other_headers = {'Authorization': f'Bearer {self.login_as_user()}'}
+        
+        response = self.client.post('/auth/logout', json={"refresh_token": tokens["refresh_token"]}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/users/me', headers=headers).status_code, 401)
+        self.assertEqual(self.client.post('/auth/refresh', json={"refresh_token": tokens["refresh_token"]}).status_code, 401)
+        self.assertEqual(self.client.get('/users/me', headers=other_headers).status_code, 200)
+        # Refresh token không dùng được làm Bearer (kể cả sau logout)
+        refresh_headers = {'Authorization': f'Bearer {tokens["refresh_token"]}'}
+        self.assertEqual(self.client.get('/users/me', headers=refresh_headers).status_code, 401)
+        
+        report = self.app.extensions['revocation'].report()
+        self.assertGreaterEqual(report['definite_negatives'], 1)
+        # Chỉ access token vào blacklist, refresh token bị thu hồi theo family
+        self.assertEqual(sum(b['items'] for b in report['buckets'].values()), 1)
+
+    def test_login_rehash_and_busy_hashing(self):
+        """Hash cũ được thay khi login đúng, pool quá tải thì login trả 503 ngay"""
+        from app.utils.hashing import HashingService
+        response = self.client.post('/auth/login', json={"email": "user@test.com", "password": "user123"})
+        self.assertEqual(response.status_code, 200)
+        with self.app.app_context():
+            stored = User.query.filter_by(email="user@test.com").first().password
+        self.assertTrue(stored.startswith(self.app.config['PASSWORD_HASH_METHOD'] + "$"))
+        self.assertEqual(self.client.post('/auth/login',
+            json={"email": "user@test.com", "password": "user123"}).status_code, 200)
+        
+        self.app.extensions['hashing'] = HashingService(1, 0, 5, self.app.config['PASSWORD_HASH_METHOD'])
+        response = self.client.post('/auth/login', json={"email": "user@test.com", "password": "user123"})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+    def test_auth_resolved_once_per_request(self):
+        """before_request decode token + lấy principal đúng một lần, decorator chỉ kiểm tra policy"""
+        tokens = json.loads(self.client.post('/auth/login',
+            json={"email": "user@test.com", "password": "user123"}).data)
+        headers = {'Authorization': f'Bearer {tokens["access_token"]}'}
+        token_cache = self.app.extensions['token_cache']
+        principal_cache = self.app.extensions['principal_cache']
+
+        decodes = token_cache.hits + token_cache.misses
+        lookups = principal_cache.hits + principal_cache.misses
+        response = self.client.post('/auth/logout', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(token_cache.hits + token_cache.misses, decodes + 1)
+        self.assertEqual(principal_cache.hits + principal_cache.misses, lookups + 1)
+
+        # Token hỏng không chặn route công khai, chỉ route cần đăng nhập trả 401
+        bad_headers = {'Authorization': 'Bearer not-a-token'}
+        self.assertEqual(self.client.get('/books/', headers=bad_headers).status_code, 200)
+        response = self.client.get('/users/me', headers=bad_headers)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.data)['error'], "Token không hợp lệ")
+
+        # admin_required giờ cũng kiểm tra token_version
+        admin_headers = {'Authorization': f'Bearer {self.login_as_admin()}'}
+        self.assertEqual(self.client.post('/auth/logout-all', headers=admin_headers).status_code, 200)
+        self.assertEqual(self.client.get('/loans/active', headers=admin_headers).status_code, 401)
+
+    def test_rate_limit_sheds_before_work(self):
+        """Hết token thì 429 ngay, không tới bước hash mật khẩu; bucket theo user tách riêng"""
+        from app.utils.hashing import HashingService
+        user_headers = {'Authorization': f'Bearer {self.login_as_user()}'}
+        admin_headers = {'Authorization': f'Bearer {self.login_as_admin()}'}
+        self.app.config['RATELIMIT_ENABLED'] = True
+        self.app.config['RATELIMIT_LIMITS'] = {
+            "auth.login": {"key": "ip", "rate": 1, "per": 60, "burst": 2},
+            "users": {"key": "user", "rate": 1, "per": 60, "burst": 1},
+        }
+        # Pool luôn từ chối: login tới bước hash sẽ trả 503 và tăng rejected
+        hashing = self.app.extensions['hashing'] = HashingService(1, 0, 5, self.app.config['PASSWORD_HASH_METHOD'])
+        credentials = {"email": "user@test.com", "password": "user123"}
+        
+        response = self.client.post('/auth/login', json=credentials)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['RateLimit-Limit'], '2')
+        self.assertEqual(response.headers['RateLimit-Remaining'], '1')
+        self.assertEqual(self.client.post('/auth/login', json=credentials).status_code, 503)
+        response = self.client.post('/auth/login', json=credentials)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['RateLimit-Remaining'], '0')
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+        self.assertEqual(hashing.report()['rejected'], 2)
+        
+        self.assertEqual(self.client.get('/users/me', headers=user_headers).status_code, 200)
+        self.assertEqual(self.client.get('/users/me', headers=user_headers).status_code, 429)
+        self.assertEqual(self.client.get('/users/me', headers=admin_headers).status_code, 200)
+        # Blueprint không cấu hình limit thì không có header
+        self.assertNotIn('RateLimit-Limit', self.client.get('/books/').headers)
+        self.assertEqual(self.app.extensions['rate_limiter'].report()['limited'], 2)
+
+    def test_refresh_token_rotation_and_reuse(self):
+        """Refresh trả token mới cùng family, dùng lại token cũ thì thu hồi cả family"""
+        tokens = json.loads(self.client.post('/auth/login',
+            json={"email": "user@test.com", "password": "user123"}).data)
+        first = tokens['refresh_token']
+        
+        response = self.client.post('/auth/refresh', json={"refresh_token": first})
+        self.assertEqual(response.status_code, 200)
+        second = json.loads(response.data)['refresh_token']
+        self.assertNotEqual(second, first)
+        access = json.loads(response.data)['access_token']
+        self.assertEqual(self.client.get('/users/me', headers={'Authorization': f'Bearer {access}'}).status_code, 200)
+        
+        # Token cũ bị dùng lại -> cả family bị thu hồi, token mới nhất cũng hết dùng được
+        response = self.client.post('/auth/refresh', json={"refresh_token": first})
+        self.assertEqual(response.status_code, 401)
+        self.assertIn("đã được sử dụng", json.loads(response.data)['error'])
+        self.assertEqual(self.client.post('/auth/refresh', json={"refresh_token": second}).status_code, 401)
+        
+        # Phiên khác không bị ảnh hưởng, cho tới khi logout-all
+        other = json.loads(self.client.post('/auth/login',
+            json={"email": "user@test.com", "password": "user123"}).data)
+        response = self.client.post('/auth/refresh', json={"refresh_token": other['refresh_token']})
+        self.assertEqual(response.status_code, 200)
+        rotated = json.loads(response.data)
+        self.client.post('/auth/logout-all', headers={'Authorization': f'Bearer {rotated["access_token"]}'})
+        self.assertEqual(self.client.post('/auth/refresh',
+            json={"refresh_token": rotated['refresh_token']}).status_code, 401)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
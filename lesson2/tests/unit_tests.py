@@ -119,5 +119,277 @@ class TestModels(unittest.TestCase):
         self.assertEqual(len(book.loans), 1)
         self.assertEqual(len(user.loans), 1)
 
+    # UNIT TEST cho in-memory search index
+    def test_memory_search_index(self):
+        """Test inverted index trigram: tìm, xếp hạng và cập nhật khi sách đổi"""
+        from app.utils.search import MemorySearch
+        db.session.add_all([
+            Book(title="Martin Eden", author="Jack London"),
+            Book(title="Clean Code", author="Robert C. Martin"),
+        ])
+        db.session.commit()
+        
+        search = MemorySearch()
+        search.ensure_ready()
+        ids = search.search("martin", 10, 0)
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(Book.query.get(ids[0]).title, "Clean Code")
+        
+        book = Book.query.filter_by(title="Martin Eden").first()
+        book.title = "The Call of the Wild"
+        search.index_book(book)
+        self.assertEqual(search.count("martin"), 1)
+        search.remove_book(ids[0])
+        self.assertEqual(search.count("martin"), 0)
+
+    # UNIT TEST cho search cache
+    def test_search_cache_serves_stale_while_locked(self):
+        """Test khi worker khác đang tính lại thì trả bản cũ thay vì query DB"""
+        from app.extension import cache
+        from app.utils.search_cache import get_or_compute, bump_generation
+        
+        value, status = get_or_compute("k", lambda: "v1")
+        self.assertEqual((value, status), ("v1", "MISS"))
+        
+        bump_generation()
+        cache.add("lock:k", True)
+        value, status = get_or_compute("k", lambda: "v2")
+        self.assertEqual((value, status), ("v1", "STALE"))
+        
+        cache.delete("lock:k")
+        value, status = get_or_compute("k", lambda: "v2")
+        self.assertEqual((value, status), ("v2", "MISS"))
+        
+        # Key generation bị evict sau khi sách đổi: không được quay về generation cũ
+        value, status = get_or_compute("fresh", lambda: "old")
+        bump_generation()
+        cache.delete("search_gen")
+        value, status = get_or_compute("fresh", lambda: "new")
+        self.assertEqual((value, status), ("new", "MISS"))
+
+    # UNIT TEST cho tag cache
+    def test_set_tagged_skips_when_invalidated_during_read(self):
+        """Tag bị invalidate sau mốc bắt đầu đọc thì không lưu bản có thể đã cũ"""
+        import time
+        from app.utils.tag_cache import get_tagged, set_tagged, invalidate_tags
+        since = time.time_ns()
+        self.assertTrue(set_tagged("page", "v1", ["books:list", "book:1"], since=since))
+        self.assertEqual(get_tagged("page"), "v1")
+        
+        since = time.time_ns()
+        invalidate_tags("book:1")  # sách đổi trong lúc view đang query
+        self.assertFalse(set_tagged("page", "stale", ["books:list", "book:1"], since=since))
+        self.assertIsNone(get_tagged("page"))
+
+    # UNIT TEST cho cache tổng số dòng có filter
+    def test_filtered_count_generation_survives_eviction(self):
+        """Generation bị evict không làm sống lại key tổng có filter đã hết hiệu lực"""
+        from app.extension import cache
+        from app.utils.counts import count_key, invalidate_filtered_totals
+        stale_key = count_key("books", {"author": "x"})
+        invalidate_filtered_totals("books")
+        self.assertNotEqual(count_key("books", {"author": "x"}), stale_key)
+        cache.delete("count_gen:books")
+        self.assertNotEqual(count_key("books", {"author": "x"}), stale_key)
+
+    def test_adjust_total_recounts_instead_of_incrementing(self):
+        """Thêm/bớt dòng thì tổng được đếm lại, key đã hết hạn không bị tạo lại chỉ với delta"""
+        from app.extension import cache
+        from app.utils.counts import adjust_total, get_total
+        db.session.add_all([Book(title=f"Count {i}") for i in range(3)])
+        db.session.commit()
+        self.assertEqual(get_total(Book.query, "books"), 3)
+        
+        db.session.add(Book(title="Count 3"))
+        db.session.commit()
+        adjust_total("books", 1)
+        self.assertEqual(get_total(Book.query, "books"), 4)
+        
+        cache.delete("count:books")  # hết COUNT_CACHE_TIMEOUT
+        adjust_total("books", 1)
+        self.assertIsNone(cache.get("count:books"))
+
+    # UNIT TEST cho Bloom filter thu hồi token
+    def test_revocation_filter_sync_between_workers(self):
+        """Không có false negative, worker khác thấy revoke sau khi sync từ cache chung"""
+        import time
+        from app.utils.revocation import BloomFilter, RevocationFilter
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"jti-{i}")
+        self.assertTrue(all(f"jti-{i}" in bloom for i in range(1000)))
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives / 10000, 0.03)
+        
+        worker_a = RevocationFilter(3600, 1000, 0.01, sync_interval=0)
+        worker_b = RevocationFilter(3600, 1000, 0.01, sync_interval=0)
+        exp = time.time() + 900
+        self.assertFalse(worker_b.is_revoked("jti-x", exp))
+        worker_a.revoke("jti-x", exp)
+        worker_a.revoke("jti-y", exp + 7200)
+        self.assertTrue(worker_b.is_revoked("jti-x", exp))
+        self.assertTrue(worker_b.is_revoked("jti-y", exp + 7200))
+        self.assertFalse(worker_b.is_revoked("jti-z", exp))
+        
+        # Worker mới khởi động nạp lại toàn bộ log còn hạn
+        worker_c = RevocationFilter(3600, 1000, 0.01, sync_interval=0)
+        self.assertTrue(worker_c.is_revoked("jti-y", exp + 7200))
+        self.assertEqual(worker_c.report()["synced_seq"], 2)
+
+    # UNIT TEST cho cache claims JWT
+    def test_decode_token_cache(self):
+        """Token hợp lệ chỉ verify một lần, entry hết hạn theo exp, token sai vẫn bị từ chối"""
+        import time
+        import jwt
+        from config import Config
+        from app.utils.token_cache import decode_token
+        token_cache = self.app.extensions['token_cache']
+        token = jwt.encode({"user_id": 1, "exp": int(time.time()) + 60}, Config.SECRET_KEY, algorithm="HS256")
+        
+        self.assertEqual(decode_token(token)["user_id"], 1)
+        self.assertEqual(decode_token(token)["user_id"], 1)
+        self.assertEqual((token_cache.hits, token_cache.misses), (1, 1))
+        
+        token_cache.get(token)["exp"] = time.time() - 1
+        with self.assertRaises(jwt.ExpiredSignatureError):
+            decode_token(token)
+        self.assertIsNone(token_cache.get(token))
+        with self.assertRaises(jwt.InvalidTokenError):
+            decode_token(token[:-2] + "xx")
+
+    # UNIT TEST cho pool hash mật khẩu
+    def test_hashing_service_rejects_when_saturated(self):
+        """Hash/verify chạy trong process pool, quá số việc chờ thì HashingBusy ngay"""
+        import threading
+        import time
+        from app.utils.hashing import HashingService, HashingBusy
+        service = HashingService(workers=1, max_pending=1, timeout=10, method="pbkdf2:sha256:1000")
+        try:
+            stored = service.hash_password("secret")
+            self.assertTrue(stored.startswith("pbkdf2:sha256:1000$"))
+            self.assertTrue(service.verify_password(stored, "secret"))
+            self.assertFalse(service.verify_password(stored, "wrong"))
+            
+            busy = threading.Thread(target=service.run, args=(time.sleep, 0.5))
+            busy.start()
+            time.sleep(0.1)
+            started = time.time()
+            with self.assertRaises(HashingBusy):
+                service.hash_password("other")
+            self.assertLess(time.time() - started, 0.1)
+            busy.join()
+            self.assertEqual(service.report()["rejected"], 1)
+            self.assertIsNone(service.rehash_if_needed(stored, "secret"))
+            self.assertIsNotNone(service.rehash_if_needed("scrypt:32768:8:1$x$y", "secret"))
+            
+            # Quá timeout: việc vẫn chạy trong process con nên vẫn chiếm chỗ tới khi xong
+            service.timeout = 0.1
+            with self.assertRaises(HashingBusy):
+                service.run(time.sleep, 0.5)
+            self.assertEqual(service.report()["pending"], 1)
+            with self.assertRaises(HashingBusy):
+                service.hash_password("other")
+            self.assertEqual(service.report()["rejected"], 2)
+            deadline = time.time() + 5
+            while service.report()["pending"] and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(service.report()["pending"], 0)
+        finally:
+            service.shutdown()
+
+    # UNIT TEST cho rate limit token bucket
+    def test_token_bucket_stores(self):
+        """Bucket cho burst request rồi nạp lại theo rate, backend chung nguyên tử qua script"""
+        import threading
+        import time
+        from app.utils.rate_limit import MemoryBucketStore, RedisBucketStore, take_token
+        
+        tokens, allowed, retry_after, reset_after = take_token(None, None, 100.0, rate=2, burst=3)
+        self.assertEqual((tokens, allowed, reset_after), (2, True, 0.5))
+        tokens, allowed, retry_after, _ = take_token(0.5, 100.0, 100.0, rate=2, burst=3)
+        self.assertEqual((allowed, retry_after), (False, 0.25))
+        self.assertEqual(take_token(0, 100.0, 105.0, rate=2, burst=3)[0], 2)
+        
+        class FakeRedis:
+            """Giả lập Redis: script chạy dưới một lock như Redis chạy script một luồng"""
+            def __init__(self):
+                self.data = {}
+                self.lock = threading.Lock()
+            
+            def register_script(self, source):
+                def script(keys, args):
+                    with self.lock:
+                        state = self.data.get(keys[0], (None, None))
+                        now = time.time()
+                        tokens, allowed, retry_after, reset_after = take_token(*state, now, *args)
+                        self.data[keys[0]] = (tokens, now)
+                        return [int(allowed), str(tokens).encode(), str(retry_after).encode(),
+                                str(reset_after).encode()]
+                return script
+        
+        for store in (MemoryBucketStore(maxsize=100), RedisBucketStore(FakeRedis())):
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(store.take("ip:1", 0.01, 5)))
+                       for _ in range(20)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(sum(1 for r in results if r[0]), 5)
+            self.assertTrue(store.take("ip:2", 0.01, 5)[0])
+
+    # UNIT TEST cho family refresh token
+    def test_refresh_token_family_gc(self):
+        """Rotate là CAS theo jti hiện hành, family hết hạn bị xóa theo batch"""
+        from datetime import datetime, timedelta
+        from app.models import RefreshTokenFamily
+        from app.utils.refresh_tokens import start_family, rotate_family, purge_expired_families
+        later = datetime.utcnow() + timedelta(days=7)
+        family_id = start_family(1, "jti-1", later)
+        for i in range(5):
+            start_family(1, f"old-{i}", datetime.utcnow() - timedelta(seconds=1))
+        db.session.commit()
+        
+        self.assertTrue(rotate_family(family_id, "jti-1", "jti-2", later))
+        self.assertFalse(rotate_family(family_id, "jti-1", "jti-3", later))
+        db.session.commit()
+        
+        self.assertEqual(purge_expired_families(batch_size=2), 5)
+        self.assertEqual([f.current_jti for f in RefreshTokenFamily.query.all()], ["jti-2"])
+
+    # UNIT TEST cho row_version của Book
+    def test_book_row_version_concurrent_write(self):
+        """Ghi ORM sau khi dòng đã đổi bởi request khác vẫn thành công, row_version tăng trong UPDATE"""
+        from app.utils.checkout import claim_books
+        book = Book(title="Versioned", author="A")
+        db.session.add(book)
+        db.session.commit()
+        self.assertEqual(book.row_version, 1)
+        
+        book.title  # entity đã load, sau đó request khác đổi dòng bằng Core UPDATE
+        db.session.execute(db.text("UPDATE books SET row_version = row_version + 1 WHERE id = :id"), {"id": book.id})
+        book.title = "Renamed"
+        db.session.commit()
+        self.assertEqual(book.row_version, 3)
+        self.assertEqual(claim_books([book.id]), {book.id})
+        db.session.commit()
+        self.assertEqual(db.session.get(Book, book.id).row_version, 4)
+
+    def test_add_missing_book_columns(self):
+        """Bảng books cũ (chưa có updated_at/row_version) được thêm cột lúc khởi động"""
+        from app.utils.schema import add_missing_columns
+        db.session.remove()
+        with db.engine.begin() as connection:
+            connection.execute(db.text("DROP TABLE books"))
+            connection.execute(db.text(
+                "CREATE TABLE books (id INTEGER PRIMARY KEY, title VARCHAR NOT NULL, author VARCHAR, is_available BOOLEAN)"))
+            connection.execute(db.text("INSERT INTO books (title, author, is_available) VALUES ('Old', 'A', 1)"))
+            add_missing_columns(connection)
+            add_missing_columns(connection)
+        
+        book = Book.query.one()
+        self.assertEqual(book.row_version, 1)
+        self.assertIsNotNone(book.updated_at)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file